@@ -0,0 +1,123 @@
+"""Load test of event streams served by the ASGI application (sunflower.async_server).
+
+Open many idle event-stream connections, then publish an update and measure
+the time needed to deliver it to every connection.
+
+Two modes:
+- in-process (default): the ASGI application is called directly with fake
+  connections and updates are injected in its fan-out, so that neither a
+  server nor Redis is needed. Memory allocated per connection is reported
+  with --memory.
+- --url: connections are opened against a running server, e.g.
+  uvicorn asgi:application --port 8001. Updates are published by the
+  scheduler: the test waits for next "updated" event.
+  Process limit of open files must be raised (ulimit -n).
+
+Usage: python benchmarks/event_streams.py [--connections N] [--memory] [--url URL]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sunflower import settings
+from sunflower.async_server import app, get_fanout
+from sunflower.core.fanout import ChannelState
+
+
+class FakeConnection:
+    """Client of an event stream, calling the ASGI application directly."""
+
+    def __init__(self, path):
+        self.scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": []}
+        self.disconnected = asyncio.Event()
+        self.events = 0
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.body" and message["body"].startswith(b"data:"):
+            self.events += 1
+
+
+async def run_in_process(connections, trace_memory):
+    fanout = get_fanout()
+    fanout.start = lambda: None # states are injected below instead of Redis task
+    endpoint = settings.CHANNELS[0]
+    fanout.update([ChannelState(endpoint, 1, {}, {"current_station": "A"})])
+
+    if trace_memory:
+        tracemalloc.start()
+    start = perf_counter()
+    clients = [FakeConnection(f"/api/channels/{endpoint}/events/") for _ in range(connections)]
+    tasks = [asyncio.ensure_future(app(client.scope, client.receive, client.send)) for client in clients]
+    await asyncio.sleep(0)
+    while sum(fanout._clients.values()) < connections:
+        await asyncio.sleep(0.01)
+    duration = perf_counter() - start
+    if trace_memory:
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{connections} connections opened in {duration:.2f}s (memory tracing enabled), {memory / connections / 1024:.1f} KiB per connection")
+    else:
+        print(f"{connections} connections opened in {duration:.2f}s")
+
+    start = perf_counter()
+    fanout.update([ChannelState(endpoint, 2, {}, {"current_station": "B"})])
+    while not all(client.events for client in clients):
+        await asyncio.sleep(0.001)
+    print(f"update delivered to all connections in {(perf_counter() - start) * 1000:.1f}ms")
+
+    for client in clients:
+        client.disconnected.set()
+    await asyncio.gather(*tasks)
+    assert all(client.events == 1 for client in clients)
+
+
+async def open_stream(url, received):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    writer.write(f"GET {parts.path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    async for line in reader:
+        if line.startswith(b"data:"):
+            received.append(perf_counter())
+            break
+    writer.close()
+
+
+async def run_against_server(url, connections):
+    received = []
+    start = perf_counter()
+    tasks = []
+    for _ in range(connections):
+        tasks.append(asyncio.ensure_future(open_stream(url, received)))
+        if len(tasks) % 500 == 0:
+            await asyncio.sleep(0.1) # don't overflow listen backlog
+    print(f"{connections} connections opened in {perf_counter() - start:.2f}s, waiting for next update...")
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if received:
+        print(f"update received by {len(received)} connections within {(max(received) - min(received)) * 1000:.1f}ms")
+    if errors:
+        print(f"{len(errors)} connections failed, e.g.: {errors[0]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=20000)
+    parser.add_argument("--memory", action="store_true", help="measure memory per connection (in-process mode, slower)")
+    parser.add_argument("--url", help="url of an event stream of a running ASGI server")
+    args = parser.parse_args()
+    if args.url is None:
+        asyncio.run(run_in_process(args.connections, args.memory))
+    else:
+        asyncio.run(run_against_server(args.url, args.connections))
@@ -0,0 +1,100 @@
+"""Benchmark of song library search (sunflower.core.library.SearchIndex).
+
+Index members of a synthetic library are kept in a sorted list, and prefix
+lookups are made with bisect, as ZLEXCOUNT and ZRANGEBYLEX do in Redis: time
+of lookups and ranking is reported for a few queries ("in-process" column).
+
+If a Redis server is running, the library is also indexed in Redis and
+SearchIndex.search() is timed end to end, with ZLEXCOUNT, ZRANGEBYLEX and
+HMGET round trips ("redis" column), as well as an update of the unchanged library
+(one HKEYS, made at each library scan).
+
+Usage: python benchmarks/library_search.py [number_of_songs]
+"""
+
+import os
+import random
+import sys
+from bisect import bisect_left
+from timeit import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+
+from sunflower.core.library import SearchIndex, tokenize
+from sunflower.core.types import Song
+
+SYLLABLES = ["ma", "ri", "é", "lo", "tou", "sol", "pa", "ven", "ro", "se", "chan", "son", "nuit", "jour", "ciel"]
+QUERIES = ("touso", "chanson nuit", "Ma", "ventouse rose", "xyz")
+
+
+def word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+
+def get_redis_connection():
+    connection = redis.Redis()
+    try:
+        connection.ping()
+    except redis.ConnectionError:
+        return None
+    return connection
+
+
+def main(number_of_songs):
+    rng = random.Random(0)
+    artists = [" ".join(word(rng) for _ in range(rng.randint(1, 2))).title() for _ in range(number_of_songs // 10)]
+    songs = [
+        Song(f"/library/{i}.opus", rng.choice(artists), word(rng).title(), " ".join(word(rng) for _ in range(rng.randint(1, 4))), 180)
+        for i in range(number_of_songs)
+    ]
+    members_by_song = {
+        SearchIndex.song_id(song): SearchIndex.members(SearchIndex.song_id(song), {"artist": song.artist, "album": song.album, "title": song.title})
+        for song in songs
+    }
+    members = sorted(set().union(*members_by_song.values()))
+
+    def search(query, max_candidates=5000):
+        # rarest word gives candidates, other words are checked against them
+        bounds = {}
+        for word_ in set(tokenize(query)):
+            start = bisect_left(members, word_)
+            bounds[word_] = start, bisect_left(members, word_ + "￿", start)
+        words = sorted(bounds, key=lambda word_: bounds[word_][1] - bounds[word_][0])
+        if not words:
+            return []
+        start, end = bounds[words[0]]
+        matches = {words[0]: members[start:min(end, start + max_candidates)]}
+        candidates = {member.split("\x00")[2] for member in matches[words[0]]}
+        candidate_members = [member for song_id in candidates for member in members_by_song[song_id]]
+        for word_ in words[1:]:
+            matches[word_] = [member for member in candidate_members if member.startswith(word_)]
+        return SearchIndex.rank(words, matches, limit=20)
+
+    index = None
+    connection = get_redis_connection()
+    if connection is not None:
+        index = SearchIndex("benchmark")
+        connection.delete(index.tokens_key, index.songs_key)
+        index.update(songs)
+    print(f"{number_of_songs} songs, {len(members)} index members, times in ms" + ("" if index else " (Redis not running: round trips not measured)"))
+    print(f"{'query':<18} {'results':>7} {'in-process':>11} {'redis':>8}")
+    iterations = 100
+    try:
+        for query in QUERIES:
+            duration = timeit(lambda: search(query), number=iterations) / iterations * 1000
+            redis_duration = ""
+            if index is not None:
+                redis_duration = f"{timeit(lambda: index.search(query), number=iterations) / iterations * 1000:.3f}"
+            print(f"{query!r:<18} {len(search(query)):>7} {duration:>11.3f} {redis_duration:>8}")
+        if index is not None:
+            duration = timeit(lambda: index.update(songs), number=10) / 10 * 1000
+            print(f"update of unchanged library: {duration:.3f}ms")
+    finally:
+        if index is not None:
+            connection.delete(index.tokens_key, index.songs_key)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,94 @@
+"""Benchmark of codecs used for data stored in Redis.
+
+Compare encoding and decoding costs of channel metadata and card info with
+each available codec (see sunflower.core.codecs), and the former linear
+MetadataType lookup with as_metadata_type. If a Redis server is running,
+memory used by a key (MEMORY USAGE) is also reported.
+
+Usage: python benchmarks/persistence_codecs.py [number_of_iterations]
+"""
+
+import os
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+
+from sunflower.core.codecs import CODECS, get_codec
+from sunflower.core.types import MetadataEncoder, MetadataType, as_metadata_type
+
+METADATA = {
+    "station": "France Culture",
+    "type": MetadataType.PROGRAMME,
+    "end": 1600000000,
+    "show_title": "La Méthode scientifique",
+    "show_url": "https://www.franceculture.fr/emissions/la-methode-scientifique",
+    "diffusion_title": "Comment les abeilles voient-elles le monde ?",
+    "diffusion_url": "https://www.franceculture.fr/emissions/la-methode-scientifique/comment-les-abeilles",
+    "diffusion_summary": "Les abeilles perçoivent les ultraviolets et la lumière polarisée. " * 3,
+    "thumbnail_src": "https://cdn.radiofrance.fr/s3/cruiser-production/2019/08/methode.jpg",
+}
+
+INFO = {
+    "current_thumbnail": METADATA["thumbnail_src"],
+    "current_station": '<a target="_blank" class="" href="https://www.franceculture.fr">France Culture</a>',
+    "current_broadcast_title": METADATA["diffusion_title"],
+    "current_show_title": METADATA["show_title"],
+    "current_broadcast_summary": METADATA["diffusion_summary"],
+}
+
+
+def former_as_metadata_type(mapping):
+    """as_metadata_type before O(1) lookup (linear scan of MetadataType)."""
+    type_ = mapping.get("type")
+    if type_ is None:
+        return mapping
+    for member in MetadataType:
+        if type_ == member.value:
+            mapping["type"] = MetadataType(type_)
+            break
+    return mapping
+
+
+def get_redis_connection():
+    connection = redis.Redis()
+    try:
+        connection.ping()
+    except redis.ConnectionError:
+        return None
+    return connection
+
+
+def main(iterations):
+    connection = get_redis_connection()
+    print(f"{iterations} iterations, times per operation in µs" + ("" if connection else " (Redis not running: memory not measured)"))
+    print(f"{'codec':<10} {'data':<9} {'size (B)':>9} {'encode':>8} {'decode':>8} {'redis (B)':>10}")
+    for name in CODECS:
+        try:
+            codec = get_codec(name, MetadataEncoder, as_metadata_type)
+        except RuntimeError as err:
+            print(f"{name:<10} skipped: {err}")
+            continue
+        for label, value in (("metadata", METADATA), ("info", INFO)):
+            data = codec.encode(value)
+            encode_time = timeit(lambda: codec.encode(value), number=iterations) / iterations * 1e6
+            decode_time = timeit(lambda: codec.decode(data), number=iterations) / iterations * 1e6
+            memory = ""
+            if connection is not None:
+                key = f"sunflower:benchmark:{name}:{label}"
+                connection.set(key, data)
+                memory = connection.memory_usage(key)
+                connection.delete(key)
+            print(f"{name:<10} {label:<9} {len(data):>9} {encode_time:>8.2f} {decode_time:>8.2f} {memory:>10}")
+
+    print("\nMetadataType lookup (json object_hook), µs per call:")
+    for label, hook in (("former", former_as_metadata_type), ("current", as_metadata_type)):
+        for type_ in (MetadataType.MUSIC, MetadataType.WAITING_FOR_FOLLOWING):
+            duration = timeit(lambda: hook({"type": type_.value}), number=iterations) / iterations * 1e6
+            print(f"{label:<8} {type_.name:<22} {duration:.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,75 @@
+"""Benchmark of playlist ordering functions.
+
+Compare sunflower.utils.functions.prevent_consecutive_artists (applied after
+a random.sample() as done in former PycolorePlaylistStation) with space_artists
+on generated libraries.
+
+Usage: python benchmarks/playlist_ordering.py [number_of_songs ...]
+"""
+
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# when an artist has more than half of the songs, prevent_consecutive_artists
+# becomes quadratic (about 30 s for 10k songs), skip it above this size
+FORMER_MAX_SONGS_WHEN_DOMINATED = 10000
+
+from sunflower.core.types import Song
+from sunflower.utils.functions import prevent_consecutive_artists, space_artists
+
+
+def generate_songs(number_of_songs, rng, dominant_share=0):
+    """Generate songs whose artists follow a Zipf-like distribution (few big artists, many small ones).
+
+    If dominant_share is given, first artist gets this share of the songs.
+    """
+    number_of_artists = max(number_of_songs // 12, 2)
+    weights = [1 / rank for rank in range(1, number_of_artists + 1)]
+    if dominant_share:
+        weights[0] = dominant_share / (1 - dominant_share) * sum(weights[1:])
+    artists = rng.choices(range(number_of_artists), weights, k=number_of_songs)
+    return [Song(f"/songs/{i}.opus", f"artist-{artist}", "", f"song-{i}", 200.0) for (i, artist) in enumerate(artists)]
+
+
+def count_violations(songs, min_gap):
+    """Return number of songs played less than min_gap songs after another song of the same artist."""
+    last_positions = {}
+    violations = 0
+    for (i, song) in enumerate(songs):
+        if i - last_positions.get(song.artist, -min_gap - 1) <= min_gap:
+            violations += 1
+        last_positions[song.artist] = i
+    return violations
+
+
+def run(number_of_songs, rng, dominant_share=0):
+    songs = generate_songs(number_of_songs, rng, dominant_share)
+    label = f"{number_of_songs:>7} songs, dominant artist {dominant_share:>4.0%}"
+
+    if dominant_share > 0.5 and number_of_songs > FORMER_MAX_SONGS_WHEN_DOMINATED:
+        print(f"{label}  prevent_consecutive_artists  skipped (quadratic)")
+    else:
+        start = perf_counter()
+        former = prevent_consecutive_artists(rng.sample(songs, len(songs)))
+        former_duration = perf_counter() - start
+        print(f"{label}  prevent_consecutive_artists  {former_duration:8.3f}s"
+              f"  violations gap=1: {count_violations(former, 1)}")
+
+    for min_gap in (1, 3):
+        start = perf_counter()
+        spaced = space_artists(songs, min_gap, rng=rng)
+        duration = perf_counter() - start
+        print(f"{label}  space_artists(min_gap={min_gap})    {duration:8.3f}s"
+              f"  violations gap={min_gap}: {count_violations(spaced, min_gap)}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 30000, 100000]
+    rng = random.Random(0)
+    for dominant_share in (0, 0.4, 0.6):
+        for size in sizes:
+            run(size, rng, dominant_share)
@@ -1,3 +1,5 @@
+import os
+
 import click
 from click.exceptions import Exit
 from sunflower.utils.cli import (
@@ -9,8 +11,9 @@ from sunflower.utils.cli import (
     stop_scheduler,
     stop_liquidsoap,
 )
-from sunflower.core.functions import write_liquidsoap_config
+from sunflower.core.functions import write_liquidsoap_config, migrate_persistent_attributes, LiquidsoapConfigChange
 from sunflower.channels import tournesol, music
+from sunflower.utils.assets import compress_static
 
 
 @click.group()
@@ -21,26 +24,37 @@ def sunflower():
     )
 
 
-def start_or_restart_component(component, restart=False):
+def start_or_restart_component(component, restart=False, workers=0):
     if component in ("radio", "all"):
         start_liquidsoap(restart)
     if component in ("scheduler", "all"):
-        start_scheduler(restart)
+        start_scheduler(restart, workers)
     success_cli()
 
 
+workers_option = click.option(
+    "-w",
+    "--workers",
+    default=0,
+    help="number of scheduler workers (0 for a single scheduler); channels sharing a dynamic station are processed by one worker, the others take over if it dies",
+    show_default=True,
+)
+
+
 @sunflower.command()
 @click.argument("component")
-def start(component):
+@workers_option
+def start(component, workers):
     """Start sunflower component(s). Possible components: scheduler / radio / all (bot)."""
-    start_or_restart_component(component)
+    start_or_restart_component(component, workers=workers)
 
 
 @sunflower.command()
 @click.argument("component")
-def restart(component):
+@workers_option
+def restart(component, workers):
     """Restart sunflower component(s). Possible components: scheduler / radio / all (both)."""
-    start_or_restart_component(component, restart=True)
+    start_or_restart_component(component, restart=True, workers=workers)
 
 
 @sunflower.command()
@@ -72,11 +86,39 @@ def generate_liquidsoap_config(filename):
     """Generate config file for liquidsoap."""
     click.secho("Création du fichier {}.liq...".format(filename), fg="cyan", bold=True)
     try:
-        write_liquidsoap_config(music, tournesol, filename=filename)
+        change = write_liquidsoap_config(music, tournesol, filename=filename)
+    except Exception as err:
+        abort_cli(err)
+    if change == LiquidsoapConfigChange.NONE:
+        success_cli("Aucun changement.")
+    if change == LiquidsoapConfigChange.TIMETABLE:
+        success_cli(
+            "Fichier mis à jour. Seules les tables d'horaires ont changé : "
+            "redémarrer le scheduler suffit (sunflower restart scheduler), sans coupure du flux."
+        )
+    success_cli("Fichier créé. La structure a changé : liquidsoap doit être redémarré (sunflower restart radio).")
+
+
+
+@sunflower.command()
+def migrate_persistent_data():
+    """Convert data stored in Redis to codec set in settings (PERSISTENCE_CODEC)."""
+    click.secho("Conversion des données stockées dans Redis...", fg="cyan", bold=True)
+    try:
+        converted = migrate_persistent_attributes(music, tournesol)
     except Exception as err:
         abort_cli(err)
-    success_cli("Fichier créé")
+    success_cli("{} clé(s) convertie(s).".format(converted))
 
+@sunflower.command()
+def compress_static_files():
+    """Build hashed and precompressed copies of static files (after npm run build)."""
+    click.secho("Compression des fichiers statiques...", fg="cyan", bold=True)
+    try:
+        manifest = compress_static(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sunflower/static/dist"))
+    except Exception as err:
+        abort_cli(err)
+    success_cli("{} fichier(s) traité(s).".format(len(manifest)))
 
 if __name__ == "__main__":
     sunflower()
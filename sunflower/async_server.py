@@ -0,0 +1,236 @@
+# This file is part of sunflower package. radio
+# This module contains ASGI application serving read-only API and event streams with asyncio.
+
+import asyncio
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from sunflower import settings
+from sunflower.core.codecs import decode
+from sunflower.core.fanout import AsyncUpdatesFanout, ChannelState, format_update_event, is_newer
+from sunflower.core.types import MetadataEncoder
+
+# clients share one reader of Redis streams per process, created in event loop
+# of server (at lifespan startup) because it holds asyncio objects
+_fanout: Optional[AsyncUpdatesFanout] = None
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def get_fanout() -> AsyncUpdatesFanout:
+    """Return fanout of current process, creating it if server doesn't send lifespan events."""
+    global _fanout
+    if _fanout is None:
+        _fanout = AsyncUpdatesFanout()
+    return _fanout
+
+
+def format_channel_state(state: ChannelState) -> Dict[str, Any]:
+    return {"metadata": state.metadata, "info": state.info, "version": state.version}
+
+
+def format_now_playing(states: Iterable[ChannelState]) -> Tuple[str, Dict[str, Any]]:
+    """Return combined version and now playing data, as server.get_now_playing() does."""
+    states = list(states)
+    version = ".".join(str(state.version) for state in states)
+    return version, {"version": version, "channels": {state.endpoint: format_channel_state(state) for state in states}}
+
+
+async def send_response(send, status: int, body: bytes = b"", content_type: Optional[bytes] = None, headers: Headers = ()):
+    headers = [(b"cache-control", b"no-cache"), *headers]
+    if content_type is not None:
+        headers.append((b"content-type", content_type))
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def without_body(send):
+    """Wrap send to answer HEAD requests.
+
+    Headers are sent as for GET (content-length included), but body is dropped
+    and response ends with first body message.
+    """
+    complete = False
+
+    async def send_headers(message):
+        nonlocal complete
+        if message["type"] == "http.response.body":
+            if complete:
+                return
+            complete = True
+            message = {"type": "http.response.body", "body": b"", "more_body": False}
+        await send(message)
+    return send_headers
+
+
+async def send_json(send, data: Any, status: int = 200, headers: Headers = ()):
+    await send_response(send, status, json.dumps(data, cls=MetadataEncoder).encode(), b"application/json", headers)
+
+
+async def send_event_stream(receive, send, events):
+    """Send events (async iterator of str) until client disconnects."""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+    })
+
+    async def stream():
+        async for event in events:
+            await send({"type": "http.response.body", "body": event.encode(), "more_body": True})
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await events.aclose()
+
+
+# API views
+
+async def now_playing(scope, receive, send):
+    """Metadata and card info of all channels, with combined version as ETag."""
+    version, data = format_now_playing((await get_fanout().get_states(settings.CHANNELS)).values())
+    etag = f'"{version}"'.encode()
+    if_none_match = dict(scope["headers"]).get(b"if-none-match", b"")
+    if etag in (tag.strip() for tag in if_none_match.split(b",")):
+        await send_response(send, 304, headers=[(b"etag", etag)])
+    else:
+        await send_json(send, data, headers=[(b"etag", etag)])
+
+
+async def now_playing_stream(scope, receive, send):
+    """Send now playing data of all channels at connection and at each update."""
+    async def events():
+        states = {}
+        async for changed in get_fanout().listen(settings.CHANNELS):
+            states.update(changed)
+            if not changed or len(states) < len(settings.CHANNELS):
+                yield ":\n\n"
+                continue
+            version, data = format_now_playing(states[endpoint] for endpoint in settings.CHANNELS)
+            yield "id: {}\ndata: {}\n\n".format(version, json.dumps(data, cls=MetadataEncoder))
+    await send_event_stream(receive, send, events())
+
+
+async def get_channel_info(scope, receive, send, channel):
+    state = (await get_fanout().get_states([channel])).get(channel)
+    await send_json(send, None if state is None else state.metadata)
+
+
+async def update_broadcast_info(scope, receive, send, channel):
+    state = (await get_fanout().get_states([channel])).get(channel)
+    await send_json(send, None if state is None else state.info)
+
+
+async def update_broadcast_info_stream(scope, receive, send, channel):
+    """Send "updated" event when card info of channel changes (see server.update_broadcast_info_stream())."""
+    last_event_id = dict(scope["headers"]).get(b"last-event-id", b"").decode("latin-1")
+
+    async def events():
+        last_info = None
+        async for changed in get_fanout().listen([channel]):
+            state = changed.get(channel)
+            if state is None:
+                yield ":\n\n"
+            elif state.info == last_info:
+                # keep last event id of client up to date
+                yield format_update_event(state, updated=False)
+            elif last_info is None:
+                # first state is only used as reference, unless a reconnecting client missed it
+                last_info = state.info
+                yield format_update_event(state, updated=is_newer(state, last_event_id))
+            else:
+                last_info = state.info
+                yield format_update_event(state)
+    await send_event_stream(receive, send, events())
+
+
+async def poll_channel(scope, receive, send, channel):
+    """Long-poll alternative to SSE (see server.poll_channel())."""
+    query = parse_qs(scope["query_string"].decode())
+    try:
+        version = int(query["version"][0]) if "version" in query else None
+        timeout = min(float(query.get("timeout", [settings.LONG_POLL_TIMEOUT])[0]), settings.LONG_POLL_TIMEOUT)
+    except ValueError:
+        version, timeout = None, settings.LONG_POLL_TIMEOUT
+    if version is None:
+        state = (await get_fanout().get_states([channel])).get(channel)
+    else:
+        state = await get_fanout().wait_for_change(channel, version, max(timeout, 0))
+    if state is None:
+        await send_response(send, 204)
+    else:
+        await send_json(send, format_channel_state(state))
+
+
+async def get_station_data(scope, receive, send, station):
+    data = await get_fanout().redis.get(f"sunflower:station:{station}:data")
+    await send_json(send, None if data is None else decode(data))
+
+
+_channels_pattern = "(?P<channel>{})".format("|".join(map(re.escape, settings.CHANNELS)))
+_stations_pattern = "(?P<station>{})".format("|".join(map(re.escape, settings.STATIONS)))
+
+ROUTES = [
+    (re.compile(pattern), view)
+    for pattern, view in (
+        (r"/api/now-playing/", now_playing),
+        (r"/api/now-playing/events/", now_playing_stream),
+        (rf"/api/channels/{_channels_pattern}/metadata/", get_channel_info),
+        (rf"/api/channels/{_channels_pattern}/update/", update_broadcast_info),
+        (rf"/api/channels/{_channels_pattern}/events/", update_broadcast_info_stream),
+        (rf"/api/channels/{_channels_pattern}/poll/", poll_channel),
+        (rf"/api/stations/{_stations_pattern}/", get_station_data),
+    )
+]
+
+
+async def lifespan(receive, send):
+    global _fanout
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_fanout().start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _fanout is not None:
+                await _fanout.stop()
+                _fanout = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application serving read-only API views and event streams.
+
+    It is an alternative to Flask server for these urls, holding a lot of
+    idle event streams with few resources. Other urls (HTML views, API
+    links) are served by Flask server (see wsgi.py): requests must be routed
+    by the HTTP server (nginx).
+    """
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    for pattern, view in ROUTES:
+        match = pattern.fullmatch(scope["path"])
+        if match is not None:
+            break
+    else:
+        return await send_json(send, {"error": "Not found"}, status=404)
+    if scope["method"] not in ("GET", "HEAD"):
+        return await send_json(send, {"error": "Method not allowed"}, status=405, headers=[(b"allow", b"GET, HEAD")])
+    if scope["method"] == "HEAD":
+        send = without_body(send)
+    await view(scope, receive, send, **match.groupdict())
@@ -3,13 +3,13 @@
 """Module containing radio metadata fetching related functions."""
 
 from sunflower.core.bases import Channel
-from sunflower.handlers import AdsHandler
+from sunflower.handlers import AdsHandler, CoverProxyHandler
 from sunflower.stations import (RTL2, FranceCulture, FranceInfo, FranceInter,
                                 FranceMusique, PycolorePlaylistStation)
 
 tournesol = Channel(
     endpoint="tournesol",
-    handlers=(AdsHandler,),
+    handlers=(AdsHandler, CoverProxyHandler),
     timetable={
         # (weekday1, weekday2, ...)
         (0, 1, 2, 3, 4): [
@@ -52,7 +52,7 @@ tournesol = Channel(
     },
 )
 
-music = Channel("music", handlers=(AdsHandler,),
+music = Channel("music", handlers=(AdsHandler, CoverProxyHandler),
                 timetable={(0, 1, 2, 3,): [
                     ("00:00", "09:00", RTL2),
                     ("09:00", "12:00", PycolorePlaylistStation),
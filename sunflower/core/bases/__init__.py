@@ -1,2 +1,2 @@
-from .stations import Station, STATIONS_INSTANCES, URLStation, DynamicStation
+from .stations import Station, STATIONS_INSTANCES, StationRegistry, URLStation, DynamicStation
 from .channels import Channel
@@ -1,16 +1,27 @@
+import concurrent.futures
 from datetime import datetime, time, timedelta
 import functools
+import json
+import os
+import traceback
 from logging import Logger
+from typing import Any, Callable, Dict, Optional
+
+import redis
 
 from sunflower import settings
-from sunflower.core.bases.stations import Station
-from sunflower.core.mixins import RedisMixin
+from sunflower.core.bases.stations import DynamicStation, Station
+from sunflower.core.codecs import decode, get_codec
+from sunflower.core.demand import Demand
+from sunflower.core.history import BroadcastHistory
+from sunflower.core.liquidsoap import LiquidsoapError
+from sunflower.core.mixins import LiquidsoapMixin, RedisMixin
 from sunflower.core.descriptors import PersistentAttribute
 from sunflower.core.types import (CardMetadata, MetadataEncoder, MetadataType,
                                   as_metadata_type, MetadataDict)
 
 
-class Channel(RedisMixin):
+class Channel(RedisMixin, LiquidsoapMixin):
     """Channel.
 
     Channel object contains and manages stations. It triggers station metadata updates
@@ -20,6 +31,11 @@ class Channel(RedisMixin):
     """
 
     data_type = "channel"
+
+    # metadata is fetched in background threads, shared by all channels (see _refresh_metadata()),
+    # created at first use in each process (executor threads don't survive a fork)
+    _refresh_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+    _refresh_executor_pid: Optional[int] = None
     
     def __init__(self, endpoint, timetable, handlers=[]):
         """Channel constructor.
@@ -36,6 +52,7 @@ class Channel(RedisMixin):
         self.endpoint = endpoint
         self.timetable = timetable
         self.handlers = [Handler(self) for Handler in handlers]
+        self.history = BroadcastHistory(endpoint)
         
         if len(self.stations) == 1:
             self._current_station_instance = self.stations[0]()
@@ -46,6 +63,15 @@ class Channel(RedisMixin):
             self._current_station_instance = None
             self._following_station_instance = None
 
+        self._liquidsoap_selection = None
+        self._liquidsoap_selection_time = 0
+        self._last_full_processing_time = 0
+        self._refresh_future: Optional[concurrent.futures.Future] = None
+        self._refresh_station: Optional[Station] = None
+        self._prefetch_future: Optional[concurrent.futures.Future] = None
+        self._prefetch_station: Optional[Station] = None
+        self._prefetch_start: Optional[datetime] = None
+
         self.redis_metadata_key = "sunflower:channel:" + self.endpoint + ":metadata"
         self.redis_info_key = "sunflower:channel:" + self.endpoint + ":info"
 
@@ -160,11 +186,22 @@ class Channel(RedisMixin):
         self._update_station_instances()
         return self._following_station_instance
 
-    current_broadcast_metadata = PersistentAttribute("metadata", MetadataEncoder, as_metadata_type)
-    current_broadcast_info = PersistentAttribute("info")
+    current_broadcast_metadata = PersistentAttribute("metadata", codec=get_codec(settings.PERSISTENCE_CODEC, MetadataEncoder, as_metadata_type))
+    current_broadcast_info = PersistentAttribute("info", codec=get_codec(settings.PERSISTENCE_CODEC))
+    data_version = PersistentAttribute("version", codec=get_codec(settings.PERSISTENCE_CODEC), doc="Counter incremented at each metadata update.")
 
-    def publish_to_redis(self, metadata):
-        return super().publish_to_redis(self.endpoint, metadata)
+    def publish_update(self, metadata: MetadataDict, info: CardMetadata, version: int) -> bytes:
+        """Append metadata, card info and version to Redis stream of channel and return entry id.
+
+        Values are encoded as in persistent attributes, so that readers (see
+        UpdatesFanout) get data of the update without reading attributes.
+        """
+        cls = type(self)
+        return self.publish_to_stream(self.endpoint, {
+            "version": version,
+            "metadata": cls.current_broadcast_metadata.codec.encode(cls.current_broadcast_metadata.pre_set_hook_func(self, metadata)),
+            "info": cls.current_broadcast_info.codec.encode(cls.current_broadcast_info.pre_set_hook_func(self, info)),
+        })
 
     @current_broadcast_info.post_get_hook
     def current_broadcast_info(self, redis_data) -> CardMetadata:
@@ -211,7 +248,15 @@ class Channel(RedisMixin):
             return self.waiting_for_following_card_metadata
         return self.current_station.format_info(current_info, metadata, logger)
 
-    def get_current_broadcast_metadata(self, current_metadata, logger: Logger, dt: datetime):
+    @property
+    def refresh_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        cls = Channel
+        if cls._refresh_executor is None or cls._refresh_executor_pid != os.getpid():
+            cls._refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(settings.CHANNELS), thread_name_prefix="metadata-refresh")
+            cls._refresh_executor_pid = os.getpid()
+        return cls._refresh_executor
+
+    def get_current_broadcast_metadata(self, current_metadata, logger: Logger, dt: datetime, station: Optional[Station] = None):
         """Get metadata of current broadcasted programm for current station.
 
         Param: current_metadata: current metadata stored in Redis
@@ -222,55 +267,305 @@ class Channel(RedisMixin):
         """
         if current_metadata is None:
             current_metadata = {}
-        return self.current_station.get_metadata(current_metadata, logger, dt)
+        return (station or self.current_station).get_metadata(current_metadata, logger, dt)
+
+    def _fetch_shared_metadata(self, fetch: Callable[[], Optional[MetadataDict]], logger: Logger, station: Station):
+        """Get metadata of an external station with fetch (see Station.prepare_metadata()),
+        sharing it with other channels using the station.
+
+        Metadata fetched by a channel is stored in Redis during settings.SHARED_METADATA_TTL
+        seconds, and a lock prevents other channels (of any scheduler worker) from fetching
+        it at the same time: a station used by several channels is fetched once. Channels
+        finding the lock taken wait for the fetching channel with a blocking BLPOP on
+        {key}:done (at most settings.SHARED_METADATA_WAIT seconds), then fetch metadata
+        themselves if it is still missing. Dynamic stations are always asked directly,
+        as they don't fetch anything.
+        """
+        if isinstance(station, DynamicStation):
+            return fetch()
+        key = f"sunflower:station:{station.formated_station_name}:shared_metadata"
+        lock_key, done_key = key + ":lock", key + ":done"
+        locked = False
+        try:
+            for attempt in range(2):
+                cached = self._redis.get(key)
+                if cached is not None:
+                    return decode(cached, as_metadata_type)
+                locked = self._redis.set(lock_key, self.endpoint, nx=True, ex=2 * settings.SHARED_METADATA_TTL)
+                if locked or attempt:
+                    break
+                # another channel is fetching metadata: wait for its notification
+                self._redis.blpop([done_key], timeout=settings.SHARED_METADATA_WAIT)
+        except redis.RedisError as err:
+            logger.error(f"channel={self.endpoint} station={station.formated_station_name} Shared metadata could not be read: {err}")
+            return fetch()
+        metadata = None
+        try:
+            metadata = fetch()
+        finally:
+            try:
+                pipeline = self._redis.pipeline()
+                if metadata is not None and metadata["type"] != MetadataType.ERROR:
+                    pipeline.set(key, json.dumps(metadata, cls=MetadataEncoder), ex=settings.SHARED_METADATA_TTL)
+                if locked:
+                    pipeline.delete(lock_key)
+                    # wake up waiting channels (one token per possible waiter, remaining ones expire)
+                    pipeline.delete(done_key)
+                    pipeline.rpush(done_key, *[1] * len(settings.CHANNELS))
+                    pipeline.expire(done_key, settings.SHARED_METADATA_TTL)
+                pipeline.execute()
+            except redis.RedisError as err:
+                logger.error(f"channel={self.endpoint} station={station.formated_station_name} Shared metadata could not be stored: {err}")
+        return metadata
+
+    def _prefetch_following_station(self, logger: Logger, now: datetime):
+        """Fetch metadata of following station in background, settings.STATION_PREFETCH_LEAD_TIME
+        seconds before the transition, as it will be at transition time.
+
+        Prefetched metadata is used by _refresh_metadata() at transition, so that new
+        card is published without fetch latency.
+        """
+        if len(self.stations) == 1:
+            return
+        station = self.following_station
+        transition = self.current_station_end
+        if (
+            (transition - now).total_seconds() > settings.STATION_PREFETCH_LEAD_TIME
+            or station is self.current_station
+            or not station.prefetchable_metadata
+            or (self._prefetch_station is station and self._prefetch_start == transition)
+        ):
+            return
+        logger.debug(f"channel={self.endpoint} station={station.formated_station_name} Prefetching metadata for {transition:%H:%M:%S}.")
+        self._prefetch_station = station
+        self._prefetch_start = transition
+        self._prefetch_future = self.refresh_executor.submit(station.prepare_metadata({}, logger, transition))
+
+    def _refresh_metadata(self, current_metadata: Optional[MetadataDict], logger: Logger, now: datetime) -> Optional[MetadataDict]:
+        """Return new metadata of current station, or None if published metadata must be kept.
+
+        Stale-while-revalidate policy: metadata is fetched in background (refresh_executor,
+        with function returned by Station.prepare_metadata() in scheduler thread) and waited for at most settings.METADATA_REFRESH_TIMEOUT seconds. If it is not ready
+        or if fetching failed (error metadata or exception):
+        - current metadata is kept during settings.METADATA_GRACE_PERIOD seconds after its end,
+          if it is good metadata of current station (refresh is waited for again at next call);
+        - else fallback metadata of the station is used (get_fallback_metadata(), built from
+          cached data), and retried after the grace period;
+        - else error metadata is used if fetching failed; if refresh is still running, current
+          metadata is kept if it belongs to current station, else neutral metadata is used.
+        """
+        station = self.current_station
+        if self._refresh_future is None or self._refresh_station is not station:
+            self._refresh_station = station
+            if self._prefetch_station is station and self._prefetch_start == self.current_station_start:
+                # metadata was fetched before the transition (see _prefetch_following_station())
+                logger.debug(f"channel={self.endpoint} station={station.formated_station_name} Using prefetched metadata.")
+                self._refresh_future = self._prefetch_future
+                self._prefetch_station = self._prefetch_start = self._prefetch_future = None
+            else:
+                fetch = station.prepare_metadata(current_metadata or {}, logger, now)
+                self._refresh_future = self.refresh_executor.submit(self._fetch_shared_metadata, fetch, logger, station)
+        metadata = None
+        try:
+            metadata = self._refresh_future.result(timeout=settings.METADATA_REFRESH_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            logger.debug(f"channel={self.endpoint} station={station.formated_station_name} Metadata refresh is still running.")
+        except Exception as err:
+            logger.error(f"channel={self.endpoint} station={station.formated_station_name} Metadata could not be fetched: {err}")
+            logger.error(traceback.format_exc())
+            self._refresh_future = None
+        else:
+            self._refresh_future = None
+        if metadata is not None and metadata["type"] != MetadataType.ERROR:
+            return metadata
 
-    def process(self, logger: Logger, now: datetime, **kwargs):
+        if (
+            current_metadata is not None
+            and current_metadata["station"] == station.station_name
+            and current_metadata["type"] != MetadataType.ERROR
+            and now.timestamp() < current_metadata["end"] + settings.METADATA_GRACE_PERIOD
+        ):
+            return None
+        fallback_metadata = station.get_fallback_metadata(current_metadata or {}, logger, now)
+        if fallback_metadata is not None:
+            logger.debug(f"channel={self.endpoint} station={station.formated_station_name} Using fallback metadata.")
+            fallback_metadata["end"] = min(fallback_metadata["end"], int(now.timestamp() + settings.METADATA_GRACE_PERIOD))
+            return fallback_metadata
+        if metadata is not None:
+            return metadata
+        if current_metadata is not None and current_metadata["station"] == station.station_name:
+            return None
+        return {"station": station.station_name, "type": MetadataType.NONE, "end": 0}
+
+    def process(self, logger: Logger, now: datetime, demand: Optional[Dict[str, Demand]] = None, **kwargs):
         """If needed, update metadata.
 
-        - Check if metadata needs to be updated
+        - Tell liquidsoap which station is on air
+        - If channel is idle (nobody is listening to it, see DemandMonitor), skip
+          metadata updates, except every settings.IDLE_CHANNEL_PROCESSING_INTERVAL seconds
+        - Prefetch metadata of following station before transition
+        - Check if metadata needs to be updated (else let handlers refresh
+          published metadata, see _refresh_from_handlers())
         - Get metadata and card info with stations methods
         - Apply changements operated by handlers
-        - Update metadata in Redis
-        - If needed, send SSE and update card info in Redis.
+        - Update metadata in Redis and increment data version
+        - If needed, update card info in Redis
+        - Append the update to Redis stream of the channel, read by web servers
+          (heartbeats of event streams are sent by web servers themselves).
+        - Record metadata in broadcast history of the channel
 
         If card info changed and need to be updated in client, return True.
         Else return False.
         """
 
-        current_metadata = self.current_broadcast_metadata
+        self._select_station_in_liquidsoap(logger, now)
+
+        channel_demand = (demand or {}).get(self.endpoint, Demand(None, None))
+        if channel_demand.idle and now.timestamp() - self._last_full_processing_time < settings.IDLE_CHANNEL_PROCESSING_INTERVAL:
+            return False
+        self._last_full_processing_time = now.timestamp()
+
+        self._prefetch_following_station(logger, now)
+
+        current_metadata, current_info, current_version = PersistentAttribute.get_many([
+            (self, "current_broadcast_metadata"),
+            (self, "current_broadcast_info"),
+            (self, "data_version"),
+        ])
 
         if (
             current_metadata is not None
             and now.timestamp() < current_metadata["end"]
             and current_metadata["station"] == self.current_station.station_name
         ):
-            self.publish_to_redis("unchanged")
-            return False
+            return self._refresh_from_handlers(current_metadata, current_info, current_version, logger)
 
-        current_info = self.current_broadcast_info
+        metadata = self._refresh_metadata(current_metadata, logger, now)
+        if metadata is None:
+            # last known good metadata stays published while refresh is running
+            return False
 
-        metadata = self.get_current_broadcast_metadata(current_metadata, logger, now)
         info = self.get_current_broadcast_info(current_info, metadata, logger)
 
         for handler in self.handlers:
             metadata, info = handler.process(metadata, info, logger, now)
         
         self.current_broadcast_metadata = metadata
-        if info == self.current_broadcast_info:
-            self.publish_to_redis("unchanged")
+        self.data_version = version = (current_version or 0) + 1
+        info_changed = info != current_info
+        if info_changed:
+            self.current_broadcast_info = info
+        self.publish_update(metadata, info, version)
+        self.history.record(metadata, now)
+        if not info_changed:
             return False
-        self.current_broadcast_info = info
-        self.publish_to_redis("updated")
         logger.debug(f"channel={self.endpoint} station={self.current_station.formated_station_name} Metadata was updated.")
         return True
-    
-    def get_liquidsoap_config(self):
-        """Renvoie une chaîne de caractères à écrire dans le fichier de configuration liquidsoap."""
+
+    def _refresh_from_handlers(self, metadata: MetadataDict, info: CardMetadata, version: Optional[int], logger: Logger) -> bool:
+        """Publish current metadata and card info again if a handler changed them since they were published.
+
+        Handlers may define refresh(metadata, info, logger), returning updated
+        metadata and card info, or None if nothing changed (for example when a
+        cover fetched in background is ready, see CoverProxyHandler).
+        Return True if card info changed.
+        """
+        updated = False
+        for handler in self.handlers:
+            refresh = getattr(handler, "refresh", None)
+            refreshed = None if refresh is None else refresh(metadata, info, logger)
+            if refreshed is not None:
+                metadata, info = refreshed
+                updated = True
+        if not updated:
+            return False
+        self.current_broadcast_metadata = metadata
+        self.current_broadcast_info = info
+        self.data_version = version = (version or 0) + 1
+        self.publish_update(metadata, info, version)
+        logger.debug(f"channel={self.endpoint} Metadata was refreshed by handlers.")
+        return True
+
+    def get_state(self) -> Optional[Dict[str, Any]]:
+        """Return in-memory state of handlers (keyed by handler class name) for snapshots, or None.
+
+        Metadata and card info are already persisted in Redis.
+        """
+        handlers_states = {
+            type(handler).__name__: state
+            for handler in self.handlers
+            if (state := getattr(handler, "get_state", lambda: None)()) is not None
+        }
+        return {"handlers": handlers_states} if handlers_states else None
+
+    def restore_state(self, state: Dict[str, Any]) -> bool:
+        """Restore state of handlers returned by get_state(). Return True if at least one handler was restored."""
+        restored = False
+        for handler in self.handlers:
+            handler_state = state.get("handlers", {}).get(type(handler).__name__)
+            if handler_state is not None and hasattr(handler, "restore_state"):
+                restored = handler.restore_state(handler_state) or restored
+        return restored
+
+    @property
+    def liquidsoap_station_variable(self) -> str:
+        """Name of liquidsoap interactive variable containing station selected by scheduler."""
+        return f"{self.endpoint}_station"
+
+    @property
+    def liquidsoap_selection_time_variable(self) -> str:
+        """Name of liquidsoap interactive variable containing time of last selection by scheduler."""
+        return f"{self.endpoint}_station_time"
+
+    def _select_station_in_liquidsoap(self, logger: Logger, now: datetime):
+        """Tell liquidsoap which station is on air, according to current timetable.
+
+        Timetable changes are thus applied without restarting liquidsoap. Selection
+        is sent with its time at each station change, and every minute in case liquidsoap
+        restarted. Liquidsoap ignores a selection older than settings.LIQUIDSOAP_SELECTION_TIMEOUT
+        and follows its static timetable, so that the stream doesn't stay on the last
+        selected station if the scheduler stops.
+        """
+        if len(self.stations) == 1:
+            return
+        station_name = self.current_station.formated_station_name
+        if station_name == self._liquidsoap_selection and now.timestamp() - self._liquidsoap_selection_time < 60:
+            return
+        try:
+            replies = self.liquidsoap.execute(
+                f"var.set {self.liquidsoap_selection_time_variable} = {now.timestamp():.1f}",
+                f'var.set {self.liquidsoap_station_variable} = "{station_name}"',
+            )
+        except LiquidsoapError as err:
+            logger.error(f"channel={self.endpoint} Station could not be selected in liquidsoap: {err}")
+            return
+        if not all(any(line.endswith("set.") for line in reply.lines) for reply in replies):
+            logger.error(f"channel={self.endpoint} Station could not be selected in liquidsoap: {[reply.lines for reply in replies]}")
+            return
+        self._liquidsoap_selection = station_name
+        self._liquidsoap_selection_time = now.timestamp()
+
+    def get_liquidsoap_config(self, static_timetable=True):
+        """Renvoie une chaîne de caractères à écrire dans le fichier de configuration liquidsoap.
+
+        La station jouée est choisie par le scheduler grâce à une variable interactive
+        (voir _select_station_in_liquidsoap()). Tant que le scheduler n'a rien choisi,
+        ou si son choix date de plus de settings.LIQUIDSOAP_SELECTION_TIMEOUT secondes
+        (scheduler arrêté), la table d'horaires statique est utilisée. Si static_timetable=False,
+        celle-ci n'est pas écrite (utile pour comparer la structure de deux configurations).
+        """
 
         # définition des horaires des radios
         if len(self.stations) > 1:
-            timetable_to_write = "# timetable\n{}_timetable = switch(track_sensitive=false, [\n".format(self.endpoint)
-            for days, timetable in self.timetable.items():
+            timetable_to_write = "# timetable\n"
+            timetable_to_write += '{0}_selected_station = interactive.string("{1}", "")\n'.format(self.endpoint, self.liquidsoap_station_variable)
+            timetable_to_write += '{0}_selection_time = interactive.float("{1}", 0.)\n'.format(self.endpoint, self.liquidsoap_selection_time_variable)
+            timetable_to_write += "{}_timetable = switch(track_sensitive=false, [\n".format(self.endpoint)
+            for station in sorted(self.stations, key=lambda station: station.formated_station_name):
+                timetable_to_write += '    ({{ {0}_selected_station() == "{1}" and time() - {0}_selection_time() < {2} }}, {1}),\n'.format(
+                    self.endpoint, station.formated_station_name, float(settings.LIQUIDSOAP_SELECTION_TIMEOUT)
+                )
+            for days, timetable in (self.timetable.items() if static_timetable else ()):
                 formated_weekday = (
                     ("(" + " or ".join("{}w".format(wd+1) for wd in days) + ") and")
                     if len(days) > 1
@@ -288,7 +583,7 @@ class Channel(RedisMixin):
             timetable_to_write = ""
         
         # output
-        fallback = str(self.endpoint) + "_timetable" if timetable_to_write else self.stations[0].formated_station_name
+        fallback = str(self.endpoint) + "_timetable" if len(self.stations) > 1 else self.stations[0].formated_station_name
         timetable_to_write += str(self.endpoint) + "_radio = fallback([" + fallback + ", default])\n"    
         timetable_to_write += str(self.endpoint) + '_radio = fallback(track_sensitive=false, [request.queue(id="' + str(self.endpoint) + '_custom_songs"), ' + str(self.endpoint) + '_radio])\n\n'
 
@@ -1,23 +1,38 @@
 # This file is part of sunflower package. radio
 # bases.py contains base classes
 
+import functools
 from datetime import datetime, timedelta
 from logging import Logger
-from typing import Dict
+from typing import Any, Callable, Optional
 
 from sunflower.core.decorators import classproperty
 from sunflower.core.mixins import HTMLMixin, RedisMixin
 from sunflower.core.types import CardMetadata, MetadataDict, MetadataType
 
 
-class Station(HTMLMixin):
+class StationMeta(type):
+    """Metaclass of stations, making station classes singletons.
+
+    Calling a station class returns the instance stored in STATIONS_INSTANCES
+    registry, __init__() is only run at first call.
+    """
+
+    def __call__(cls):
+        return STATIONS_INSTANCES.get_instance(cls)
+
+
+class Station(HTMLMixin, metaclass=StationMeta):
     """Base station.
 
     User defined stations should inherit from this class and define following properties:
     - station_name (str)
     - station_thumbnail (str): link to station thumbnail
 
-    Station classes are singletons.
+    Station classes are singletons. Their lifecycle is:
+    - construction and setup() at first call of the class;
+    - start() when the scheduler starts (see StationRegistry);
+    - stop() when the scheduler stops.
     """
 
     data_type = "station"
@@ -26,6 +41,10 @@ class Station(HTMLMixin):
     station_website_url: str = ""
     station_slogan: str = ''
 
+    # if True, metadata can be fetched in advance, before the station is on air
+    # (see Channel._prefetch_following_station())
+    prefetchable_metadata: bool = True
+
     @classproperty
     def formated_station_name(cls) -> str:
         """Return formated station name.
@@ -37,29 +56,40 @@ class Station(HTMLMixin):
         """
         return cls.station_name.lower().replace(" ", "")
 
-    def __new__(cls):
-        """Create new instance or return previously created one.
-
-        Station class is singleton, so once one instance is created,
-        all other calls to this method return the one created before. At
-        first instanciation, call __setup__() method.
-        """
-        instance_of_dict = STATIONS_INSTANCES.get(cls.__name__)
-        if instance_of_dict is None:
-            instance_of_dict = STATIONS_INSTANCES[cls.__name__] = super().__new__(cls)
-            instance_of_dict.__setup__()
-        return instance_of_dict
-
     @property
     def html_formated_station_name(self):
         return self._format_html_anchor_element(self.station_website_url, self.station_name)
 
-    def __setup__(self):
-        """Equivalent of __init__() but it is called at first instanciation only.
+    def setup(self):
+        """Called once, right after the instance is created (at first call of the class).
 
-        Further instanciations return first created object as this class is a singleton.
+        Further calls of the class return first created object as this class is a singleton.
+        Setup must be cheap (no I/O): stations are created by web server and CLI too.
         """
 
+    def start(self):
+        """Called once before the station is processed by the scheduler.
+
+        Expensive initialisation (library scans, connections...) belongs here.
+        """
+
+    def stop(self):
+        """Called once when the scheduler stops."""
+
+    def get_state(self) -> Optional[Any]:
+        """Return jsonable in-memory state to keep across scheduler restarts, or None.
+
+        See SnapshotStore in sunflower.core.snapshots module.
+        """
+        return None
+
+    def restore_state(self, state: Any) -> bool:
+        """Restore state returned by get_state() in a previous run, before start().
+
+        Return False if state is not valid anymore.
+        """
+        return False
+
     def _get_error_metadata(self, message, seconds):
         """Return general mapping containing a message and ERROR type.
         
@@ -92,6 +122,24 @@ class Station(HTMLMixin):
         and other metadata fields required by format_info().
         """
 
+    def prepare_metadata(self, current_metadata: MetadataDict, logger: Logger, dt: datetime) -> Callable[[], Optional[MetadataDict]]:
+        """Return function returning get_metadata() result, called in a background thread.
+
+        This method is called in scheduler thread (see Channel._refresh_metadata()).
+        Stations whose in-memory state is modified by the scheduler while metadata is
+        fetched must copy here the state needed to build metadata, so that returned
+        function doesn't read it.
+        """
+        return functools.partial(self.get_metadata, current_metadata, logger, dt)
+
+    def get_fallback_metadata(self, current_metadata: MetadataDict, logger: Logger, dt: datetime) -> Optional[MetadataDict]:
+        """Return metadata built from cached data (no request), used when get_metadata() fails or is too slow.
+
+        For instance, next planned programme in last fetched schedule. Return None
+        if no cached data is available. Returned mapping must be supported by format_info().
+        """
+        return None
+
     def format_info(self, current_info: CardMetadata, metadata: MetadataDict, logger: Logger) -> CardMetadata:
         """Format metadata for displaying in the card.
 
@@ -109,7 +157,45 @@ class Station(HTMLMixin):
         """Return string containing liquidsoap config for this station."""
 
 
-STATIONS_INSTANCES: Dict[str, Station] = {}
+class StationRegistry(dict):
+    """Mapping containing station instances, keyed by station class name.
+
+    Instances are lazily created by get_instance() (that is to say at first call of
+    the station class). start() and stop() call station hooks at most once, so
+    the registry can be reset and reused (for example in tests) with reset().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._started = set()
+
+    def get_instance(self, station_cls) -> Station:
+        """Return instance of station_cls, create and setup it if needed."""
+        instance = self.get(station_cls.__name__)
+        if instance is None:
+            instance = self[station_cls.__name__] = type.__call__(station_cls)
+            instance.setup()
+        return instance
+
+    def start(self, station: Station):
+        """Call station.start() if station is not already started."""
+        name = type(station).__name__
+        if name not in self._started:
+            station.start()
+            self._started.add(name)
+
+    def stop_all(self):
+        """Call stop() of all started stations."""
+        while self._started:
+            self[self._started.pop()].stop()
+
+    def reset(self):
+        """Stop started stations and forget all instances."""
+        self.stop_all()
+        self.clear()
+
+
+STATIONS_INSTANCES = StationRegistry()
 
 
 class DynamicStation(Station, RedisMixin):
@@ -119,6 +205,9 @@ class DynamicStation(Station, RedisMixin):
     """
     endpoint: str # for api
 
+    # metadata depends on what the station plays once on air
+    prefetchable_metadata = False
+
     def process(self, logger, channels_using, now, **kwargs):
         raise NotImplementedError("process() must be implemented")
 
@@ -133,7 +222,7 @@ class URLStation(Station):
     station_url: str
     station_slogan: str
 
-    def __setup__(self):
+    def setup(self):
         if self.station_url == "":
             raise ValueError("URL not specified for URLStation object.")
 
@@ -0,0 +1,115 @@
+# This file is part of sunflower package. radio
+# This module contains codecs used for serializing data stored in Redis.
+
+import json
+from enum import Enum
+from json import JSONEncoder
+from typing import Any, Callable, Dict, Optional, Type
+
+try:
+    import msgpack
+except ImportError: # optional dependency (pip install sunflower[msgpack])
+    msgpack = None
+
+# binary data starts with this header followed by format version:
+# 0xc1 is never used in msgpack and can't start a json document
+MSGPACK_MAGIC = b"\xc1SF"
+MSGPACK_FORMAT_VERSION = 1
+
+# enums supported by binary codec: ext type code -> (enum class, value -> member mapping)
+_ENUM_EXT_TYPES: Dict[int, Any] = {}
+_ENUM_EXT_CODES: Dict[Type[Enum], int] = {}
+
+
+def register_enum(code: int, enum_cls: Type[Enum]):
+    """Register an enum whose members can be encoded by MsgpackCodec (as ext type with given code)."""
+    _ENUM_EXT_TYPES[code] = (enum_cls, {member.value: member for member in enum_cls})
+    _ENUM_EXT_CODES[enum_cls] = code
+
+
+def _msgpack_default(obj):
+    code = _ENUM_EXT_CODES.get(type(obj))
+    if code is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+    return msgpack.ExtType(code, msgpack.packb(obj.value))
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code not in _ENUM_EXT_TYPES:
+        return msgpack.ExtType(code, data)
+    return _ENUM_EXT_TYPES[code][1][msgpack.unpackb(data)]
+
+
+def decode(data: bytes, object_hook: Optional[Callable] = None) -> Any:
+    """Decode data encoded by any codec (format is detected thanks to header).
+
+    object_hook is used for json data only.
+    """
+    if data[:len(MSGPACK_MAGIC)] == MSGPACK_MAGIC:
+        version = data[len(MSGPACK_MAGIC)]
+        if version != MSGPACK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary format version: {version}.")
+        if msgpack is None:
+            raise RuntimeError("msgpack package is required for decoding binary data.")
+        return msgpack.unpackb(data[len(MSGPACK_MAGIC) + 1:], ext_hook=_msgpack_ext_hook)
+    if isinstance(data, bytes):
+        data = data.decode()
+    return json.loads(data, object_hook=object_hook)
+
+
+class Codec:
+    """Base class for codecs.
+
+    encode() returns bytes in the codec format. decode() supports all formats, so that
+    codec of a persistent attribute can be changed without migrating existing keys
+    (see migrate_persistent_attributes() in functions module).
+
+    json_encoder_cls and object_hook are used for json data.
+    """
+
+    name: str
+
+    def __init__(self, json_encoder_cls: Optional[Type[JSONEncoder]] = None, object_hook: Optional[Callable] = None):
+        self.json_encoder_cls = json_encoder_cls
+        self.object_hook = object_hook
+
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError("encode() must be implemented")
+
+    def decode(self, data: bytes) -> Any:
+        return decode(data, self.object_hook)
+
+
+class JsonCodec(Codec):
+    """Encode data as json (default)."""
+
+    name = "json"
+
+    def encode(self, value):
+        return json.dumps(value, cls=self.json_encoder_cls).encode()
+
+
+class MsgpackCodec(Codec):
+    """Encode data with msgpack, after a versioned header. Registered enums are encoded as ext types."""
+
+    name = "msgpack"
+
+    def __init__(self, json_encoder_cls=None, object_hook=None):
+        if msgpack is None:
+            raise RuntimeError("msgpack package is required for MsgpackCodec (pip install msgpack).")
+        super().__init__(json_encoder_cls, object_hook)
+
+    def encode(self, value):
+        return MSGPACK_MAGIC + bytes([MSGPACK_FORMAT_VERSION]) + msgpack.packb(value, default=_msgpack_default)
+
+
+CODECS = {codec_cls.name: codec_cls for codec_cls in (JsonCodec, MsgpackCodec)}
+
+
+def get_codec(name: str, json_encoder_cls: Optional[Type[JSONEncoder]] = None, object_hook: Optional[Callable] = None) -> Codec:
+    """Return codec instance with given name (see CODECS)."""
+    try:
+        codec_cls = CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec {name!r}. Available codecs: {', '.join(CODECS)}.") from None
+    return codec_cls(json_encoder_cls, object_hook)
@@ -0,0 +1,165 @@
+# This file is part of sunflower package. radio
+# This module contains CoverCache class, storing resized copies of remote covers on disk.
+
+import hashlib
+import io
+import os
+from typing import Dict, Optional, Tuple
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError: # optional dependency (pip install sunflower[covers])
+    Image = None
+
+from sunflower import settings
+
+# extension -> mimetype of stored variants
+MIMETYPES = {
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "svg": "image/svg+xml",
+}
+EXTENSIONS = {mimetype: extension for extension, mimetype in MIMETYPES.items()}
+
+
+class CoverCache:
+    """Covers fetched once from their remote url and stored on disk, shared by scheduler and server.
+
+    Each cover is identified by a key (hash of its url) and stored as:
+    - {key}.webp and {key}.jpg, resized to fit in size x size pixels, if
+      Pillow is installed. Otherwise, or if image can't be decoded, the
+      original image is stored as is ({key}.png, {key}.jpg...);
+    - {key}.svg for vector images (not resized, as they are usually small);
+    - {key}.src, containing the remote url.
+
+    Total size of the directory is kept under max_size bytes: least
+    recently used covers are removed first (files are touched when served).
+    """
+
+    def __init__(self, root: str = settings.COVERS_ROOT, max_size: int = settings.COVERS_MAX_SIZE, size: int = settings.COVER_SIZE, timeout: float = 2):
+        self.root = root
+        self.max_size = max_size
+        self.size = size
+        self.timeout = timeout
+
+    @staticmethod
+    def get_key(url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest()[:24]
+
+    @staticmethod
+    def get_local_url(key: str) -> str:
+        return f"/covers/{key}"
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.root, f"{key}.{extension}")
+
+    def _stored_extensions(self, key: str):
+        return [extension for extension in MIMETYPES if os.path.exists(self._path(key, extension))]
+
+    def lookup(self, url: str) -> Optional[str]:
+        """Return local url of cover at given url if it is stored (marking it as used), else None."""
+        key = self.get_key(url)
+        if not self._stored_extensions(key):
+            return None
+        self.touch(key)
+        return self.get_local_url(key)
+
+    def get(self, url: str) -> str:
+        """Return local url of cover at given url, fetching and storing it if needed.
+
+        Raise requests.RequestException, OSError or ValueError if cover could not be stored.
+        """
+        local_url = self.lookup(url)
+        if local_url is not None:
+            return local_url
+        key = self.get_key(url)
+        response = requests.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        self.store(key, url, response.content, response.headers.get("Content-Type", ""))
+        return self.get_local_url(key)
+
+    def _make_variants(self, data: bytes, content_type: str) -> Dict[str, bytes]:
+        content_type = content_type.split(";")[0].strip()
+        if content_type == "image/svg+xml" or data.lstrip()[:5] in (b"<?xml", b"<svg "):
+            return {"svg": data}
+        if Image is not None:
+            try:
+                image = Image.open(io.BytesIO(data))
+                image.thumbnail((self.size, self.size))
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+                webp, jpeg = io.BytesIO(), io.BytesIO()
+                image.save(webp, "WEBP", quality=80)
+                if image.mode == "RGBA":
+                    # jpeg has no alpha channel: use a white background
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                image.save(jpeg, "JPEG", quality=85, optimize=True, progressive=True)
+                return {"webp": webp.getvalue(), "jpg": jpeg.getvalue()}
+            except (OSError, ValueError):
+                pass # not decodable by Pillow: keep original
+        extension = EXTENSIONS.get(content_type)
+        if extension is None:
+            raise ValueError(f"Unsupported cover type: {content_type or 'unknown'}.")
+        return {extension: data}
+
+    def store(self, key: str, url: str, data: bytes, content_type: str):
+        """Store variants of cover data, then remove least recently used covers if needed."""
+        os.makedirs(self.root, exist_ok=True)
+        files = self._make_variants(data, content_type)
+        files["src"] = url.encode()
+        for extension, file_data in files.items():
+            tmp_path = self._path(key, extension) + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(file_data)
+            os.replace(tmp_path, self._path(key, extension))
+        self.evict(keep=key)
+
+    def find(self, key: str, accept: str = "") -> Optional[Tuple[str, str]]:
+        """Return path and mimetype of best stored variant of cover for given Accept header, or None."""
+        extensions = self._stored_extensions(key)
+        if "webp" in extensions and "image/webp" not in accept and "jpg" in extensions:
+            extensions.remove("webp")
+        if not extensions:
+            return None
+        path = self._path(key, extensions[0])
+        return path, MIMETYPES[extensions[0]]
+
+    def touch(self, key: str):
+        """Mark cover as recently used."""
+        try:
+            os.utime(self._path(key, "src"))
+        except OSError:
+            pass
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used covers (except keep) until directory size is under max_size."""
+        covers: Dict[str, list] = {} # key -> [size, last use time, paths]
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                key, _, extension = entry.name.partition(".")
+                if not entry.is_file() or extension.endswith("tmp"):
+                    continue
+                stat = entry.stat()
+                cover = covers.setdefault(key, [0, 0, []])
+                cover[0] += stat.st_size
+                cover[2].append(entry.path)
+                if extension == "src":
+                    cover[1] = stat.st_mtime
+        total_size = sum(cover[0] for cover in covers.values())
+        for key, (size, _, paths) in sorted(covers.items(), key=lambda item: item[1][1]):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
@@ -0,0 +1,125 @@
+# This file is part of sunflower package. radio
+# This module contains DemandMonitor class, telling which channels are listened to.
+
+import concurrent.futures
+import json
+from collections import Counter
+from time import monotonic
+from typing import Dict, Iterable, NamedTuple, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from sunflower import settings
+from sunflower.core.fanout import FANOUT_CLIENTS_KEY_PREFIX, FANOUT_PROCESSES_KEY
+from sunflower.core.mixins import RedisMixin
+
+
+class Demand(NamedTuple):
+    """Audience of a channel. None means unknown (source could not be reached)."""
+    subscribers: Optional[int] # clients waiting for metadata updates (SSE, long-poll)
+    listeners: Optional[int] # clients listening to audio stream (Icecast)
+
+    @property
+    def idle(self) -> bool:
+        """True if channel is known to have no audience at all."""
+        return self.subscribers == 0 and self.listeners == 0
+
+
+class DemandMonitor(RedisMixin):
+    """Count audience of channels.
+
+    Audience combines:
+    - clients of the web server waiting for updates of the channel (SSE and
+      long-poll), as reported in Redis by UpdatesFanout of each server process;
+    - listeners of Icecast mount of the channel, read from Icecast status page
+      (status-json.xsl).
+
+    Both are read in one request each for all channels. Subscribers are read at
+    each refresh(). Icecast status page is read in a background thread every
+    status_interval seconds, so that the scheduler tick doesn't wait for it:
+    last read listeners are used, unless they are older than status_max_age
+    seconds (status page can't be read anymore).
+    """
+
+    def __init__(
+        self,
+        icecast_status_url: str = settings.ICECAST_STATUS_URL,
+        timeout: float = 1,
+        status_interval: float = settings.ICECAST_STATUS_INTERVAL,
+        status_max_age: float = settings.ICECAST_STATUS_MAX_AGE,
+    ):
+        super().__init__()
+        self.icecast_status_url = icecast_status_url
+        self.timeout = timeout
+        self.status_interval = status_interval
+        self.status_max_age = status_max_age
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._listeners_future: Optional[concurrent.futures.Future] = None
+        self._listeners_request_time = float("-inf")
+        self._listeners: Optional[Dict[str, int]] = None
+        self._listeners_time = float("-inf")
+
+    def _get_subscribers(self, endpoints: Iterable[str]) -> Dict[str, int]:
+        process_ids = list(self._redis.smembers(FANOUT_PROCESSES_KEY))
+        reports = self._redis.mget([FANOUT_CLIENTS_KEY_PREFIX.encode() + process_id for process_id in process_ids]) if process_ids else []
+        counts = Counter()
+        for report in filter(None, reports):
+            counts.update(json.loads(report))
+        # forget stopped processes (their report expired)
+        expired = [process_id for process_id, report in zip(process_ids, reports) if report is None]
+        if expired:
+            self._redis.srem(FANOUT_PROCESSES_KEY, *expired)
+        return {endpoint: counts[endpoint] for endpoint in endpoints}
+
+    def _get_listeners(self) -> Dict[str, int]:
+        """Return number of listeners by Icecast mount."""
+        sources = requests.get(self.icecast_status_url, timeout=self.timeout).json()["icestats"].get("source", [])
+        if isinstance(sources, dict):
+            # Icecast doesn't use a list when there is only one source
+            sources = [sources]
+        return {urlparse(source["listenurl"]).path.strip("/"): int(source.get("listeners", 0)) for source in sources}
+
+    def _collect_listeners(self, logger=None) -> Optional[Dict[str, int]]:
+        """Return last read listeners, and read Icecast status page again in background if needed.
+
+        Return None if listeners were not read for status_max_age seconds.
+        """
+        now = monotonic()
+        if self._listeners_future is not None and self._listeners_future.done():
+            try:
+                self._listeners = self._listeners_future.result()
+                self._listeners_time = now
+            except Exception as err:
+                if logger is not None:
+                    logger.error(f"Icecast listeners could not be counted: {err}")
+            self._listeners_future = None
+        if self._listeners_future is None and now - self._listeners_request_time >= self.status_interval:
+            if self._executor is None:
+                # created lazily, in scheduler process
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="icecast-status")
+            self._listeners_future = self._executor.submit(self._get_listeners)
+            self._listeners_request_time = now
+        if now - self._listeners_time > self.status_max_age:
+            return None
+        return self._listeners
+
+    def refresh(self, endpoints: Iterable[str], logger=None) -> Dict[str, Demand]:
+        """Return demand of channels with given endpoints.
+
+        If a source can't be read, corresponding counts are None, so that
+        channels are not considered as idle. Listeners are unknown until
+        Icecast status page is read for the first time.
+        """
+        endpoints = list(endpoints)
+        try:
+            subscribers = self._get_subscribers(endpoints)
+        except Exception as err:
+            subscribers = {}
+            if logger is not None:
+                logger.error(f"SSE subscribers could not be counted: {err}")
+        listeners = self._collect_listeners(logger)
+        return {
+            endpoint: Demand(subscribers.get(endpoint), None if listeners is None else listeners.get(endpoint, 0))
+            for endpoint in endpoints
+        }
@@ -1,12 +1,16 @@
-from sunflower.core.mixins import RedisMixin
+from sunflower.core.codecs import Codec, JsonCodec
+from sunflower.core.persistence import PersistenceBackend, RedisBackend
 from json import JSONEncoder
-from typing import Type, Callable
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
 
 
-class PersistentAttribute(RedisMixin):
+class PersistentAttribute:
     """Descriptor for attributes stored in external persistence system.
 
-    For the moment, only Redis persistent attributes are implemented.
+    Data is stored by a persistence backend (see persistence module): the one given
+    to the constructor, or else the default backend, which is a RedisBackend unless
+    set_default_backend() is called (for example with a CachedRedisBackend in the
+    scheduler, or with a MemoryBackend in tests).
 
     Owner class or object must have two mandatory attributes:
 
@@ -15,8 +19,8 @@ class PersistentAttribute(RedisMixin):
 
     Hooks can be added for customizing persistence and retrievals:
 
-    - `pre_set_hook_func()` is called before storing data in Redis database (see `__set__()` method).
-    - `post_get_hook_func()` is called after retrieving data from Redis database (see `__get__()` method).
+    - `pre_set_hook_func()` is called before storing data in backend (see `__set__()` method).
+    - `post_get_hook_func()` is called after retrieving data from backend (see `__get__()` method).
 
     These can be added through the constructor or with decorators. For example:
 
@@ -25,7 +29,7 @@ class PersistentAttribute(RedisMixin):
 
     @persistent_attribute.pre_set_hook
     def persistent_attribute(self, value):
-        # format data to be stored in Redis database
+        # format data to be stored in backend
         return data
     
     @persistent_attribute.post_get_hook
@@ -35,12 +39,16 @@ class PersistentAttribute(RedisMixin):
     ```
     """
 
+    default_backend: PersistenceBackend = RedisBackend()
+
     def __init__(self, redis_key: str, 
                  json_encoder_cls: Type[JSONEncoder] = None, object_hook: Callable = None,
                  expiration_delay: int = None, doc: str = "",
-                 pre_set_hook: Callable = lambda self, x: x, post_get_hook: Callable = lambda self, x: x):
-        super().__init__()
+                 pre_set_hook: Callable = lambda self, x: x, post_get_hook: Callable = lambda self, x: x,
+                 backend: Optional[PersistenceBackend] = None, codec: Optional[Codec] = None):
         self.__doc__ = doc
+        self._backend = backend
+        self.codec = codec or JsonCodec(json_encoder_cls, object_hook)
         self.json_encoder_cls = json_encoder_cls
         self.object_hook = object_hook
         self.expiration_delay = expiration_delay
@@ -48,22 +56,55 @@ class PersistentAttribute(RedisMixin):
         self.pre_set_hook_func = pre_set_hook
         self.post_get_hook_func = post_get_hook
 
+    @classmethod
+    def set_default_backend(cls, backend: PersistenceBackend):
+        """Set backend used by persistent attributes created without backend."""
+        cls.default_backend = backend
+
+    @property
+    def backend(self) -> PersistenceBackend:
+        return self._backend or type(self).default_backend
+
     def __set_name__(self, owner, name):
         self.name = name        
         if not self.__doc__:
             self.__doc__ = f"{self.name} persistent attribute."
         
+    @staticmethod
+    def get_many(requests: Iterable[Tuple[Any, str]]) -> List[Any]:
+        """Return values of several persistent attributes, for one or several objects.
+
+        requests contains (object, attribute name) pairs. Values are fetched with one
+        get_many() call by backend (that is to say one MGET for Redis backends), and
+        post_get hooks are applied as with attribute access.
+        """
+        requests = [(obj, getattr(type(obj), name)) for obj, name in requests]
+        values: List[Any] = [None] * len(requests)
+        by_backend: Dict[PersistenceBackend, List[int]] = {}
+        for i, (_, attr) in enumerate(requests):
+            by_backend.setdefault(attr.backend, []).append(i)
+        for backend, indexes in by_backend.items():
+            fetched = backend.get_many([(requests[i][1].get_key(requests[i][0]), requests[i][1].codec) for i in indexes])
+            for i, data in zip(indexes, fetched):
+                obj, attr = requests[i]
+                values[i] = attr.post_get_hook_func(obj, data)
+        return values
+
+    def get_key(self, obj) -> str:
+        """Return key where data of given object is stored."""
+        return f"sunflower:{obj.data_type}:{obj.endpoint}:{self.redis_key}"
+
     def __get__(self, obj, owner):
-        """Get data from Redis, and return self.post_get_hook_func(data)."""
+        """Get data from backend, and return self.post_get_hook_func(data)."""
         if obj is None:
             return self
-        data = self.get_from_redis(f"sunflower:{obj.data_type}:{obj.endpoint}:{self.redis_key}", self.object_hook)
+        data = self.backend.get(self.get_key(obj), self.codec)
         return self.post_get_hook_func(obj, data)
 
     def __set__(self, obj, value):
-        """Pass value to self.pre_set_hook_func() and store the result in Redis database."""
+        """Pass value to self.pre_set_hook_func() and store the result in backend."""
         data = self.pre_set_hook_func(obj, value)
-        self.set_to_redis(f"sunflower:{obj.data_type}:{obj.endpoint}:{self.redis_key}", data, self.json_encoder_cls, self.expiration_delay)
+        self.backend.set(self.get_key(obj), data, self.codec, self.expiration_delay)
 
     def __delete__(self, obj):
         raise AttributeError(f"Can't delete attribute 'f{self.name}'. It expires {self.expiration_delay} seconds after its last assignment.")
@@ -78,11 +119,11 @@ class PersistentAttribute(RedisMixin):
 
         @persistent_attribute.pre_set_hook
         def persistent_attribute(self, value):
-            # format data to be stored in Redis database
+            # format data to be stored in backend
             return data
         ```
         """
-        return type(self)(self.redis_key, self.json_encoder_cls, self.object_hook, self.expiration_delay, self.__doc__, pre_set_hook_func, self.post_get_hook_func)
+        return type(self)(self.redis_key, self.json_encoder_cls, self.object_hook, self.expiration_delay, self.__doc__, pre_set_hook_func, self.post_get_hook_func, self._backend, self.codec)
     
     def post_get_hook(self, post_get_hook_func):
         """Method for adding post_get_hook_func() with a decorator.
@@ -98,4 +139,4 @@ class PersistentAttribute(RedisMixin):
             return value
         ```
         """
-        return type(self)(self.redis_key, self.json_encoder_cls, self.object_hook, self.expiration_delay, self.__doc__, self.pre_set_hook_func, post_get_hook_func)
+        return type(self)(self.redis_key, self.json_encoder_cls, self.object_hook, self.expiration_delay, self.__doc__, self.pre_set_hook_func, post_get_hook_func, self._backend, self.codec)
@@ -0,0 +1,417 @@
+# This file is part of sunflower package. radio
+# This module contains UpdatesFanout class, distributing channels updates to web server clients.
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import monotonic, sleep
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import redis
+import redis.asyncio
+
+from sunflower import settings
+from sunflower.core.codecs import decode
+from sunflower.core.mixins import RedisMixin
+from sunflower.core.types import ChannelView, as_metadata_type
+
+# set of ids of server processes reporting their clients, and prefix of report keys
+FANOUT_PROCESSES_KEY = "sunflower:fanout:processes"
+FANOUT_CLIENTS_KEY_PREFIX = "sunflower:fanout:clients:"
+# maximum delay between retries of stream readers after unexpected errors, in seconds
+MAX_RETRY_DELAY = 30
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelState(NamedTuple):
+    """Data of a channel, as published by the scheduler.
+
+    event_id is the id of the entry of the Redis stream of the channel
+    containing this state (None if state was read from persistent attributes).
+    """
+    endpoint: str
+    version: int
+    metadata: Optional[Dict[str, Any]]
+    info: Optional[Dict[str, Any]]
+    event_id: Optional[str] = None
+
+    @classmethod
+    def from_view(cls, view: ChannelView) -> "ChannelState":
+        return cls(view.endpoint, view.version or 0, view.metadata, view.info)
+
+    @classmethod
+    def from_stream_entry(cls, endpoint: str, entry_id: bytes, fields: Dict[bytes, bytes]) -> "ChannelState":
+        """Return state from an entry appended by Channel.publish_update()."""
+        return cls(
+            endpoint,
+            int(fields[b"version"]),
+            decode(fields[b"metadata"], as_metadata_type),
+            decode(fields[b"info"]),
+            entry_id.decode(),
+        )
+
+
+def parse_stream_entries(endpoint: str, entries: List[Tuple[bytes, Dict[bytes, bytes]]]) -> List[ChannelState]:
+    """Return state of last valid entry of given stream entries (empty list if there is none).
+
+    Invalid entries are logged and skipped, so that stream readers don't stop on them.
+    """
+    for entry_id, fields in reversed(entries):
+        try:
+            return [ChannelState.from_stream_entry(endpoint, entry_id, fields)]
+        except Exception:
+            logger.exception(f"channel={endpoint} Invalid update {entry_id!r} skipped.")
+    return []
+
+
+def parse_event_id(event_id: str) -> Tuple[int, int]:
+    """Return comparable form of a stream entry id ("<milliseconds>-<sequence>")."""
+    milliseconds, _, sequence = event_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def is_newer(state: ChannelState, last_event_id: Optional[str]) -> bool:
+    """Return True if state comes from a stream entry after last_event_id (Last-Event-ID header of SSE clients)."""
+    if state.event_id is None or not last_event_id:
+        return False
+    try:
+        return parse_event_id(state.event_id) > parse_event_id(last_event_id)
+    except ValueError:
+        # not a stream entry id: client can't have seen current state
+        return True
+
+
+def format_update_event(state: ChannelState, updated: bool = True) -> str:
+    """Return event of a channel event stream for given state.
+
+    Event id is id of stream entry of state, so that browsers send it back
+    in Last-Event-ID header when they reconnect. If updated is False, event
+    has no data: it only sets last event id of client (or is a heartbeat).
+    """
+    event = "" if state.event_id is None else f"id: {state.event_id}\n"
+    if updated:
+        return event + "data: updated\n\n"
+    return (event or ":\n") + "\n"
+
+
+class UpdatesFanout(RedisMixin):
+    """Distribute updates of channels to clients of current server process.
+
+    A single background thread reads Redis streams of all channels, where
+    the scheduler appends each update (see Channel.publish_update()), with a
+    blocking XREAD from the last read entries: no update is missed, even
+    when connection to Redis is lost for a moment. Data of updates is kept
+    in memory, and waiting clients (SSE streams, long-polls) are woken up
+    with a threading.Condition. Waiting clients thus cost no Redis connection
+    and no request, and reconnecting clients are served from memory.
+
+    Number of clients of each channel is reported in Redis every report_interval
+    seconds (and as soon as a channel gets its first client), for DemandMonitor.
+    """
+
+    def __init__(self, endpoints: Iterable[str] = settings.CHANNELS, report_interval: float = 5):
+        super().__init__()
+        self.endpoints = list(endpoints)
+        self.report_interval = report_interval
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._condition = threading.Condition()
+        self._states: Dict[str, ChannelState] = {}
+        self._sequence = 0 # incremented at each received message
+        self._clients: Counter = Counter()
+        self._report_needed = False
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._streams = {self.REDIS_STREAMS[endpoint].encode(): endpoint for endpoint in self.endpoints}
+
+    def start(self):
+        """Start background thread if not running (it is started at first use)."""
+        with self._condition:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            # thread is not inherited by forked worker processes
+            self._thread_pid = os.getpid()
+            self.process_id = f"{socket.gethostname()}:{self._thread_pid}"
+            self._thread = threading.Thread(target=self._run, name="sunflower-fanout", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # unexpected errors (bug, undecodable entry...) are logged and retried
+        # with an increasing delay, so that the thread never dies
+        delay = 1
+        while True:
+            try:
+                last_ids = self._load()
+                delay = 1
+                last_report_time = float("-inf")
+                while True:
+                    for stream, entries in self._redis.xread(last_ids, block=1000) or []:
+                        last_ids[stream] = entries[-1][0]
+                        states = parse_stream_entries(self._streams[stream], entries)
+                        if states:
+                            self.update(states)
+                    if self._report_needed or monotonic() - last_report_time >= self.report_interval:
+                        self._report_clients()
+                        last_report_time = monotonic()
+            except redis.RedisError:
+                sleep(1)
+            except Exception:
+                logger.exception(f"Channels updates could not be read, retrying in {delay}s.")
+                sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _load(self) -> Dict[bytes, bytes]:
+        """Load last state of channels and return ids of last entries of their streams.
+
+        Channels without valid stream entry (stream was trimmed, Redis restarted,
+        or last entry can't be decoded) are read from their persistent attributes.
+        """
+        pipeline = self._redis.pipeline(transaction=False)
+        for stream in self._streams:
+            pipeline.xrevrange(stream, count=1)
+        last_ids, states, missing = {}, [], []
+        for (stream, endpoint), entries in zip(self._streams.items(), pipeline.execute()):
+            last_ids[stream] = entries[0][0] if entries else b"0-0"
+            parsed = parse_stream_entries(endpoint, entries)
+            states.extend(parsed)
+            if not parsed:
+                missing.append(endpoint)
+        states.extend(ChannelState.from_view(view) for view in ChannelView.get_many(missing))
+        self.update(states)
+        return last_ids
+
+    def update(self, states: Iterable[ChannelState]):
+        """Store given channel states and wake up waiting clients."""
+        with self._condition:
+            for state in states:
+                self._states[state.endpoint] = state
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def _report_clients(self):
+        with self._condition:
+            self._report_needed = False
+            counts = dict(self._clients)
+        pipeline = self._redis.pipeline()
+        pipeline.set(FANOUT_CLIENTS_KEY_PREFIX + self.process_id, json.dumps(counts), ex=int(3 * self.report_interval))
+        pipeline.sadd(FANOUT_PROCESSES_KEY, self.process_id)
+        pipeline.execute()
+
+    @contextmanager
+    def connect(self, endpoints: Iterable[str]):
+        """Count a client of given channels during context."""
+        endpoints = list(endpoints)
+        with self._condition:
+            for endpoint in endpoints:
+                self._clients[endpoint] += 1
+                if self._clients[endpoint] == 1:
+                    self._report_needed = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                for endpoint in endpoints:
+                    self._clients[endpoint] -= 1
+                    if self._clients[endpoint] == 0:
+                        self._report_needed = True
+
+    def wait_for_change(self, endpoint: str, version: Optional[int], timeout: float) -> Optional[ChannelState]:
+        """Return state of channel as soon as its version differs from given version.
+
+        Return None if version didn't change after timeout seconds.
+        """
+        self.start()
+        with self.connect([endpoint]), self._condition:
+            self._condition.wait_for(lambda: self._states.get(endpoint, ChannelState(endpoint, version, None, None)).version != version, timeout)
+            state = self._states.get(endpoint)
+        if state is None or state.version == version:
+            return None
+        return state
+
+    def listen(self, endpoints: Iterable[str], heartbeat_interval: float = 15) -> Iterator[Dict[str, ChannelState]]:
+        """Yield states of given channels, at each message received for any channel.
+
+        Yielded dicts, keyed by endpoint, only contain channels whose version
+        changed since previous iteration (all channels at first iteration, as
+        soon as data is fetched). An empty dict is yielded when nothing changed,
+        which is used for heartbeats, at least every heartbeat_interval seconds.
+        """
+        self.start()
+        endpoints = list(endpoints)
+        versions: Dict[str, int] = {}
+        sequence = None
+        with self.connect(endpoints):
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._sequence != sequence, heartbeat_interval)
+                    sequence = self._sequence
+                    states = [self._states[endpoint] for endpoint in endpoints if endpoint in self._states]
+                changed = {state.endpoint: state for state in states if versions.get(state.endpoint) != state.version}
+                versions.update((endpoint, state.version) for endpoint, state in changed.items())
+                yield changed
+
+
+class AsyncUpdatesFanout:
+    """asyncio counterpart of UpdatesFanout, used by the ASGI server (see async_server module).
+
+    A single task reads Redis streams of all channels with an async Redis
+    client (blocking XREAD), keeps data of channels in memory and wakes up
+    waiting clients. Waiting clients are coroutines awaiting an asyncio.Event, which
+    is replaced at each update: an idle client costs a few kilobytes.
+
+    Number of clients is reported in Redis for DemandMonitor, as UpdatesFanout does.
+    """
+
+    def __init__(self, endpoints: Iterable[str] = settings.CHANNELS, report_interval: float = 5):
+        self.endpoints = list(endpoints)
+        self.report_interval = report_interval
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.redis = redis.asyncio.Redis()
+        self._states: Dict[str, ChannelState] = {}
+        self._sequence = 0 # incremented at each received message
+        self._event = asyncio.Event()
+        self._clients: Counter = Counter()
+        self._report_needed = False
+        self._task: Optional[asyncio.Task] = None
+        self._streams = {RedisMixin.REDIS_STREAMS[endpoint].encode(): endpoint for endpoint in self.endpoints}
+
+    def start(self):
+        """Start background task if not running (it is started at first use)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.redis.aclose()
+
+    async def _run(self):
+        delay = 1 # see UpdatesFanout._run()
+        while True:
+            try:
+                last_ids = await self._load()
+                delay = 1
+                last_report_time = float("-inf")
+                while True:
+                    for stream, entries in await self.redis.xread(last_ids, block=1000) or []:
+                        last_ids[stream] = entries[-1][0]
+                        states = parse_stream_entries(self._streams[stream], entries)
+                        if states:
+                            self.update(states)
+                    if self._report_needed or monotonic() - last_report_time >= self.report_interval:
+                        await self._report_clients()
+                        last_report_time = monotonic()
+            except redis.RedisError:
+                await asyncio.sleep(1)
+            except Exception:
+                logger.exception(f"Channels updates could not be read, retrying in {delay}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    async def _load(self) -> Dict[bytes, bytes]:
+        """Load last state of channels and return ids of last entries of their streams (see UpdatesFanout._load())."""
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for stream in self._streams:
+                pipeline.xrevrange(stream, count=1)
+            all_entries = await pipeline.execute()
+        last_ids, states, missing = {}, [], []
+        for (stream, endpoint), entries in zip(self._streams.items(), all_entries):
+            last_ids[stream] = entries[0][0] if entries else b"0-0"
+            parsed = parse_stream_entries(endpoint, entries)
+            states.extend(parsed)
+            if not parsed:
+                missing.append(endpoint)
+        if missing:
+            fields = ChannelView.fields
+            raw_data = iter(await self.redis.mget([f"sunflower:channel:{endpoint}:{name}" for endpoint in missing for name in fields]))
+            for endpoint in missing:
+                values = {name: None if data is None else decode(data, as_metadata_type) for name, data in zip(fields, raw_data)}
+                states.append(ChannelState(endpoint, values["version"] or 0, values["metadata"], values["info"]))
+        self.update(states)
+        return last_ids
+
+    def update(self, states: Iterable[ChannelState]):
+        """Store given channel states and wake up waiting clients."""
+        for state in states:
+            self._states[state.endpoint] = state
+        self._sequence += 1
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def _report_clients(self):
+        self._report_needed = False
+        async with self.redis.pipeline() as pipeline:
+            pipeline.set(FANOUT_CLIENTS_KEY_PREFIX + self.process_id, json.dumps(dict(self._clients)), ex=int(3 * self.report_interval))
+            pipeline.sadd(FANOUT_PROCESSES_KEY, self.process_id)
+            await pipeline.execute()
+
+    @contextmanager
+    def connect(self, endpoints: Iterable[str]):
+        """Count a client of given channels during context."""
+        endpoints = list(endpoints)
+        for endpoint in endpoints:
+            self._clients[endpoint] += 1
+            self._report_needed |= self._clients[endpoint] == 1
+        try:
+            yield
+        finally:
+            for endpoint in endpoints:
+                self._clients[endpoint] -= 1
+                self._report_needed |= self._clients[endpoint] == 0
+
+    async def _wait(self, timeout: float) -> bool:
+        """Wait for next update at most timeout seconds. Return False on timeout."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def get_states(self, endpoints: Iterable[str], timeout: float = 5) -> Dict[str, ChannelState]:
+        """Return states of given channels, waiting at most timeout seconds for first fetch."""
+        self.start()
+        endpoints = list(endpoints)
+        while any(endpoint not in self._states for endpoint in endpoints) and await self._wait(timeout):
+            pass
+        return {endpoint: self._states[endpoint] for endpoint in endpoints if endpoint in self._states}
+
+    async def wait_for_change(self, endpoint: str, version: Optional[int], timeout: float) -> Optional[ChannelState]:
+        """Return state of channel as soon as its version differs from given version.
+
+        Return None if version didn't change after timeout seconds.
+        """
+        self.start()
+        deadline = monotonic() + timeout
+        with self.connect([endpoint]):
+            while True:
+                state = self._states.get(endpoint)
+                if state is not None and state.version != version:
+                    return state
+                if not await self._wait(deadline - monotonic()):
+                    return None
+
+    async def listen(self, endpoints: Iterable[str], heartbeat_interval: float = 15):
+        """Yield states of given channels whose version changed, as UpdatesFanout.listen() does."""
+        self.start()
+        endpoints = list(endpoints)
+        versions: Dict[str, int] = {}
+        sequence = None
+        with self.connect(endpoints):
+            while True:
+                if self._sequence == sequence:
+                    await self._wait(heartbeat_interval)
+                sequence = self._sequence
+                states = [self._states[endpoint] for endpoint in endpoints if endpoint in self._states]
+                changed = {state.endpoint: state for state in states if versions.get(state.endpoint) != state.version}
+                versions.update((endpoint, state.version) for endpoint, state in changed.items())
+                yield changed
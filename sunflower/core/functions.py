@@ -1,48 +1,148 @@
 # This file is part of sunflower package. radio
 # This module contains core functions.
 
+import hashlib
+import os
+from enum import Enum
+from typing import Iterator
+
+import redis
+
 from sunflower.core.bases import URLStation
 from sunflower.core.descriptors import PersistentAttribute
+from sunflower.core.persistence import RedisBackend
+
+LIQUIDSOAP_STRUCTURE_HEADER = "# structure: "
+
+
+class LiquidsoapConfigChange(Enum):
+    """Kind of change between running liquidsoap config and a generated one."""
+    NONE = "none"
+    TIMETABLE = "timetable" # can be applied at runtime, through interactive variables
+    STRUCTURE = "structure" # liquidsoap must be restarted
+
+
+def generate_liquidsoap_config(*channels, static_timetable=True):
+    """Return complete liquidsoap config as a string."""
+    # config de base (pas de log, activation server telnet, source par défaut)
+    config = "#! /usr/bin/env liquidsoap\n\n"
+    config += "# log file\n"
+    config += 'set("log.file", false)\n\n'
+    config += "# activate telnet server\n"
+    config += 'set("server.telnet", true)\n\n'
+    config += "# default source\n"
+    config += 'default = single("~/radio/franceinfo-long.ogg")\n\n'
+    config += "# streams\n"
+
+    # configuration des chaînes
+    # initialisation
+    used_stations = set()
+
+    # on récupère les infos de chaque chaîne
+    timetables = []
+    outputs = []
+    for channel in channels:
+        timetable, output = channel.get_liquidsoap_config(static_timetable)
+        timetables.append(timetable)
+        outputs.append(output)
+        used_stations.update(channel.stations)
+
+    # on commence par énumérer toutes les stations utilisées
+    # (triées pour que la configuration générée soit toujours la même)
+    for station in sorted(used_stations, key=lambda station: station.formated_station_name):
+        config += station.get_liquidsoap_config()
+        if URLStation in station.mro():
+            outputs.append("output.dummy({})".format(station.formated_station_name))
+
+    # puis on écrit les timetables
+    timetables_string = "\n".join(timetables)
+    config += "\n" + timetables_string
+
+    # et les output
+    outputs_string = "\n".join(outputs)
+    config += "\n" + outputs_string
+    return config
+
+
+def write_liquidsoap_config(*channels, filename) -> LiquidsoapConfigChange:
+    """Write complete liquidsoap config file if it changed, and return the kind of change.
+
+    Second line of the file contains a digest of the config without static
+    timetables. If the digest didn't change, changes only concern timetables:
+    they are applied by the scheduler through liquidsoap interactive variables
+    and liquidsoap doesn't need to be restarted.
+
+    File is written atomically (written in a temporary file, then renamed).
+    """
+    path = "{}.liq".format(filename)
+    structure = generate_liquidsoap_config(*channels, static_timetable=False)
+    digest = hashlib.sha1(structure.encode()).hexdigest()
+    shebang, config = generate_liquidsoap_config(*channels).split("\n", 1)
+    config = shebang + "\n" + LIQUIDSOAP_STRUCTURE_HEADER + digest + "\n" + config
+
+    try:
+        with open(path) as f:
+            running_config = f.read()
+    except FileNotFoundError:
+        running_config = ""
+    if running_config == config:
+        return LiquidsoapConfigChange.NONE
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        f.write(config)
+    os.replace(temporary_path, path)
+
+    running_config_lines = running_config.split("\n", 2)
+    if len(running_config_lines) > 1 and running_config_lines[1] == LIQUIDSOAP_STRUCTURE_HEADER + digest:
+        return LiquidsoapConfigChange.TIMETABLE
+    return LiquidsoapConfigChange.STRUCTURE
+
+
+def get_persistent_attributes(obj) -> Iterator[PersistentAttribute]:
+    """Yield PersistentAttribute descriptors of given object (including inherited ones)."""
+    for klass in type(obj).__mro__:
+        for attr in vars(klass).values():
+            if isinstance(attr, PersistentAttribute):
+                yield attr
+
+
+def migrate_persistent_attributes(*objects) -> int:
+    """Encode again data stored in Redis for persistent attributes of given objects with their codec.
+
+    Keys whose data was encoded by another codec (for example before a change of
+    settings.PERSISTENCE_CODEC) are thus converted. Expiration is kept. Keys written
+    during the migration (by the scheduler, with the right codec) are skipped.
+
+    Keys are read and written with the Redis connection of the backend of each
+    attribute; attributes stored by other backends are skipped.
 
-def write_liquidsoap_config(*channels, filename):
-    """Write complete liquidsoap config file."""
-    with open("{}.liq".format(filename), "w") as f:
-        # config de base (pas de log, activation server telnet, source par défaut)
-        f.write("#! /usr/bin/env liquidsoap\n\n")
-        f.write("# log file\n")
-        f.write('set("log.file", false)\n\n')
-        f.write("# activate telnet server\n")
-        f.write('set("server.telnet", true)\n\n')
-        f.write("# default source\n")
-        f.write('default = single("~/radio/franceinfo-long.ogg")\n\n')
-        f.write("# streams\n")
-
-        # configuration des chaînes
-        # initialisation
-        used_stations = set()
-
-        # on récupère les infos de chaque chaîne
-        timetables = []
-        outputs = []
-        for channel in channels:
-            timetable, output = channel.get_liquidsoap_config()
-            timetables.append(timetable)
-            outputs.append(output)
-            used_stations.update(channel.stations)
-
-        # on commence par énumérer toutes les stations utilisées
-        for station in used_stations:
-            f.write(station.get_liquidsoap_config())
-            if URLStation in station.mro():
-                outputs.append("output.dummy({})".format(station.formated_station_name))
-
-        # puis on écrit les timetables
-        timetables_string = "\n".join(timetables)
-        f.write("\n" + timetables_string)
-
-        # et les output
-        outputs_string = "\n".join(outputs)
-        f.write("\n" + outputs_string)
+    Return number of converted keys.
+    """
+    converted = 0
+    for obj in objects:
+        for attr in get_persistent_attributes(obj):
+            if not isinstance(attr.backend, RedisBackend):
+                continue
+            key = attr.get_key(obj)
+            with attr.backend._redis.pipeline() as pipeline:
+                try:
+                    pipeline.watch(key)
+                    data = pipeline.get(key)
+                    if data is None:
+                        continue
+                    new_data = attr.codec.encode(attr.codec.decode(data))
+                    if new_data == data:
+                        continue
+                    # remaining time to live in ms, negative if key doesn't expire
+                    ttl = pipeline.pttl(key)
+                    pipeline.multi()
+                    pipeline.set(key, new_data, px=ttl if ttl > 0 else None)
+                    pipeline.execute()
+                    converted += 1
+                except redis.WatchError:
+                    continue
+    return converted
 
 
 def check_obj_integrity(obj):
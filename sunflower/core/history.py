@@ -0,0 +1,180 @@
+# This file is part of sunflower package. radio
+# This module contains BroadcastHistory class, storing broadcasts of a channel for range queries.
+
+from datetime import date, datetime, timedelta, timezone
+from time import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from sunflower import settings
+from sunflower.core.mixins import RedisMixin
+from sunflower.core.types import MetadataDict, MetadataType
+
+# entry of a history stream: (id, fields)
+Entry = Tuple[bytes, Dict[bytes, bytes]]
+
+
+class BroadcastHistory(RedisMixin):
+    """Append-only history of metadata changes of a channel, stored in daily Redis streams.
+
+    Each change is an entry of sunflower:channel:{endpoint}:history:{day} stream
+    (day of the change, UTC), whose id is the time of the change in milliseconds
+    and whose fields are the non-empty fields of metadata listed in fields.
+    A range of time is thus read with one XRANGE per day, in O(log n + m),
+    without scanning. Consecutive identical entries (same broadcast refreshed)
+    are recorded once.
+
+    Streams of days older than detailed_days are downsampled: consecutive
+    entries of a same broadcast, and consecutive non-musical entries (ads,
+    transitions...) of a same station, are merged into their first entry.
+    Streams expire retention_days after their day.
+    """
+
+    fields = ("type", "station", "artist", "title", "album", "show_title", "end")
+    # entries of these types are distinct broadcasts even if they are consecutive
+    detailed_types = {MetadataType.MUSIC.value, MetadataType.PROGRAMME.value}
+
+    def __init__(
+        self,
+        endpoint: str,
+        retention_days: int = settings.HISTORY_RETENTION_DAYS,
+        detailed_days: int = settings.HISTORY_DETAILED_DAYS,
+        max_query_days: int = settings.HISTORY_MAX_QUERY_DAYS,
+    ):
+        super().__init__()
+        self.endpoint = endpoint
+        self.retention_days = retention_days
+        self.detailed_days = detailed_days
+        self.max_query_days = max_query_days
+        self._last_fields: Optional[Dict[str, str]] = None
+        self._last_downsampled_day: Optional[date] = None
+
+    def key(self, day: date) -> str:
+        return f"sunflower:channel:{self.endpoint}:history:{day.isoformat()}"
+
+    @staticmethod
+    def day_of(timestamp: float) -> date:
+        return datetime.fromtimestamp(timestamp, timezone.utc).date()
+
+    def expiration_time(self, day: date) -> int:
+        """Return timestamp at which stream of given day expires."""
+        day_end = datetime.combine(day, datetime.min.time(), timezone.utc) + timedelta(days=1)
+        return int(day_end.timestamp()) + self.retention_days * 86400
+
+    @classmethod
+    def compact(cls, metadata: MetadataDict) -> Dict[str, str]:
+        """Return fields of history entry of given metadata."""
+        compacted = {}
+        for field in cls.fields:
+            value = metadata.get(field)
+            if isinstance(value, MetadataType):
+                value = value.value
+            if value not in (None, ""):
+                compacted[field] = str(value)
+        return compacted
+
+    @classmethod
+    def merge_key(cls, fields: Dict[bytes, bytes]) -> Tuple:
+        """Return key of entry: consecutive entries with the same key are merged when downsampling."""
+        if fields.get(b"type", b"").decode() in cls.detailed_types:
+            return tuple(sorted((field, value) for field, value in fields.items() if field != b"end"))
+        return fields.get(b"type"), fields.get(b"station")
+
+    @classmethod
+    def downsample(cls, entries: Iterable[Entry]) -> List[Entry]:
+        """Merge consecutive entries with same key (see merge_key()), keeping id of first one and end of last one."""
+        downsampled: List[Entry] = []
+        last_key = None
+        for entry_id, fields in entries:
+            key = cls.merge_key(fields)
+            if downsampled and key == last_key:
+                if b"end" in fields:
+                    downsampled[-1][1][b"end"] = fields[b"end"]
+                continue
+            downsampled.append((entry_id, dict(fields)))
+            last_key = key
+        return downsampled
+
+    def record(self, metadata: MetadataDict, now: Optional[datetime] = None) -> Optional[bytes]:
+        """Append metadata to history if it changed since last call and return entry id (else None).
+
+        Once a day, stream of the day which is not detailed anymore is downsampled.
+        """
+        timestamp = time() if now is None else now.timestamp()
+        fields = self.compact(metadata)
+        entry_id = None
+        if {**fields, "end": None} != {**(self._last_fields or {}), "end": None}:
+            entry_id = self._append(fields, timestamp)
+        self._last_fields = fields
+        day = self.day_of(timestamp) - timedelta(days=self.detailed_days + 1)
+        if day != self._last_downsampled_day:
+            self.downsample_day(day)
+            self._last_downsampled_day = day
+        return entry_id
+
+    def _append(self, fields: Dict[str, str], timestamp: float) -> bytes:
+        day = self.day_of(timestamp)
+        pipeline = self._redis.pipeline(transaction=False)
+        # explicit milliseconds with automatic sequence (Redis >= 7)
+        pipeline.xadd(self.key(day), fields, id=f"{int(timestamp * 1000)}-*")
+        pipeline.expireat(self.key(day), self.expiration_time(day))
+        try:
+            entry_id, _ = pipeline.execute()
+        except redis.ResponseError:
+            # older Redis version or clock going backwards: let Redis choose id
+            entry_id = self._redis.xadd(self.key(day), fields)
+        return entry_id
+
+    def downsample_day(self, day: date) -> bool:
+        """Downsample stream of given day (see downsample()). Return True if it was rewritten."""
+        key = self.key(day)
+        entries = self._redis.xrange(key)
+        downsampled = self.downsample(entries)
+        if len(downsampled) == len(entries):
+            return False
+        tmp_key = key + ":tmp"
+        pipeline = self._redis.pipeline(transaction=True)
+        pipeline.delete(tmp_key)
+        for entry_id, fields in downsampled:
+            pipeline.xadd(tmp_key, fields, id=entry_id)
+        pipeline.rename(tmp_key, key)
+        pipeline.expireat(key, self.expiration_time(day))
+        pipeline.execute()
+        return True
+
+    @staticmethod
+    def format_entry(entry: Entry) -> Dict[str, Any]:
+        entry_id, fields = entry
+        data: Dict[str, Any] = {"start": int(entry_id.split(b"-")[0]) / 1000}
+        for field, value in fields.items():
+            data[field.decode()] = value.decode()
+        if "end" in data:
+            data["end"] = int(data["end"])
+        return data
+
+    def get_range(self, start: float, end: float) -> List[Dict[str, Any]]:
+        """Return broadcasts between start and end timestamps, oldest first.
+
+        First broadcast is the one being broadcast at start, if it is known.
+        Raise ValueError if range is empty or longer than max_query_days.
+        """
+        if end < start:
+            raise ValueError("End of range is before its start.")
+        if end - start > self.max_query_days * 86400:
+            raise ValueError(f"Range can't be longer than {self.max_query_days} days.")
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        first_day, last_day = self.day_of(start), self.day_of(end)
+        pipeline = self._redis.pipeline(transaction=False)
+        # broadcast at start, recorded on start day or the day before
+        pipeline.xrevrange(self.key(first_day), max=start_ms, count=1)
+        pipeline.xrevrange(self.key(first_day - timedelta(days=1)), count=1)
+        day = first_day
+        while day <= last_day:
+            pipeline.xrange(self.key(day), min=f"({start_ms}", max=end_ms)
+            day += timedelta(days=1)
+        current, previous, *days_entries = pipeline.execute()
+        entries = current or previous
+        for day_entries in days_entries:
+            entries.extend(day_entries)
+        return [self.format_entry(entry) for entry in entries]
@@ -0,0 +1,114 @@
+# This file is part of sunflower package. radio
+# This module contains LeaseManager class, used by sharded schedulers.
+
+import hashlib
+import math
+import os
+import socket
+import uuid
+from time import time
+from typing import Callable, Iterable, Optional, Set
+
+from sunflower.core.mixins import RedisMixin
+
+# renew lease only if it is still owned by the worker
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# release lease only if it is still owned by the worker
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseManager(RedisMixin):
+    """Share objects to process between several scheduler workers thanks to Redis leases.
+
+    Each worker sends a heartbeat at each iteration (sunflower:scheduler:workers
+    sorted set, score = timestamp of last heartbeat). Workers whose heartbeat is older
+    than lease_duration are considered dead.
+
+    An object is processed by the worker holding its lease (sunflower:scheduler:lease:{name}
+    key, containing worker id and expiring after lease_duration seconds). At each
+    iteration, rebalance():
+    - renews leases held by the worker;
+    - releases leases above fair share (number of objects / number of live workers),
+      so that new workers get objects;
+    - claims free leases up to fair share (dead workers' leases are free once expired).
+
+    Each worker claims objects in its own order (rendezvous hashing), so that
+    workers don't try to claim the same objects at the same time.
+    """
+
+    workers_key = "sunflower:scheduler:workers"
+    lease_key_prefix = "sunflower:scheduler:lease:"
+
+    def __init__(self, worker_id: Optional[str] = None, lease_duration: float = 20):
+        super().__init__()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_duration = lease_duration
+        self.owned: Set[str] = set()
+        self._renew_script = self._redis.register_script(RENEW_SCRIPT)
+        self._release_script = self._redis.register_script(RELEASE_SCRIPT)
+
+    def _preference(self, name: str) -> str:
+        return hashlib.sha1(f"{self.worker_id}:{name}".encode()).hexdigest()
+
+    def heartbeat(self) -> int:
+        """Tell other workers this one is alive, forget dead workers and return number of live workers."""
+        now = time()
+        pipeline = self._redis.pipeline()
+        pipeline.zadd(self.workers_key, {self.worker_id: now})
+        pipeline.zremrangebyscore(self.workers_key, "-inf", now - self.lease_duration)
+        pipeline.zcard(self.workers_key)
+        return pipeline.execute()[-1]
+
+    def rebalance(self, names: Iterable[str], before_release: Optional[Callable[[str], None]] = None) -> Set[str]:
+        """Renew, release and claim leases among names and return names owned by this worker.
+
+        If given, before_release is called with name of each lease released
+        above fair share, before it is released (for checkpointing state of
+        objects, so that their next owner restores up to date state).
+        """
+        names = sorted(set(names), key=self._preference)
+        fair_share = math.ceil(len(names) / self.heartbeat())
+        lease_duration_ms = int(self.lease_duration * 1000)
+
+        # renew owned leases (leases expired and claimed by another worker are lost)
+        owned = sorted(self.owned & set(names), key=self._preference)
+        renewed = [self._renew_script(keys=[self.lease_key_prefix + name], args=[self.worker_id, lease_duration_ms]) for name in owned]
+        self.owned = {name for (name, success) in zip(owned, renewed) if success}
+
+        # release leases above fair share, least preferred first
+        for name in sorted(self.owned, key=self._preference)[fair_share:]:
+            if before_release is not None:
+                before_release(name)
+            self.release(name)
+
+        # claim free leases up to fair share
+        for name in names:
+            if len(self.owned) >= fair_share:
+                break
+            if name in self.owned:
+                continue
+            if self._redis.set(self.lease_key_prefix + name, self.worker_id, nx=True, px=lease_duration_ms):
+                self.owned.add(name)
+        return set(self.owned)
+
+    def release(self, name: str):
+        """Release lease of given name."""
+        self._release_script(keys=[self.lease_key_prefix + name], args=[self.worker_id])
+        self.owned.discard(name)
+
+    def release_all(self):
+        """Release all leases and leave the workers set (when worker stops)."""
+        for name in list(self.owned):
+            self.release(name)
+        self._redis.zrem(self.workers_key, self.worker_id)
@@ -0,0 +1,262 @@
+# This file is part of sunflower package. radio
+# This module contains indexes of songs library served by the web server.
+
+import hashlib
+import json
+import re
+import unicodedata
+from collections import defaultdict
+from itertools import groupby
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sunflower import settings
+from sunflower.core.mixins import RedisMixin
+from sunflower.core.types import Song
+
+
+class PlaylistIndex(RedisMixin):
+    """Playlist of a station grouped by artist, sorted and paginated, stored in Redis.
+
+    Index is built by the station when its library changes, so that the
+    server reads only requested page or artist. Keys (prefixed by
+    sunflower:station:{endpoint}:playlist):
+    - :pages: list of pages, each page being a json list of artist groups
+      ({"artist": ..., "songs": [{"title": ..., "album": ...}, ...]}). Pages
+      contain whole groups and at least page_size songs (except last one);
+    - :artists: hash case folded artist -> json {"artist": ..., "page": page
+      number, "songs": [...]};
+    - :digest: digest of indexed songs, so that unchanged library is not indexed again.
+
+    Artists are compared case insensitively: songs of "Artist" and "ARTIST"
+    belong to the same group, named after its first song.
+
+    Keys are written in a transaction: readers never see a partial index.
+    Page numbers start at 1.
+    """
+
+    # changed when format of stored data changes, so that indexes are rebuilt
+    format_version = 2
+
+    def __init__(self, endpoint: str, page_size: int = settings.PLAYLIST_PAGE_SIZE, expiration_delay: int = 172800):
+        super().__init__()
+        self.endpoint = endpoint
+        self.page_size = page_size
+        self.expiration_delay = expiration_delay
+        prefix = f"sunflower:station:{endpoint}:playlist"
+        self.pages_key = prefix + ":pages"
+        self.artists_key = prefix + ":artists"
+        self.digest_key = prefix + ":digest"
+
+    @staticmethod
+    def group_by_artist(songs: Iterable[Song]) -> List[Dict[str, Any]]:
+        """Return artist groups of given songs, sorted by artist then by title (case insensitive)."""
+        sorted_songs = sorted(songs, key=lambda song: (song.artist.casefold(), song.title.casefold()))
+        groups = []
+        for _, artist_songs in groupby(sorted_songs, key=lambda song: song.artist.casefold()):
+            artist_songs = list(artist_songs)
+            groups.append({"artist": artist_songs[0].artist, "songs": [{"title": song.title, "album": song.album} for song in artist_songs]})
+        return groups
+
+    def paginate(self, groups: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split artist groups in pages of at least page_size songs (without splitting groups)."""
+        pages: List[List[Dict[str, Any]]] = []
+        page: List[Dict[str, Any]] = []
+        page_length = 0
+        for group in groups:
+            page.append(group)
+            page_length += len(group["songs"])
+            if page_length >= self.page_size:
+                pages.append(page)
+                page, page_length = [], 0
+        if page:
+            pages.append(page)
+        return pages
+
+    def persist(self, songs: Iterable[Song]) -> bool:
+        """Index given songs if they changed since last indexing, else refresh expiration.
+
+        Return True if index was rebuilt.
+        """
+        groups = self.group_by_artist(songs)
+        digest = hashlib.sha1(json.dumps([self.format_version, groups]).encode()).hexdigest()
+        if self._redis.get(self.digest_key) == digest.encode():
+            pipeline = self._redis.pipeline()
+            for key in (self.pages_key, self.artists_key, self.digest_key):
+                pipeline.expire(key, self.expiration_delay)
+            pipeline.execute()
+            return False
+        pages = self.paginate(groups)
+        pipeline = self._redis.pipeline(transaction=True)
+        pipeline.delete(self.pages_key, self.artists_key)
+        if pages:
+            pipeline.rpush(self.pages_key, *(json.dumps(page) for page in pages))
+            pipeline.hset(self.artists_key, mapping={
+                group["artist"].casefold(): json.dumps({"artist": group["artist"], "page": number, "songs": group["songs"]})
+                for number, page in enumerate(pages, 1) for group in page
+            })
+            pipeline.expire(self.pages_key, self.expiration_delay)
+            pipeline.expire(self.artists_key, self.expiration_delay)
+        pipeline.set(self.digest_key, digest, ex=self.expiration_delay)
+        pipeline.execute()
+        return True
+
+    def get_page(self, number: int) -> Optional[Dict[str, Any]]:
+        """Return given page with number of pages and artists, or None if page doesn't exist."""
+        if number < 1:
+            return None
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.lindex(self.pages_key, number - 1)
+        pipeline.llen(self.pages_key)
+        pipeline.hlen(self.artists_key)
+        page, pages_count, artists_count = pipeline.execute()
+        if page is None:
+            return None
+        return {"page": number, "pages": pages_count, "artists_count": artists_count, "artists": json.loads(page)}
+
+    def get_artist(self, artist: str) -> Optional[Dict[str, Any]]:
+        """Return name, page number and songs of given artist (case insensitive), or None if artist is unknown."""
+        data = self._redis.hget(self.artists_key, artist.casefold())
+        if data is None:
+            return None
+        return json.loads(data)
+
+
+def fold(text: str) -> str:
+    """Return text without accents, case folded ("Émile" -> "emile")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Return folded words of text."""
+    return re.findall(r"\w+", fold(text or ""))
+
+
+class SearchResults(NamedTuple):
+    """Songs found by SearchIndex.search(), best matches first."""
+    songs: List[Dict[str, Any]]
+    truncated: bool # True if some songs matching the query may be missing
+
+
+class SearchIndex(RedisMixin):
+    """Prefix index of artist, album and title of songs of a station, stored in Redis.
+
+    Keys (prefixed by sunflower:station:{endpoint}:search):
+    - :tokens: sorted set whose members are "{token}\\x00{field}\\x00{song id}"
+      (all scores being 0, members are sorted lexicographically), tokens
+      being folded words (see fold()). Songs whose words start with a prefix
+      are found with ZRANGEBYLEX in O(log n + matches);
+    - :songs: hash song id -> json {"artist": ..., "album": ..., "title": ...}.
+
+    Song ids are derived from paths and tags. update() only adds new songs
+    and removes deleted ones, so that a library scan costs few writes.
+
+    A song matches a query if each word of the query is a prefix of one of
+    its words. Matches are ranked by matched field (title, then artist, then
+    album), exact words ranking before prefixes.
+
+    Candidates are the songs matching the rarest word of the query (counted
+    with ZLEXCOUNT), at most max_candidates index members: other words are
+    checked against tags of candidates. Results are marked as truncated if
+    the rarest word has more members.
+    """
+
+    # score of a matched word by field
+    field_weights = {"t": 3, "a": 2, "l": 1}
+    fields = {"t": "title", "a": "artist", "l": "album"}
+
+    def __init__(self, endpoint: str, max_candidates: int = 5000):
+        super().__init__()
+        self.endpoint = endpoint
+        self.max_candidates = max_candidates # maximal number of index members matching the rarest word of a query
+        prefix = f"sunflower:station:{endpoint}:search"
+        self.tokens_key = prefix + ":tokens"
+        self.songs_key = prefix + ":songs"
+
+    @staticmethod
+    def song_id(song: Song) -> str:
+        """Return id of song, changing if song file is moved or retagged."""
+        return hashlib.sha1("\x00".join((song.path, song.artist, song.album or "", song.title)).encode()).hexdigest()[:16]
+
+    @classmethod
+    def members(cls, song_id: str, data: Dict[str, Optional[str]]) -> Set[str]:
+        """Return members of tokens sorted set for song with given id and data."""
+        return {
+            f"{token}\x00{code}\x00{song_id}"
+            for code, field in cls.fields.items()
+            for token in tokenize(data.get(field))
+        }
+
+    def update(self, songs: Iterable[Song]) -> Tuple[int, int]:
+        """Index new songs and remove songs not in given songs. Return numbers of added and removed songs."""
+        songs = {self.song_id(song): {"artist": song.artist, "album": song.album, "title": song.title} for song in songs}
+        indexed_ids = {song_id.decode() for song_id in self._redis.hkeys(self.songs_key)}
+        added_ids = songs.keys() - indexed_ids
+        removed_ids = list(indexed_ids - songs.keys())
+        pipeline = self._redis.pipeline(transaction=True)
+        if removed_ids:
+            removed_members = set()
+            for song_id, data in zip(removed_ids, self._redis.hmget(self.songs_key, removed_ids)):
+                if data is not None:
+                    removed_members |= self.members(song_id, json.loads(data))
+            if removed_members:
+                pipeline.zrem(self.tokens_key, *removed_members)
+            pipeline.hdel(self.songs_key, *removed_ids)
+        if added_ids:
+            added_members = set().union(*(self.members(song_id, songs[song_id]) for song_id in added_ids))
+            if added_members:
+                pipeline.zadd(self.tokens_key, dict.fromkeys(added_members, 0))
+            pipeline.hset(self.songs_key, mapping={song_id: json.dumps(songs[song_id]) for song_id in added_ids})
+        pipeline.execute()
+        return len(added_ids), len(removed_ids)
+
+    @classmethod
+    def rank(cls, words: List[str], matches: Dict[str, Iterable[str]], limit: int) -> List[str]:
+        """Return ids of best songs matching all given words.
+
+        matches contains members of tokens sorted set matching each word.
+        """
+        scores: Dict[str, float] = {}
+        for number, word in enumerate(words):
+            word_scores: Dict[str, float] = defaultdict(float)
+            for member in matches[word]:
+                token, code, song_id = member.split("\x00")
+                if number > 0 and song_id not in scores:
+                    continue
+                score = cls.field_weights[code] * (2 if token == word else 1)
+                word_scores[song_id] = max(word_scores[song_id], score)
+            scores = {song_id: scores.get(song_id, 0) + score for song_id, score in word_scores.items()}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda song_id: (-scores[song_id], song_id))[:limit]
+
+    def search(self, query: str, limit: int = 20) -> SearchResults:
+        """Return songs matching query (see rank()), best matches first."""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return SearchResults([], False)
+        pipeline = self._redis.pipeline(transaction=False)
+        for word in words:
+            pipeline.zlexcount(self.tokens_key, b"[" + word.encode(), b"[" + word.encode() + b"\xff")
+        counts = dict(zip(words, pipeline.execute()))
+        # rarest word first: it gives the fewest candidates
+        words.sort(key=counts.__getitem__)
+        if counts[words[0]] == 0:
+            return SearchResults([], False)
+        members = self._redis.zrangebylex(self.tokens_key, b"[" + words[0].encode(), b"[" + words[0].encode() + b"\xff", start=0, num=self.max_candidates)
+        matches = {words[0]: [member.decode() for member in members]}
+        songs: Dict[str, Dict[str, Any]] = {}
+        if len(words) > 1:
+            songs = self._get_songs(list(dict.fromkeys(member.split("\x00")[2] for member in matches[words[0]])))
+            candidate_members = [member for song_id, data in songs.items() for member in self.members(song_id, data)]
+            for word in words[1:]:
+                matches[word] = [member for member in candidate_members if member.startswith(word)]
+        song_ids = self.rank(words, matches, limit)
+        songs.update(self._get_songs([song_id for song_id in song_ids if song_id not in songs]))
+        return SearchResults([songs[song_id] for song_id in song_ids if song_id in songs], counts[words[0]] > self.max_candidates)
+
+    def _get_songs(self, song_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return data of indexed songs with given ids, by id."""
+        if not song_ids:
+            return {}
+        return {song_id: json.loads(data) for song_id, data in zip(song_ids, self._redis.hmget(self.songs_key, song_ids)) if data is not None}
@@ -0,0 +1,187 @@
+# This file is part of sunflower package. radio
+# This module contains liquidsoap telnet client.
+
+import socket
+import threading
+from datetime import datetime
+from logging import Logger
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class LiquidsoapError(RuntimeError):
+    """Raised when liquidsoap can't be reached or replies with an error."""
+
+
+class LiquidsoapReply(NamedTuple):
+    command: str
+    lines: List[str]
+    duration: float # seconds between sending of the command and reception of the reply
+
+    @property
+    def request_id(self) -> Optional[int]:
+        """Request id returned by liquidsoap (for example by push command), or None."""
+        if len(self.lines) == 1 and self.lines[0].isdigit():
+            return int(self.lines[0])
+        return None
+
+    @property
+    def request_ids(self) -> List[int]:
+        """Request ids listed by liquidsoap (for example by queue or request.on_air commands)."""
+        return [int(word) for line in self.lines for word in line.split() if word.isdigit()]
+
+    @property
+    def metadata(self) -> Dict[str, str]:
+        """Metadata returned by request.metadata command, as a dict."""
+        metadata = {}
+        for line in self.lines:
+            key, sep, value = line.partition("=")
+            if sep:
+                metadata[key.strip()] = value.strip().strip('"')
+        return metadata
+
+
+class LiquidsoapClient:
+    """Long-lived client for liquidsoap telnet server.
+
+    Connection is opened at first command and kept open. As liquidsoap closes
+    idle connections (server.timeout setting), the client reconnects when the
+    connection is found closed and sends again commands which got no reply.
+
+    Commands sent together are pipelined: they are written at once and replies
+    (lines ended by "END") are read afterwards, in order. Commands can also be
+    queued with enqueue() and sent together with flush().
+
+    A lock makes the client usable from several threads.
+    """
+
+    END_MARKER = "END"
+
+    def __init__(self, host: str = "localhost", port: int = 1234, timeout: float = 2, logger: Optional[Logger] = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.logger = logger
+        self._socket: Optional[socket.socket] = None
+        self._buffer = b""
+        self._lock = threading.RLock()
+        self._queued_commands: List[Tuple[str, Optional[Callable[[LiquidsoapReply], None]]]] = []
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._buffer = b""
+
+    def close(self):
+        """Close connection (it is opened again at next command)."""
+        with self._lock:
+            if self._socket is None:
+                return
+            try:
+                self._socket.sendall(b"exit\n")
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+
+    def _read_reply(self) -> List[str]:
+        """Read lines until END marker. Raise ConnectionError if connection is closed."""
+        lines = []
+        while True:
+            while b"\n" not in self._buffer:
+                data = self._socket.recv(4096)
+                if not data:
+                    raise ConnectionError("Connection closed by liquidsoap.")
+                self._buffer += data
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            line = line.decode().rstrip("\r")
+            if line == self.END_MARKER:
+                return lines
+            lines.append(line)
+
+    def _send(self, commands: List[str], replies: List[LiquidsoapReply]):
+        """Write commands at once and append their replies to replies list."""
+        start = perf_counter()
+        self._socket.sendall("".join(command + "\n" for command in commands).encode())
+        for command in commands:
+            lines = self._read_reply()
+            replies.append(LiquidsoapReply(command, lines, perf_counter() - start))
+
+    def execute(self, *commands: str) -> List[LiquidsoapReply]:
+        """Send commands at once and return their replies (LiquidsoapReply objects) in order.
+
+        If connection is found closed, reconnect and send again commands without reply.
+        Raise LiquidsoapError if liquidsoap can't be reached or doesn't reply in time.
+        """
+        with self._lock:
+            replies: List[LiquidsoapReply] = []
+            for attempt in range(2):
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    self._send(list(commands[len(replies):]), replies)
+                    break
+                except socket.timeout as err:
+                    # command may have been executed, don't send it again
+                    self._drop_connection()
+                    raise LiquidsoapError(f"Liquidsoap did not reply in time to {commands[len(replies)]!r}.") from err
+                except OSError as err:
+                    # ConnectionError included: liquidsoap closed the connection (idle timeout, restart...)
+                    self._drop_connection()
+                    if attempt:
+                        raise LiquidsoapError(f"Can't reach liquidsoap at {self.host}:{self.port}: {err}") from err
+            if self.logger is not None:
+                for reply in replies:
+                    self.logger.debug(f"liquidsoap command={reply.command!r} reply={reply.lines} duration={reply.duration * 1000:.1f}ms")
+            return replies
+
+    def _drop_connection(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+
+    def enqueue(self, command: str, callback: Optional[Callable[[LiquidsoapReply], None]] = None):
+        """Queue a command, sent with other queued commands at next flush().
+
+        If given, callback is called with the reply of the command.
+        """
+        with self._lock:
+            self._queued_commands.append((command, callback))
+
+    def flush(self) -> List[LiquidsoapReply]:
+        """Send all queued commands at once and return their replies."""
+        with self._lock:
+            queued_commands, self._queued_commands = self._queued_commands, []
+            if not queued_commands:
+                return []
+            replies = self.execute(*(command for command, _ in queued_commands))
+        for reply, (_, callback) in zip(replies, queued_commands):
+            if callback is not None:
+                callback(reply)
+        return replies
+
+    def push(self, queue_id: str, uri: str) -> int:
+        """Push uri in request.queue source with id queue_id and return request id."""
+        reply = self.execute(f"{queue_id}.push {uri}")[0]
+        if reply.request_id is None:
+            raise LiquidsoapError(f"Unexpected reply to {reply.command!r}: {reply.lines}")
+        return reply.request_id
+
+    def queue(self, queue_id: str) -> List[int]:
+        """Return ids of requests waiting in request.queue source with id queue_id."""
+        return self.execute(f"{queue_id}.queue")[0].request_ids
+
+    def on_air(self) -> List[int]:
+        """Return ids of requests currently on air."""
+        return self.execute("request.on_air")[0].request_ids
+
+    def metadata(self, request_id: int) -> Dict[str, str]:
+        """Return metadata of given request."""
+        return self.execute(f"request.metadata {request_id}")[0].metadata
+
+
+def parse_on_air(metadata: Dict[str, str]) -> Optional[datetime]:
+    """Return datetime when request started to be played, from request metadata, or None."""
+    on_air = metadata.get("on_air")
+    if not on_air:
+        return None
+    return datetime.strptime(on_air, "%Y/%m/%d %H:%M:%S")
@@ -2,11 +2,13 @@
 # Mixins
 
 import json
-from typing import Any, Type, Optional
+from typing import Any, Dict, Type, Optional
 
 import redis
 
 from sunflower import settings
+from sunflower.core.codecs import decode
+from sunflower.core.liquidsoap import LiquidsoapClient
 
 class RedisMixin:
     """Provide a method to access data from redis database.
@@ -15,8 +17,8 @@ class RedisMixin:
     to access.
     """
     
-    # keep a dict containing name of Redis channels for pubsub
-    REDIS_CHANNELS = {name: "sunflower:channel:" + name for name in settings.CHANNELS}
+    # keep a dict containing keys of Redis streams of channels updates
+    REDIS_STREAMS = {name: f"sunflower:channel:{name}:events" for name in settings.CHANNELS}
 
     __slots__ = ("_redis",)
 
@@ -26,13 +28,13 @@ class RedisMixin:
     def get_from_redis(self, key, object_hook=None):
         """Get value for given key from Redis.
         
-        Data got from Redis is loaded from json with given object_hook.
-        If no data is found, return None.
+        Data got from Redis is decoded whatever its codec (see codecs module),
+        json data being loaded with given object_hook. If no data is found, return None.
         """
         raw_data = self._redis.get(key)
         if raw_data is None:
             return None
-        return json.loads(raw_data.decode(), object_hook=object_hook)
+        return decode(raw_data, object_hook)
     
     def set_to_redis(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None, expiration_delay: int = 86400):
         """Set new value for given key in Redis.
@@ -42,19 +44,28 @@ class RedisMixin:
         json_data = json.dumps(value, cls=json_encoder_cls)
         return self._redis.set(key, json_data, ex=expiration_delay)
 
-    def publish_to_redis(self, channel, data):
-        """publish a message to a redis channel.
+    def publish_to_stream(self, channel: str, fields: Dict[str, Any], maxlen: int = settings.EVENTS_STREAM_MAXLEN) -> bytes:
+        """Append an entry to the Redis stream of a channel and return its id.
 
         Parameters:
         - channel (str): channel name
-        - data (jsonable data or str): data to publish
-        
-        channel in redis is prefixed with 'sunflower:'.
+        - fields (dict): fields of the entry (str, bytes or numbers)
+
+        Stream is capped to about maxlen entries, so that readers that were
+        disconnected can catch up from their last entry id (see UpdatesFanout).
         """
-        assert channel in self.REDIS_CHANNELS, "Channel not defined in settings."
-        if not isinstance(data, str):
-            data = json.dumps(data)
-        self._redis.publish(self.REDIS_CHANNELS[channel], data)
+        assert channel in self.REDIS_STREAMS, "Channel not defined in settings."
+        return self._redis.xadd(self.REDIS_STREAMS[channel], fields, maxlen=maxlen, approximate=True)
+
+
+class LiquidsoapMixin:
+    """Provide access to liquidsoap telnet server.
+
+    All objects share the same LiquidsoapClient, so only one connection
+    is kept open by process.
+    """
+
+    liquidsoap = LiquidsoapClient(settings.LIQUIDSOAP_TELNET_HOST, settings.LIQUIDSOAP_TELNET_PORT)
 
 
 class HTMLMixin:
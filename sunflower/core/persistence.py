@@ -0,0 +1,251 @@
+# This file is part of sunflower package. radio
+# This module contains persistence backends used by PersistentAttribute descriptor.
+
+import logging
+import threading
+from time import monotonic
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import redis
+
+from sunflower.core.codecs import Codec
+from sunflower.core.mixins import RedisMixin
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceBackend:
+    """Base class for persistence backends.
+
+    Values are serialized with given codec (see codecs module): get() returns
+    a value decoded by codec, set() stores a value encoded by codec, expiring
+    after expiration_delay seconds (never if None).
+    """
+
+    def get(self, key: str, codec: Codec) -> Any:
+        """Return value stored at key, or None."""
+        raise NotImplementedError("get() must be implemented")
+
+    def get_many(self, requests: Sequence[Tuple[str, Codec]]) -> List[Any]:
+        """Return values stored at given keys, each one decoded with its codec.
+
+        Backends can override it to fetch all values in one round trip.
+        """
+        return [self.get(key, codec) for key, codec in requests]
+
+    def set(self, key: str, value: Any, codec: Codec, expiration_delay: Optional[int] = None):
+        """Store value at key."""
+        raise NotImplementedError("set() must be implemented")
+
+
+class RedisBackend(PersistenceBackend, RedisMixin):
+    """Store values in Redis database."""
+
+    def get(self, key, codec):
+        data = self._redis.get(key)
+        if data is None:
+            return None
+        return codec.decode(data)
+
+    def get_many(self, requests):
+        if not requests:
+            return []
+        all_data = self._redis.mget([key for key, _ in requests])
+        return [None if data is None else codec.decode(data) for data, (_, codec) in zip(all_data, requests)]
+
+    def set(self, key, value, codec, expiration_delay=None):
+        self._redis.set(key, codec.encode(value), ex=expiration_delay)
+
+
+class MemoryBackend(PersistenceBackend):
+    """Store values in a dict, in current process. Used for tests and benchmarks.
+
+    Values are serialized as in Redis, so that stored data behaves the same way
+    (tuples become lists, objects must be serializable...).
+    """
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {} # key -> (encoded value, expiration time or None)
+
+    def get(self, key, codec):
+        data, expiration_time = self.data.get(key, (None, None))
+        if data is None:
+            return None
+        if expiration_time is not None and expiration_time <= monotonic():
+            del self.data[key]
+            return None
+        return codec.decode(data)
+
+    def set(self, key, value, codec, expiration_delay=None):
+        expiration_time = None if expiration_delay is None else monotonic() + expiration_delay
+        self.data[key] = (codec.encode(value), expiration_time)
+
+
+class _CacheEntry:
+    __slots__ = ("data", "values", "expiration_time")
+
+    def __init__(self, data: Optional[bytes], expiration_time: float):
+        self.data = data
+        self.values: Dict[Codec, Any] = {} # codec -> decoded value
+        self.expiration_time = expiration_time
+
+
+class CachedRedisBackend(RedisBackend):
+    """Redis backend with a write-through cache in current process.
+
+    Values read or written are kept in a local dict, and decoded values are
+    memoized by codec: repeated reads cost a dict lookup. Returned values
+    are thus shared and must not be mutated.
+
+    Cache entries are invalidated:
+    - by Redis keyspace notifications for keys written by other processes;
+    - after max_age seconds, in case a notification was missed;
+    - when the stored value expires.
+
+    Keyspace notifications of generic, string and expired events ("K$gx" at
+    least) must be enabled on the Redis server (notify-keyspace-events), as
+    the backend doesn't change server configuration. If they are not (or if
+    CONFIG GET is not allowed), a warning is logged and values are not cached,
+    as writes of other processes could not be seen before max_age seconds.
+
+    Notifications of writes made by this backend are ignored, so that they don't
+    invalidate freshly written values: each write registers the events it
+    triggers ("set", and "expire" for values with an expiration delay) in
+    _own_writes, with a deadline after which an event that never arrived is
+    forgotten and stops hiding notifications of other processes.
+    """
+
+    keyspace_pattern = "sunflower:*"
+    # seconds after which an expected notification of an own write is forgotten
+    own_write_timeout = 5
+
+    def __init__(self, max_age: float = 60, notifications: bool = True):
+        super().__init__()
+        self.max_age = max_age
+        self.notifications = notifications
+        self._cache: Dict[str, _CacheEntry] = {}
+        self._own_writes: Dict[Tuple[str, str], List[float]] = {} # (key, event) -> deadlines
+        self._generation = 0 # incremented at each invalidation
+        self._lock = threading.Lock()
+        self._listener: Optional[redis.client.PubSubWorkerThread] = None
+
+    def _start_listener(self):
+        """Subscribe to keyspace notifications of sunflower keys in a background thread."""
+        try:
+            events = self._redis.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+        except redis.ResponseError as err:
+            # CONFIG command not allowed (managed Redis)
+            events, reason = "", f"they could not be checked ({err})"
+        else:
+            reason = f'they are not enabled (notify-keyspace-events="{events}")'
+        if not ("K" in events and ("A" in events or {"$", "g", "x"} <= set(events))):
+            logger.warning(f'Redis keyspace notifications are required to cache persistent attributes, but {reason}: values are not cached. Set notify-keyspace-events to "K$gx" in Redis configuration.')
+            self.notifications = False
+            self.max_age = 0
+            self.clear()
+            return
+        db = self._redis.connection_pool.connection_kwargs.get("db", 0)
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{f"__keyspace@{db}__:{self.keyspace_pattern}": self._handle_notification})
+        self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._handle_listener_error)
+
+    def _handle_notification(self, message: Dict[str, Any]):
+        key = message["channel"].decode().split(":", 1)[1]
+        event = message["data"].decode()
+        with self._lock:
+            if self._pop_own_write(key, event):
+                return
+            self._cache.pop(key, None)
+            self._generation += 1
+
+    def _pop_own_write(self, key: str, event: str) -> bool:
+        """Forget pending own write of key triggering event and return True if there is one.
+
+        Must be called with lock held.
+        """
+        deadlines = self._own_writes.get((key, event))
+        if not deadlines:
+            return False
+        now = monotonic()
+        while deadlines and deadlines[0] <= now:
+            del deadlines[0]
+        found = bool(deadlines)
+        if found:
+            del deadlines[0]
+        if not deadlines:
+            del self._own_writes[(key, event)]
+        return found
+
+    def _handle_listener_error(self, err, pubsub, thread):
+        # notifications may have been missed: forget everything and restart listener at next access
+        thread.stop()
+        pubsub.close()
+        with self._lock:
+            self._cache.clear()
+            self._own_writes.clear()
+            self._generation += 1
+            self._listener = None
+
+    def _ensure_listener(self):
+        if self.notifications and self._listener is None:
+            self._start_listener()
+
+    def clear(self):
+        """Forget all cached values."""
+        with self._lock:
+            self._cache.clear()
+
+    def get(self, key, codec):
+        self._ensure_listener()
+        with self._lock:
+            entry = self._cache.get(key)
+            generation = self._generation
+        if entry is None or entry.expiration_time <= monotonic():
+            entry = _CacheEntry(self._redis.get(key), monotonic() + self.max_age)
+            with self._lock:
+                # don't cache value if an invalidation was received during GET
+                if generation == self._generation:
+                    self._cache[key] = entry
+        return self._decode_entry(entry, codec)
+
+    def get_many(self, requests):
+        """Return values from cache, fetching missing ones in one MGET."""
+        self._ensure_listener()
+        now = monotonic()
+        with self._lock:
+            entries = [self._cache.get(key) for key, _ in requests]
+            generation = self._generation
+        missing_keys = [key for (key, _), entry in zip(requests, entries) if entry is None or entry.expiration_time <= now]
+        if missing_keys:
+            fetched = dict(zip(missing_keys, (_CacheEntry(data, monotonic() + self.max_age) for data in self._redis.mget(missing_keys))))
+            with self._lock:
+                if generation == self._generation:
+                    self._cache.update(fetched)
+            entries = [fetched.get(key, entry) for (key, _), entry in zip(requests, entries)]
+        return [self._decode_entry(entry, codec) for entry, (_, codec) in zip(entries, requests)]
+
+    @staticmethod
+    def _decode_entry(entry: _CacheEntry, codec: Codec) -> Any:
+        if entry.data is None:
+            return None
+        try:
+            return entry.values[codec]
+        except KeyError:
+            value = entry.values[codec] = codec.decode(entry.data)
+            return value
+
+    def set(self, key, value, codec, expiration_delay=None):
+        self._ensure_listener()
+        data = codec.encode(value)
+        with self._lock:
+            if self._listener is not None:
+                now = monotonic()
+                for event in ("set",) if expiration_delay is None else ("set", "expire"):
+                    # forget notifications which never arrived
+                    deadlines = [d for d in self._own_writes.get((key, event), ()) if d > now]
+                    deadlines.append(now + self.own_write_timeout)
+                    self._own_writes[(key, event)] = deadlines
+        self._redis.set(key, data, ex=expiration_delay)
+        ttl = self.max_age if expiration_delay is None else min(self.max_age, expiration_delay)
+        with self._lock:
+            self._cache[key] = _CacheEntry(data, monotonic() + ttl)
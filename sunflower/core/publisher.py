@@ -0,0 +1,116 @@
+# This file is part of sunflower package. radio
+# This module contains StaticPublisher class, writing API responses as static files.
+
+import gzip
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError: # optional dependency (pip install sunflower[brotli])
+    brotli = None
+
+from sunflower import settings
+from sunflower.core.codecs import decode
+from sunflower.core.mixins import RedisMixin
+from sunflower.core.types import MetadataEncoder, as_metadata_type
+
+
+class StaticPublisher(RedisMixin):
+    """Write read-only API responses as static files, so that they are served without Flask.
+
+    Files are laid out like API urls under root directory, each response
+    being stored in an index.json file:
+    - api/channels/{endpoint}/metadata/index.json (raw metadata)
+    - api/channels/{endpoint}/update/index.json (card info)
+    - api/now-playing/index.json (metadata, card info and version of all channels)
+    - api/stations/{endpoint}/index.json (data of dynamic stations)
+
+    Each file has pre-compressed variants (.gz, and .br if brotli package is
+    installed) for gzip_static/brotli_static nginx modules. Files are
+    replaced atomically (written in a temporary file, then renamed), so that
+    a partial file is never served.
+
+    Data is read from Redis in one MGET at each publish() and files are only
+    written when raw data changed since last publication.
+    """
+
+    def __init__(self, root: str, channels: Iterable[str] = settings.CHANNELS, stations: Iterable[str] = settings.STATIONS):
+        super().__init__()
+        self.root = root
+        self.channels = list(channels)
+        self.stations = list(stations)
+        self._published: Dict[str, Optional[bytes]] = {} # key -> raw data of last publication
+
+    def _keys(self) -> List[str]:
+        return (
+            [f"sunflower:channel:{endpoint}:{name}" for endpoint in self.channels for name in ("metadata", "info", "version")]
+            + [f"sunflower:station:{endpoint}:data" for endpoint in self.stations]
+        )
+
+    def write(self, path: str, value: Any):
+        """Write value as json at given path (relative to root), with compressed variants."""
+        data = json.dumps(value, cls=MetadataEncoder).encode()
+        variants: List[Tuple[str, bytes]] = [(path, data), (path + ".gz", gzip.compress(data, mtime=0))]
+        if brotli is not None:
+            variants.append((path + ".br", brotli.compress(data)))
+        directory = os.path.join(self.root, os.path.dirname(path))
+        os.makedirs(directory, exist_ok=True)
+        for variant_path, variant_data in variants:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(variant_data)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, os.path.join(self.root, variant_path))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def publish(self) -> List[str]:
+        """Write files of data changed since last publication. Return written paths."""
+        keys = self._keys()
+        return self.publish_raw_data(dict(zip(keys, self._redis.mget(keys))))
+
+    def publish_raw_data(self, raw_data: Dict[str, Optional[bytes]]) -> List[str]:
+        """Write files of given raw data (keyed by Redis key) if it changed since last publication."""
+        changed = {key for key, data in raw_data.items() if key not in self._published or self._published[key] != data}
+        if not changed:
+            return []
+
+        def load(key):
+            data = raw_data[key]
+            return None if data is None else decode(data, as_metadata_type)
+
+        written = []
+        channels_changed = False
+        for endpoint in self.channels:
+            for name, path in (("metadata", "metadata"), ("info", "update")):
+                key = f"sunflower:channel:{endpoint}:{name}"
+                if key in changed:
+                    written.append(f"api/channels/{endpoint}/{path}/index.json")
+                    self.write(written[-1], load(key))
+            channels_changed |= any(f"sunflower:channel:{endpoint}:{name}" in changed for name in ("metadata", "info", "version"))
+        if channels_changed:
+            channels = {
+                endpoint: {
+                    "metadata": load(f"sunflower:channel:{endpoint}:metadata"),
+                    "info": load(f"sunflower:channel:{endpoint}:info"),
+                    "version": load(f"sunflower:channel:{endpoint}:version") or 0,
+                }
+                for endpoint in self.channels
+            }
+            version = ".".join(str(channel["version"]) for channel in channels.values())
+            written.append("api/now-playing/index.json")
+            self.write(written[-1], {"version": version, "channels": channels})
+        for endpoint in self.stations:
+            key = f"sunflower:station:{endpoint}:data"
+            if key in changed:
+                written.append(f"api/stations/{endpoint}/index.json")
+                self.write(written[-1], load(key))
+
+        # data is marked as published only once written
+        self._published.update((key, raw_data[key]) for key in changed)
+        return written
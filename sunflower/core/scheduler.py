@@ -1,19 +1,58 @@
 # This file is part of sunflower package. radio
 # This module contains Scheduler class.
 
+import itertools
+import signal
+import sys
 import traceback
 from datetime import datetime
 from time import sleep
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set
 
-from sunflower.core.bases import DynamicStation, Station, Channel
+from sunflower import settings
+from sunflower.core.bases import DynamicStation, Station, Channel, STATIONS_INSTANCES
+from sunflower.core.demand import DemandMonitor
+from sunflower.core.leases import LeaseManager
+from sunflower.core.mixins import LiquidsoapMixin
+from sunflower.core.publisher import StaticPublisher
+from sunflower.core.snapshots import SnapshotStore
 
 
 class Scheduler:
+    """Process channels and dynamic stations every 4 seconds.
 
-    def __init__(self, channels, logger):
+    If a LeaseManager is given, the scheduler is a worker among others (sharded
+    mode): it only processes channels and dynamic stations whose lease it holds.
+    A channel and the dynamic stations it uses share one lease (as well as
+    other channels using these stations), as channels read in-memory state of
+    their dynamic stations. Each object is thus processed by exactly one worker,
+    and work is shared again when a worker dies or joins. Objects are
+    checkpointed before their lease is released, and audience (DemandMonitor)
+    is only read for owned channels.
+
+    Groups only spread work when channels don't share dynamic stations: the
+    shipped channels all use Pycolore and form a single group, so one worker
+    processes everything and the others are hot standbys taking over when it
+    dies (failover, not parallelism).
+
+    State of processed objects is checkpointed in snapshots every checkpoint_interval
+    iterations and when the scheduler stops (SIGTERM included), and restored when
+    the scheduler starts or claims an object, so that a restart doesn't rescan
+    songs library nor play songs again.
+
+    If a StaticPublisher is given, API responses are written as static files
+    after each iteration (only changed data is written).
+    """
+
+    def __init__(self, channels, logger, lease_manager: Optional[LeaseManager] = None, snapshot_store: Optional[SnapshotStore] = None, checkpoint_interval: int = settings.SNAPSHOT_INTERVAL, static_publisher: Optional[StaticPublisher] = None):
         self.channels = channels
         self.logger = logger
+        self.lease_manager = lease_manager
+        self.snapshot_store = snapshot_store or SnapshotStore()
+        self.checkpoint_interval = checkpoint_interval
+        self.static_publisher = static_publisher
+        self.demand_monitor = DemandMonitor()
+        self._claimed: Set[str] = set() # lease names of objects restored and started by this scheduler
 
         # get stations
         self.stations = {Station() for channel in channels for Station in channel.stations}
@@ -21,6 +60,9 @@ class Scheduler:
         # get objects to process at each iteration
         objects_to_process = []
 
+        # add logger to liquidsoap client
+        LiquidsoapMixin.liquidsoap.logger = logger
+
         # add logger to channels
         # add channels to objects to process
         for channel in self.channels:
@@ -35,11 +77,33 @@ class Scheduler:
                 objects_to_process.append(station)
         
         self.objects_to_process = objects_to_process
+        self.lease_groups = self._group_objects(objects_to_process)
+        self._lease_group_names = {self._lease_name(obj): name for name, group in self.lease_groups.items() for obj in group}
 
+    @classmethod
+    def _group_objects(cls, objects) -> Dict[str, List[Any]]:
+        """Return objects sharing a lease, keyed by lease name.
 
-    @property
-    def context(self) -> Dict[str, Any]:
-        """Return context dict containing data needed for channels and station to process.
+        A channel is grouped with the dynamic stations it uses, and thus with
+        other channels using one of these stations. Name of a group is the
+        lease names of its objects joined with "+".
+        """
+        groups: List[List[Any]] = []
+        for channel in (obj for obj in objects if isinstance(obj, Channel)):
+            stations = [Station() for Station in channel.stations]
+            group = [channel] + [station for station in stations if isinstance(station, DynamicStation) and station in objects]
+            linked_groups = [other for other in groups if any(obj in other for obj in group)]
+            for other in linked_groups:
+                groups.remove(other)
+                group.extend(obj for obj in other if obj not in group)
+            groups.append(group)
+        grouped = [obj for group in groups for obj in group]
+        groups.extend([obj] for obj in objects if obj not in grouped)
+        return {"+".join(sorted(cls._lease_name(obj) for obj in group)): group for group in groups}
+
+
+    def get_context(self, channels: List[Channel]) -> Dict[str, Any]:
+        """Return context dict containing data needed for given channels and stations to process.
         
         Current defined keys:
         
@@ -48,6 +112,8 @@ class Scheduler:
             on air on these channels. This key allows station to know on which channels they
             are currently used.
         - `now`: datetime object representing current timestamp.
+        - `demand` (Dict[str, Demand]): audience of given channels, keyed by channel endpoint
+            (see DemandMonitor). Idle channels skip most of metadata updates.
         """
         channels_using: Dict[Station, List[Channel]] = {
             station: [channel for channel in self.channels if channel.current_station is station]
@@ -56,21 +122,97 @@ class Scheduler:
         return {
             "channels_using": channels_using,
             "now": datetime.now(),
+            "demand": self.demand_monitor.refresh((channel.endpoint for channel in channels), self.logger) if channels else {},
         }
 
+    @staticmethod
+    def _lease_name(obj) -> str:
+        return f"{obj.data_type}:{obj.endpoint}"
+
+    @property
+    def owned_objects(self) -> List[Any]:
+        """Return objects to process by this scheduler at current iteration.
+
+        In sharded mode, renew and claim leases first.
+        """
+        if self.lease_manager is None:
+            return self.objects_to_process
+        previously_owned = set(self.lease_manager.owned)
+        owned = self.lease_manager.rebalance(self.lease_groups, before_release=lambda name: self.checkpoint(self.lease_groups[name]))
+        if owned != previously_owned:
+            self.logger.info(f"worker={self.lease_manager.worker_id} Owned objects: {', '.join(sorted(owned)) or 'none'}.")
+        return [obj for obj in self.objects_to_process if self._lease_group_names[self._lease_name(obj)] in owned]
+
+    def _claim(self, obj):
+        """Prepare object before its first processing by this scheduler.
+
+        Restore its state from last snapshot (warm start) and start it if it is a station.
+        """
+        try:
+            if self.snapshot_store.restore(obj):
+                self.logger.info(f"{obj.data_type}={obj.endpoint} State restored from snapshot.")
+        except Exception as err:
+            self.logger.error(f"{obj.data_type}={obj.endpoint} State could not be restored from snapshot: {err}")
+        if isinstance(obj, Station):
+            STATIONS_INSTANCES.start(obj)
+        self._claimed.add(self._lease_name(obj))
+
+    def checkpoint(self, objects):
+        """Store snapshot of state of given objects."""
+        for obj in objects:
+            try:
+                self.snapshot_store.save(obj)
+            except Exception as err:
+                self.logger.error(f"{obj.data_type}={obj.endpoint} Snapshot could not be stored: {err}")
+
+    def _handle_sigterm(self, signum, frame):
+        self.logger.info("SIGTERM received, stopping scheduler.")
+        sys.exit(0)
+
     def run(self):
         """Keep data for radio client up to date."""
+        owned_objects = []
         try:
+            signal.signal(signal.SIGTERM, self._handle_sigterm)
+            if self.lease_manager is None:
+                for obj in self.objects_to_process:
+                    self._claim(obj)
+                for station in self.stations:
+                    STATIONS_INSTANCES.start(station)
             # loop
-            while True:
+            for iteration in itertools.count(1):
                 sleep(4)
-                context = self.context
-                for obj in self.objects_to_process:
+                try:
+                    owned_objects = self.owned_objects
+                except Exception as err:
+                    self.logger.error("Les objets à traiter n'ont pas pu être déterminés : {}.".format(err))
+                    continue
+                context = self.get_context([obj for obj in owned_objects if isinstance(obj, Channel)])
+                # in sharded mode, objects are claimed (restored and started) when their lease is acquired
+                self._claimed.intersection_update(self._lease_name(obj) for obj in owned_objects)
+                for obj in owned_objects:
+                    if self._lease_name(obj) not in self._claimed:
+                        self._claim(obj)
+                for obj in owned_objects:
                     try:
                         obj.process(self.logger, **context)
                     except Exception as err:
                         self.logger.error("Une erreur est survenue pendant la mise à jour des données: {}.".format(err))
                         self.logger.error(traceback.format_exc())
+                if self.static_publisher is not None:
+                    try:
+                        self.static_publisher.publish()
+                    except Exception as err:
+                        self.logger.error("Les fichiers statiques de l'API n'ont pas pu être écrits : {}.".format(err))
+                if iteration % self.checkpoint_interval == 0:
+                    self.checkpoint(owned_objects)
         except Exception as err:
             self.logger.error("Erreur fatale")
             self.logger.error(traceback.format_exc())
+        finally:
+            # checkpoint before releasing leases, so that next owner restores up to date state
+            self.checkpoint(owned_objects)
+            if self.lease_manager is not None:
+                self.lease_manager.release_all()
+            STATIONS_INSTANCES.stop_all()
+            LiquidsoapMixin.liquidsoap.close()
@@ -0,0 +1,57 @@
+# This file is part of sunflower package. radio
+# This module contains SnapshotStore class, used for warm starts of the scheduler.
+
+from time import time
+from typing import Any, Dict, Optional
+
+from sunflower import settings
+from sunflower.core.mixins import RedisMixin
+
+
+class SnapshotStore(RedisMixin):
+    """Store in Redis snapshots of in-memory state of scheduled objects.
+
+    Scheduled objects (channels and stations) expose their state with get_state()
+    (jsonable data, or None if there is nothing to keep) and take it back with
+    restore_state(state), returning False if given state is not valid anymore
+    (for instance if songs library moved). State of an object is stored in
+    sunflower:snapshot:{data_type}:{endpoint} key with a format version and a
+    timestamp. Snapshots older than max_age seconds or written with another
+    format version are ignored.
+    """
+
+    # increment when format of states changes
+    version = 1
+    key_prefix = "sunflower:snapshot:"
+
+    def __init__(self, max_age: int = settings.SNAPSHOT_MAX_AGE):
+        super().__init__()
+        self.max_age = max_age
+
+    def _key(self, obj) -> str:
+        return f"{self.key_prefix}{obj.data_type}:{obj.endpoint}"
+
+    def save(self, obj) -> bool:
+        """Store snapshot of given object state. Return False if object has no state to store."""
+        state = obj.get_state()
+        if state is None:
+            return False
+        snapshot = {"version": self.version, "timestamp": time(), "state": state}
+        self.set_to_redis(self._key(obj), snapshot, expiration_delay=self.max_age)
+        return True
+
+    def load(self, obj) -> Optional[Any]:
+        """Return last valid state stored for given object, or None."""
+        snapshot: Optional[Dict[str, Any]] = self.get_from_redis(self._key(obj))
+        if snapshot is None or snapshot.get("version") != self.version:
+            return None
+        if time() - snapshot.get("timestamp", 0) > self.max_age:
+            return None
+        return snapshot.get("state")
+
+    def restore(self, obj) -> bool:
+        """Restore state of given object from its snapshot. Return True if state was restored."""
+        state = self.load(obj)
+        if state is None:
+            return False
+        return bool(obj.restore_state(state))
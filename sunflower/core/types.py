@@ -3,7 +3,8 @@
 import json
 from typing import NamedTuple
 from enum import Enum
-from typing import Any, Dict, Tuple, Optional, Union
+from typing import Any, Dict, Iterable, List, Tuple, Optional, Union
+from sunflower.core.codecs import decode, register_enum
 from sunflower.core.mixins import RedisMixin
 from dataclasses import dataclass
 
@@ -45,18 +46,60 @@ class BaseView(RedisMixin):
     of Channel and Station objects without having to deal with these big
     objects. Instead, it uses these view objects which are only exposing
     Redis-stored data.
+
+    Fetched values are memoized for the lifetime of the view (that is to say
+    a request for the server). Several fields can be fetched in one MGET with
+    fetch(), and several views at once with get_many().
     """
-    __slots__ = ()
+    __slots__ = ("endpoint", "_values")
     fields: Tuple[str, ...] = ()
+    data_type: str
+
+    def __init__(self, endpoint):
+        super().__init__()
+        self.endpoint = endpoint
+        self._values: Dict[str, Any] = {}
+
+    def _get_key(self, name: str) -> str:
+        return f"sunflower:{self.data_type}:{self.endpoint}:{name}"
+
+    def _decode(self, raw_data: bytes) -> Any:
+        return decode(raw_data)
+
+    def _store(self, name: str, raw_data: Optional[bytes]):
+        self._values[name] = None if raw_data is None else self._decode(raw_data)
+
+    def fetch(self, *names: str) -> "BaseView":
+        """Fetch given fields (all fields by default) not fetched yet, in one MGET. Return the view."""
+        names = [name for name in (names or self.fields) if name not in self._values]
+        if names:
+            for name, raw_data in zip(names, self._redis.mget([self._get_key(name) for name in names])):
+                self._store(name, raw_data)
+        return self
+
+    @classmethod
+    def get_many(cls, endpoints: Iterable[str], *names: str) -> List["BaseView"]:
+        """Return views of given endpoints with given fields (all fields by default) fetched in one MGET."""
+        views = [cls(endpoint) for endpoint in endpoints]
+        names = names or cls.fields
+        if views:
+            raw_data = iter(views[0]._redis.mget([view._get_key(name) for view in views for name in names]))
+            for view in views:
+                for name in names:
+                    view._store(name, next(raw_data))
+        return views
 
     def __getattr__(self, name):
+        if name in self.fields:
+            return self.fetch(name)._values[name]
         raise AttributeError(
             f"'{name}' attribute is not readable. "
             "Only following attributes are readable: " + ", ".join(self.fields) + "."
         )
     
     def __repr__(self):
-        attrs = ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__ + self.fields)
+        self.fetch()
+        attrs = ", ".join(f"{name}={getattr(self, name)}" for name in ("endpoint",) + self.fields)
         return f"<{type(self).__name__}({attrs})>"
 
 
@@ -67,6 +110,8 @@ class ChannelView(BaseView):
     channel. Other attributes are dynamically got from Redis:
     - metadata is fetched from sunflower:channel:{endpoint}:metadata key
     - info is fetched from sunflower:channel:{endpoint}:info key
+    - version is fetched from sunflower:channel:{endpoint}:version key (incremented
+      at each metadata update)
 
     Final attribues are defined:
     - fields: dynamic attributes that can be accessed
@@ -75,17 +120,12 @@ class ChannelView(BaseView):
     Any other attribute access will result in a AttributeError.
     """
 
-    __slots__= ("endpoint",)
-    fields = ("metadata", "info")
-
-    def __init__(self, endpoint):
-        super().__init__()
-        self.endpoint = endpoint
+    __slots__ = ()
+    fields = ("metadata", "info", "version")
+    data_type = "channel"
 
-    def __getattr__(self, name):
-        if name in self.fields:
-            return self.get_from_redis(f"sunflower:channel:{self.endpoint}:{name}", object_hook=as_metadata_type)
-        return super().__getattr__(name)
+    def _decode(self, raw_data):
+        return decode(raw_data, as_metadata_type)
 
 
 class StationView(BaseView):
@@ -96,17 +136,9 @@ class StationView(BaseView):
     'endpoint' attribute is also readable.
     """
 
-    __slots__= ("endpoint",)
+    __slots__ = ()
     fields = ("data",)
-
-    def __init__(self, endpoint):
-        super().__init__()
-        self.endpoint = endpoint
-
-    def __getattr__(self, name):
-        if name in self.fields:
-            return self.get_from_redis(f"sunflower:station:{self.endpoint}:{name}")
-        return super().__getattr__(name)
+    data_type = "station"
 
 
 # MetadataType utils for json (de)serialization
@@ -118,13 +150,14 @@ class MetadataEncoder(json.JSONEncoder):
             return obj.value
         return json.JSONEncoder.default(self, obj)
 
+_METADATA_TYPES_BY_VALUE = {member.value: member for member in MetadataType}
+
 def as_metadata_type(mapping: Dict[str, Any]) -> Dict[str, Any]:
     """object_hook for supporting MetadataType at json deserialization."""
     type_ = mapping.get("type")
-    if type_ is None:
-        return mapping
-    for member in MetadataType:
-        if type_ == member.value:
-            mapping["type"] = MetadataType(type_)
-            break
+    if isinstance(type_, str) and type_ in _METADATA_TYPES_BY_VALUE:
+        mapping["type"] = _METADATA_TYPES_BY_VALUE[type_]
     return mapping
+
+# MetadataType members are encoded as ext type 1 by binary codec
+register_enum(1, MetadataType)
@@ -1,18 +1,57 @@
-import telnetlib
+import concurrent.futures
+import json
+import os
 from datetime import datetime
-from typing import Tuple, Dict
+from time import monotonic, time
+from typing import Any, Tuple, Dict, NamedTuple, Optional
+
+import redis
 
 from sunflower import settings
-from sunflower.core.types import CardMetadata, MetadataType, MetadataDict
+from sunflower.core.covers import CoverCache
+from sunflower.core.types import CardMetadata, MetadataType, MetadataDict, Song
 from sunflower.utils.functions import fetch_cover_and_link_on_deezer, parse_songs
-from sunflower.core.mixins import HTMLMixin
+from sunflower.core.liquidsoap import LiquidsoapError
+from sunflower.core.mixins import HTMLMixin, LiquidsoapMixin, RedisMixin
+
+
+class StagedSong(NamedTuple):
+    """Backup song ready to be played: cover, link and card are already resolved."""
+    song: Song
+    thumbnail: str
+    card: CardMetadata
+
+
+class AdsHandler(HTMLMixin, LiquidsoapMixin, RedisMixin):
+    """Play backup songs instead of advertising.
 
+    Next backup song is staged (cover and link fetched on Deezer, card built)
+    in a background thread when the station is not broadcasting ads, so that
+    it can be pushed to liquidsoap as soon as ads are detected, without any
+    request to Deezer during the scheduler iteration. If no song is staged
+    when ads are detected, next backup song is played with station cover.
+    Backup songs list is only used in scheduler thread: the background
+    thread gets the chosen song.
+
+    Latency between beginning of ads (end of previous broadcast, or beginning
+    of iteration if it is unknown) and push is stored in Redis
+    (sunflower:channel:{endpoint}:ads_latencies list).
+    """
+
+    # number of latency records kept in Redis
+    latency_records_number = 1000
 
-class AdsHandler(HTMLMixin):
     def __init__(self, channel):
+        super().__init__()
         self.channel = channel
         self.glob_pattern = settings.BACKUP_SONGS_GLOB_PATTERN
-        self.backup_songs = self._parse_songs()
+        self.backup_songs = []
+        self.staged_song: Optional[StagedSong] = None
+        self.redis_latencies_key = f"sunflower:channel:{self.channel.endpoint}:ads_latencies"
+        self._staging_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._staging_future: Optional[concurrent.futures.Future] = None
+        self._staging_song: Optional[Song] = None # song whose cover is fetched in background
+        self._last_broadcast_end: Optional[float] = None
 
     def _fetch_cover_and_link_on_deezer(self, artist, album, track):
         return fetch_cover_and_link_on_deezer(self.channel.current_station.station_thumbnail, artist, album, track)
@@ -20,38 +59,231 @@ class AdsHandler(HTMLMixin):
     def _parse_songs(self):
         return parse_songs(self.glob_pattern)
 
-    def process(self, metadata, info, logger, dt: datetime) -> Tuple[MetadataDict, CardMetadata]:
-        """Play backup songs if advertising is detected on currently broadcasted station."""
-        if metadata["type"] == MetadataType.ADS:
-            logger.debug(f"channel={self.channel.endpoint} station={self.channel.current_station.formated_station_name} Ads detected.")
-            if not self.backup_songs:
-                logger.debug(f"channel={self.channel.endpoint} Backup songs list must be generated.")
-                self.backup_songs = self._parse_songs()
-            backup_song = self.backup_songs.pop(0)
-
-            # tell liquidsoap to play backup song
-            session = telnetlib.Telnet("localhost", 1234)
-            session.write("{}_custom_songs.push {}\n".format(self.channel.endpoint, backup_song.path).encode())
-            session.write("exit\n".encode())
-            session.close()
-            
-            station = metadata["station"]
+    def _pop_backup_song(self, logger) -> Song:
+        """Pop next backup song, generating the list if needed. Called in scheduler thread only."""
+        if not self.backup_songs:
+            logger.debug(f"channel={self.channel.endpoint} Backup songs list must be generated.")
+            self.backup_songs = self._parse_songs()
+        return self.backup_songs.pop(0)
+
+    def _stage_song(self, backup_song: Song, fetch_cover: bool = True) -> StagedSong:
+        """Fetch cover and link of backup song (if fetch_cover is True) and build its card.
+
+        Called in background thread: it doesn't access backup songs list.
+        """
+        if fetch_cover:
             thumbnail, url = self._fetch_cover_and_link_on_deezer(backup_song.artist, backup_song.album, backup_song.title)
+        else:
+            thumbnail, url = self.channel.current_station.station_thumbnail, None
+        card = CardMetadata(
+            current_thumbnail=thumbnail,
+            current_station="", # set when played
+            current_broadcast_title=self._format_html_anchor_element(url, backup_song.artist + " • " + backup_song.title),
+            current_show_title="Musique",
+            current_broadcast_summary="", # set when played
+        )
+        return StagedSong(backup_song, thumbnail, card)
+
+    def _collect_staged_song(self, logger):
+        """Keep song staged in background thread, if staging is over."""
+        future = self._staging_future
+        if future is None or not future.done():
+            return
+        self._staging_future = None
+        try:
+            self.staged_song = future.result()
+        except Exception as err:
+            logger.error(f"channel={self.channel.endpoint} Cover of next backup song could not be fetched: {err}")
+            self.staged_song = self._stage_song(self._staging_song, fetch_cover=False)
+        self._staging_song = None
+
+    def _start_staging(self, logger):
+        """Stage next backup song in background thread if needed.
+
+        Song is chosen in scheduler thread: only its cover and link are fetched in background.
+        """
+        if self.staged_song is not None or self._staging_future is not None:
+            return
+        if self._staging_executor is None:
+            # created lazily, in scheduler process
+            self._staging_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ads-{self.channel.endpoint}")
+        try:
+            self._staging_song = self._pop_backup_song(logger)
+        except Exception as err:
+            logger.error(f"channel={self.channel.endpoint} Next backup song could not be chosen: {err}")
+            return
+        self._staging_future = self._staging_executor.submit(self._stage_song, self._staging_song)
+
+    def _record_latency(self, logger, ads_start: float, tick_start: float) -> Dict[str, Any]:
+        """Log and store latencies of an ads replacement (in seconds) and return record.
+
+        - detection_latency: between beginning of ads and push acknowledgement by liquidsoap
+        - tick_latency: between beginning of scheduler iteration and push acknowledgement
+        """
+        now = time()
+        record = {"timestamp": int(now), "detection_latency": now - ads_start, "tick_latency": now - tick_start}
+        logger.info(f"channel={self.channel.endpoint} Backup song pushed {record['detection_latency'] * 1000:.1f}ms after beginning of ads ({record['tick_latency'] * 1000:.1f}ms after beginning of iteration).")
+        try:
+            self._store_latency(record)
+        except redis.RedisError as err:
+            logger.error(f"channel={self.channel.endpoint} Ads latency could not be stored: {err}")
+        return record
+
+    def _store_latency(self, record: Dict[str, Any]):
+        pipeline = self._redis.pipeline()
+        pipeline.lpush(self.redis_latencies_key, json.dumps(record))
+        pipeline.ltrim(self.redis_latencies_key, 0, self.latency_records_number - 1)
+        pipeline.execute()
+
+    def get_state(self) -> Optional[Dict[str, Any]]:
+        """Return remaining backup songs and staged song for snapshots (see SnapshotStore)."""
+        # song being staged is saved as next backup song
+        backup_songs = ([] if self._staging_song is None else [self._staging_song]) + self.backup_songs
+        if not backup_songs and self.staged_song is None:
+            return None
+        return {
+            "glob_pattern": self.glob_pattern,
+            "backup_songs": [list(song) for song in backup_songs],
+            "staged_song": None if self.staged_song is None else [list(self.staged_song.song), self.staged_song.thumbnail, list(self.staged_song.card)],
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> bool:
+        """Restore state returned by get_state() if backup songs library didn't change."""
+        if state["glob_pattern"] != self.glob_pattern:
+            return False
+        self.backup_songs = [song for song in map(Song._make, state["backup_songs"]) if os.path.exists(song.path)]
+        if state["staged_song"] is not None:
+            song, thumbnail, card = state["staged_song"]
+            song = Song._make(song)
+            if os.path.exists(song.path):
+                self.staged_song = StagedSong(song, thumbnail, CardMetadata._make(card))
+        return True
 
-            # and update metadata
-            metadata = {
-                "artist": backup_song.artist,
-                "title": backup_song.title,
-                "end": int(dt.timestamp() + backup_song.length),
-                "type": MetadataType.MUSIC,
-                "station": station,
-                "thumbnail_src": thumbnail,
-            }
-            info = CardMetadata(
-                current_thumbnail=thumbnail,
-                current_station=self.channel.current_station.html_formated_station_name,
-                current_broadcast_title=self._format_html_anchor_element(url, backup_song.artist + " • " + backup_song.title),
-                current_show_title="Musique",
-                current_broadcast_summary="Publicité en cours sur {}. Dans un instant, retour sur la station.".format(station),
-            )
+    def process(self, metadata, info, logger, dt: datetime) -> Tuple[MetadataDict, CardMetadata]:
+        """Play backup songs if advertising is detected on currently broadcasted station.
+
+        If no ads is detected, stage next backup song in background if needed.
+        """
+        self._collect_staged_song(logger)
+        if metadata["type"] != MetadataType.ADS:
+            self._last_broadcast_end = metadata.get("end")
+            self._start_staging(logger)
+            return metadata, info
+
+        # ads began at the end of previous broadcast, if it is known
+        tick_start = dt.timestamp()
+        ads_start = self._last_broadcast_end if self._last_broadcast_end and self._last_broadcast_end <= tick_start else tick_start
+        logger.debug(f"channel={self.channel.endpoint} station={self.channel.current_station.formated_station_name} Ads detected.")
+        staged_song = self.staged_song
+        if staged_song is None:
+            # staging is not over: don't wait for Deezer
+            try:
+                staged_song = self._stage_song(self._pop_backup_song(logger), fetch_cover=False)
+            except Exception as err:
+                logger.error(f"channel={self.channel.endpoint} Backup song could not be chosen: {err}")
+                return metadata, info
+        backup_song = staged_song.song
+
+        # tell liquidsoap to play backup song
+        try:
+            request_id = self.liquidsoap.push(f"{self.channel.endpoint}_custom_songs", backup_song.path)
+        except LiquidsoapError as err:
+            logger.error(f"channel={self.channel.endpoint} Backup song could not be pushed: {err}")
+            self.staged_song = staged_song
+            return metadata, info
+        self.staged_song = None
+        self._record_latency(logger, ads_start, tick_start)
+        logger.debug(f"channel={self.channel.endpoint} Backup song pushed (request id {request_id}).")
+        self._last_broadcast_end = None
+        self._start_staging(logger)
+
+        # and update metadata
+        station = metadata["station"]
+        metadata = {
+            "artist": backup_song.artist,
+            "title": backup_song.title,
+            "end": int(dt.timestamp() + backup_song.length),
+            "type": MetadataType.MUSIC,
+            "station": station,
+            "thumbnail_src": staged_song.thumbnail,
+        }
+        info = staged_song.card._replace(
+            current_station=self.channel.current_station.html_formated_station_name,
+            current_broadcast_summary="Publicité en cours sur {}. Dans un instant, retour sur la station.".format(station),
+        )
+        return metadata, info
+
+
+class CoverProxyHandler:
+    """Replace remote covers of metadata and card by local resized copies (see CoverCache).
+
+    Covers are fetched once, so that listeners don't download full size
+    images from third parties at each card update. Covers are fetched and
+    resized in a background thread, so that the scheduler iteration never
+    waits for them: remote url is published until local copy is ready, then
+    channel publishes local url (see refresh()). Covers which could not
+    be fetched are not fetched again before retry_delay seconds. Must be the
+    last handler, so that covers set by other handlers are proxied too.
+    """
+
+    def __init__(self, channel, retry_delay: float = settings.COVER_RETRY_DELAY):
+        self.channel = channel
+        self.cache = CoverCache()
+        self.retry_delay = retry_delay
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pending: Dict[str, concurrent.futures.Future] = {} # url -> future of CoverCache.get()
+        self._failures: Dict[str, float] = {} # url -> time after which it can be fetched again
+
+    def _collect(self, logger) -> Dict[str, str]:
+        """Forget covers fetched in background thread, recording failures.
+
+        Return local urls of covers stored since last call, by remote url.
+        """
+        now = monotonic()
+        stored = {}
+        for url, future in list(self._pending.items()):
+            if not future.done():
+                continue
+            del self._pending[url]
+            try:
+                stored[url] = future.result()
+            except Exception as err:
+                logger.error(f"channel={self.channel.endpoint} Cover {url} could not be stored: {err}")
+                self._failures[url] = now + self.retry_delay
+        self._failures = {url: retry_time for url, retry_time in self._failures.items() if retry_time > now}
+        return stored
+
+    def _get_local_url(self, url: Optional[str]) -> Optional[str]:
+        if not url or not url.startswith(("http://", "https://")):
+            return url
+        local_url = self.cache.lookup(url)
+        if local_url is not None:
+            return local_url
+        if url in self._pending or url in self._failures:
+            return url
+        if self._executor is None:
+            # created lazily, in scheduler process
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"covers-{self.channel.endpoint}")
+        self._pending[url] = self._executor.submit(self.cache.get, url)
+        return url
+
+    def refresh(self, metadata, info, logger) -> Optional[Tuple[MetadataDict, CardMetadata]]:
+        """Return published metadata and card info with covers stored since they were published, or None.
+
+        Called by channel at each iteration, so that local covers replace remote
+        ones as soon as they are ready.
+        """
+        stored = self._collect(logger)
+        thumbnail_src = metadata.get("thumbnail_src")
+        if thumbnail_src not in stored and info.current_thumbnail not in stored:
+            return None
+        if thumbnail_src in stored:
+            metadata = {**metadata, "thumbnail_src": stored[thumbnail_src]}
+        return metadata, info._replace(current_thumbnail=stored.get(info.current_thumbnail, info.current_thumbnail))
+
+    def process(self, metadata, info, logger, dt: datetime) -> Tuple[MetadataDict, CardMetadata]:
+        self._collect(logger)
+        if "thumbnail_src" in metadata:
+            metadata = {**metadata, "thumbnail_src": self._get_local_url(metadata["thumbnail_src"])}
+        info = info._replace(current_thumbnail=self._get_local_url(info.current_thumbnail))
         return metadata, info
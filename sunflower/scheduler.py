@@ -1,4 +1,6 @@
 
+import argparse
+import functools
 import os
 import sys
 import logging
@@ -8,12 +10,17 @@ if __name__ == "__main__":
     sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from daemonize import Daemonize
+from sunflower.core.descriptors import PersistentAttribute
+from sunflower.core.leases import LeaseManager
+from sunflower.core.persistence import CachedRedisBackend
+from sunflower.core.publisher import StaticPublisher
 from sunflower.core.scheduler import Scheduler
 from sunflower import settings
 from sunflower.channels import tournesol, music
 from sunflower.core.functions import check_obj_integrity
 
-def launch_scheduler():
+def launch_scheduler(worker=None):
+    """Launch scheduler. If worker number is given, launch it as a worker of sharded scheduler."""
     # instanciate logger
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
@@ -22,7 +29,8 @@ def launch_scheduler():
     formatter = logging.Formatter("[%(asctime)s] %(levelname)s :: %(message)s")
     
     # rotate
-    file_handler = logging.handlers.RotatingFileHandler("/tmp/scheduler.log", "a", 1000000, 1)
+    log_file = "/tmp/scheduler.log" if worker is None else f"/tmp/scheduler-{worker}.log"
+    file_handler = logging.handlers.RotatingFileHandler(log_file, "a", 1000000, 1)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
@@ -44,13 +52,23 @@ def launch_scheduler():
         logger.info("Programme stopped.")
         raise RuntimeError("Integrity errors found.")
 
-    logger.info("Starting scheduler.")
-    scheduler = Scheduler(scheduled_channels, logger)
+    logger.info("Starting scheduler." if worker is None else f"Starting scheduler worker {worker}.")
+    # scheduler is the only writer of persistent attributes of its objects: keep them in cache
+    PersistentAttribute.set_default_backend(CachedRedisBackend())
+    lease_manager = None if worker is None else LeaseManager()
+    static_publisher = None if settings.STATIC_API_ROOT is None else StaticPublisher(settings.STATIC_API_ROOT)
+    scheduler = Scheduler(scheduled_channels, logger, lease_manager, static_publisher=static_publisher)
     logger.info("Scheduler instanciated.")
     
     scheduler.run()
     
 if __name__ == "__main__":
-    pid = "/tmp/sunflower-radio-scheduler.pid"
-    daemon = Daemonize(app="sunflower-radio-scheduler", pid=pid, action=launch_scheduler)
+    parser = argparse.ArgumentParser(description="Launch sunflower scheduler as a daemon.")
+    parser.add_argument("--worker", type=int, help="worker number, for sharded mode (several workers sharing channels and stations)")
+    args = parser.parse_args()
+    if args.worker is None:
+        app, pid = "sunflower-radio-scheduler", "/tmp/sunflower-radio-scheduler.pid"
+    else:
+        app, pid = f"sunflower-radio-scheduler-{args.worker}", f"/tmp/sunflower-radio-scheduler-{args.worker}.pid"
+    daemon = Daemonize(app=app, pid=pid, action=functools.partial(launch_scheduler, args.worker))
     daemon.start()
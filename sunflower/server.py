@@ -1,21 +1,42 @@
 import json
 import threading
 import time
-from collections import Counter
+from datetime import datetime
 
-import redis
 from flask import (Flask, Response, abort, jsonify, redirect, render_template,
-                   request, stream_with_context, url_for)
+                   request, send_file, stream_with_context, url_for)
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS, cross_origin
 
 from sunflower import settings
-from sunflower.core.types import ChannelView, MetadataEncoder, StationView
+from sunflower.core.covers import CoverCache
+from sunflower.core.fanout import ChannelState, UpdatesFanout, format_update_event, is_newer
+from sunflower.core.history import BroadcastHistory
+from sunflower.core.library import PlaylistIndex, SearchIndex
+from sunflower.core.types import ChannelView, MetadataEncoder, MetadataType, StationView
+from sunflower.utils.assets import StaticAssets
 from sunflower.utils.functions import get_channel_or_404, get_station_or_404
 
+
+class MetadataJSONProvider(DefaultJSONProvider):
+    """JSON provider of jsonify() supporting MetadataType serialization, as MetadataEncoder does."""
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, MetadataType):
+            return obj.value
+        return DefaultJSONProvider.default(obj)
+
+
 app = Flask(__name__, static_url_path="/static", static_folder="static/dist")
-app.json_encoder = MetadataEncoder
+app.json = MetadataJSONProvider(app)
+# hashed and precompressed static assets (see compress-static command), compressed json responses
+StaticAssets(app)
 # cors = CORS(app)
 
+# clients waiting for updates (SSE, long-poll) share one reader of Redis streams per process
+fanout = UpdatesFanout()
+
 # Views
 
 @app.route("/")
@@ -37,21 +58,35 @@ def channel(channel: ChannelView):
 @app.route("/playlist/<string:station>")
 @get_station_or_404
 def station_playlist(station: StationView):
-    playlist = station.data["playlist"]
-    artists = Counter([song["artist"] for song in playlist])
-    playlist_dict = {
-        artist: [song for song in playlist if song["artist"] == artist]
-        for artist in artists.keys()
-    }
+    """Page of playlist (page parameter), read from playlist index (see PlaylistIndex)."""
+    page = PlaylistIndex(station.endpoint).get_page(request.args.get("page", 1, type=int))
+    if page is None:
+        abort(404)
     context = {
         "radio_name": settings.RADIO_NAME,
-        "playlist": playlist_dict,
-        "artists": artists.items(),
+        "groups": page["artists"],
+        "page": page["page"],
+        "pages": page["pages"],
         "name": station.endpoint,
     }
     return render_template("playlist.html", **context)
 
 
+@app.route("/covers/<string:key>")
+def cover(key):
+    """Cover stored by CoverProxyHandler, as webp if browser supports it."""
+    cache = CoverCache()
+    found = cache.find(key, request.headers.get("Accept", "")) if key.isalnum() else None
+    if found is None:
+        # cover was evicted from cache
+        return redirect(url_for("static", filename="thumbnail-placeholder.svg"))
+    path, mimetype = found
+    cache.touch(key)
+    response = send_file(path, mimetype=mimetype, max_age=7 * 86400, conditional=True)
+    response.vary.add("Accept")
+    return response
+
+
 # API views
 
 @app.route("/api/")
@@ -61,8 +96,53 @@ def api_root():
                      for endpoint in settings.CHANNELS},
         "stations": {endpoint: url_for("get_station_links", station=endpoint, _external=True)
                      for endpoint in settings.STATIONS},
+        "now_playing": url_for("now_playing", _external=True),
+        "now_playing_events": url_for("now_playing_stream", _external=True),
     })
 
+def format_channel_state(state: ChannelState):
+    return {"metadata": state.metadata, "info": state.info, "version": state.version}
+
+def get_now_playing(states=None):
+    """Return combined version and mapping containing metadata, card info and version of all channels.
+
+    If states of channels are not given, data of all channels is fetched in
+    one MGET. Combined version changes as soon as data of a channel changes.
+    """
+    if states is None:
+        states = [ChannelState.from_view(view) for view in ChannelView.get_many(settings.CHANNELS)]
+    version = ".".join(str(state.version) for state in states)
+    return version, {
+        "version": version,
+        "channels": {state.endpoint: format_channel_state(state) for state in states},
+    }
+
+@app.route("/api/now-playing/")
+def now_playing():
+    """Metadata and card info of all channels, with combined version as ETag."""
+    version, data = get_now_playing()
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    else:
+        response = jsonify(data)
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/now-playing/events/")
+def now_playing_stream():
+    """Send now playing data of all channels at connection and at each update."""
+    def updates_generator():
+        states = {}
+        for changed in fanout.listen(settings.CHANNELS):
+            states.update(changed)
+            if not changed or len(states) < len(settings.CHANNELS):
+                yield ":\n\n"
+                continue
+            version, now_playing_data = get_now_playing([states[endpoint] for endpoint in settings.CHANNELS])
+            yield "id: {}\ndata: {}\n\n".format(version, json.dumps(now_playing_data, cls=MetadataEncoder))
+    return Response(stream_with_context(updates_generator()), mimetype="text/event-stream")
+
 @app.route("/api/channels/<string:channel>/")
 @get_channel_or_404
 def get_channel_links(channel):
@@ -70,6 +150,8 @@ def get_channel_links(channel):
         "audio_stream": settings.ICECAST_SERVER_URL + channel.endpoint,
         "card_formated_metadata": url_for("update_broadcast_info", channel=channel.endpoint, _external=True),
         "metadata_update_events": url_for("update_broadcast_info_stream", channel=channel.endpoint, _external=True),
+        "metadata_update_poll": url_for("poll_channel", channel=channel.endpoint, _external=True),
+        "history": url_for("get_channel_history", channel=channel.endpoint, _external=True),
         "raw_metadata": url_for("get_channel_info", channel=channel.endpoint, _external=True),
     })
 
@@ -78,6 +160,35 @@ def get_channel_links(channel):
 def get_station_links(station):
     return jsonify(station.data)
 
+@app.route("/api/stations/<string:station>/playlist/")
+@get_station_or_404
+def get_station_playlist_page(station):
+    """Page of playlist grouped by artist (page parameter, starting at 1)."""
+    page = PlaylistIndex(station.endpoint).get_page(request.args.get("page", 1, type=int))
+    if page is None:
+        abort(404)
+    if page["page"] < page["pages"]:
+        page["next"] = url_for("get_station_playlist_page", station=station.endpoint, page=page["page"] + 1, _external=True)
+    return jsonify(page)
+
+@app.route("/api/stations/<string:station>/playlist/artists/<path:artist>/")
+@get_station_or_404
+def get_station_playlist_artist(station, artist):
+    """Songs of an artist in playlist, with number of the page containing them."""
+    data = PlaylistIndex(station.endpoint).get_artist(artist)
+    if data is None:
+        abort(404)
+    return jsonify(data)
+
+@app.route("/api/stations/<string:station>/search/")
+@get_station_or_404
+def search_station_songs(station):
+    """Songs of station library matching q parameter (see SearchIndex), best matches first."""
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    found = SearchIndex(station.endpoint).search(query, limit)
+    return jsonify({"query": query, "results": found.songs, "truncated": found.truncated})
+
 @app.route("/api/channels/<string:channel>/metadata/")
 @get_channel_or_404
 def get_channel_info(channel):
@@ -91,15 +202,79 @@ def update_broadcast_info(channel):
 @app.route("/api/channels/<string:channel>/events/")
 @get_channel_or_404
 def update_broadcast_info_stream(channel):
+    """Send "updated" event when card info of channel changes.
+
+    Events ids are ids of entries of Redis stream of channel: a client
+    reconnecting with an older Last-Event-ID gets an "updated" event at once.
+    """
+    last_event_id = request.headers.get("Last-Event-ID")
+
     def updates_generator():
-        pubsub = redis.Redis().pubsub()
-        pubsub.subscribe("sunflower:channel:" + channel.endpoint)
-        for message in pubsub.listen():
-            data = message.get("data")
-            if not isinstance(data, type(b"")):
-                continue
-            if data == "unchanged":
-                yield ":"
-            yield "data: {}\n\n".format(data.decode())
-        return
+        last_info = None
+        for changed in fanout.listen([channel.endpoint]):
+            state = changed.get(channel.endpoint)
+            if state is None:
+                yield ":\n\n"
+            elif state.info == last_info:
+                # keep last event id of client up to date
+                yield format_update_event(state, updated=False)
+            elif last_info is None:
+                # first state is only used as reference, unless a reconnecting client missed it
+                last_info = state.info
+                yield format_update_event(state, updated=is_newer(state, last_event_id))
+            else:
+                last_info = state.info
+                yield format_update_event(state)
     return Response(stream_with_context(updates_generator()), mimetype="text/event-stream")
+
+def parse_time(value: str) -> float:
+    """Return timestamp of value, a timestamp or an ISO 8601 date or datetime (local time if naive)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route("/api/channels/<string:channel>/history/")
+@get_channel_or_404
+def get_channel_history(channel):
+    """Broadcasts of channel between from and to parameters (see BroadcastHistory).
+
+    Parameters are timestamps or ISO 8601 dates. Default range is last hour,
+    and a day is given with from only (from=2024-05-01).
+    """
+    try:
+        end = parse_time(request.args["to"]) if "to" in request.args else None
+        start = parse_time(request.args["from"]) if "from" in request.args else None
+        if start is None:
+            end = time.time() if end is None else end
+            start = end - 3600
+        elif end is None:
+            end = start + 86400
+        broadcasts = BroadcastHistory(channel.endpoint).get_range(start, end)
+    except ValueError as err:
+        abort(400, str(err))
+    return jsonify({"from": start, "to": end, "broadcasts": broadcasts})
+
+@app.route("/api/channels/<string:channel>/poll/")
+@get_channel_or_404
+def poll_channel(channel):
+    """Long-poll alternative to SSE, for clients behind proxies buffering event streams.
+
+    Client sends last version it got (version parameter). Request is held until
+    version of channel changes, then metadata, card info and new version are
+    returned. After timeout (settings.LONG_POLL_TIMEOUT, or lower timeout
+    parameter), response is empty (204) and client polls again. Without version,
+    current data is returned at once.
+    """
+    version = request.args.get("version", type=int)
+    timeout = min(request.args.get("timeout", settings.LONG_POLL_TIMEOUT, type=float), settings.LONG_POLL_TIMEOUT)
+    if version is None:
+        state = ChannelState.from_view(channel.fetch())
+    else:
+        state = fanout.wait_for_change(channel.endpoint, version, max(timeout, 0))
+    if state is None:
+        response = Response(status=204)
+    else:
+        response = jsonify(format_channel_state(state))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -1,9 +1,83 @@
 ICECAST_SERVER_URL = "https://icecast.pycolore.fr/"
 
+# Icecast status page, used to count listeners of channels
+ICECAST_STATUS_URL = "http://localhost:3333/status-json.xsl"
+# status page is read in background at this interval (in seconds), and last read counts are
+# used at most ICECAST_STATUS_MAX_AGE seconds (then listeners are unknown)
+ICECAST_STATUS_INTERVAL = 20
+ICECAST_STATUS_MAX_AGE = 120
+
+# channels without listeners nor SSE subscribers update their metadata at this interval (in seconds)
+IDLE_CHANNEL_PROCESSING_INTERVAL = 60
+
+# metadata refresh (stale-while-revalidate): tick waits for fetched metadata at most
+# METADATA_REFRESH_TIMEOUT seconds, and last metadata stays published at most
+# METADATA_GRACE_PERIOD seconds after its end while refresh is running or failing
+METADATA_REFRESH_TIMEOUT = 1
+METADATA_GRACE_PERIOD = 30
+
+# metadata fetched for an external station is shared with other channels (and scheduler
+# workers) during this delay (in seconds), so that a station used by several channels is fetched once
+SHARED_METADATA_TTL = 4
+# channels wait at most this delay (in seconds) for metadata being fetched by another channel
+SHARED_METADATA_WAIT = 2
+
+# metadata of following station is fetched this delay (in seconds) before timetable transitions
+STATION_PREFETCH_LEAD_TIME = 60
+
+# channels updates are appended to a Redis stream per channel, capped to about this number of entries
+EVENTS_STREAM_MAXLEN = 1000
+
+# broadcast history (see BroadcastHistory): days of history kept, days kept with all entries
+# before downsampling, and maximal length (in days) of history range queries
+HISTORY_RETENTION_DAYS = 90
+HISTORY_DETAILED_DAYS = 7
+HISTORY_MAX_QUERY_DAYS = 31
+
+# long-poll requests (SSE fallback) are held at most this delay (in seconds) before an empty response
+LONG_POLL_TIMEOUT = 30
+
+# if set, the scheduler writes read-only API responses (json, .gz and .br) in this directory,
+# laid out as API urls (e.g. api/channels/tournesol/update/index.json), for direct serving by nginx
+STATIC_API_ROOT = None
+
+# json responses of the server larger than this size (in bytes) are gzipped if client accepts it
+JSON_COMPRESSION_MIN_SIZE = 1024
+
+# covers are stored in this directory (shared by scheduler and server), resized to fit in
+# COVER_SIZE x COVER_SIZE pixels if Pillow is installed; total size is kept under COVERS_MAX_SIZE bytes
+COVERS_ROOT = "/tmp/sunflower-covers"
+COVER_SIZE = 400
+COVERS_MAX_SIZE = 200 * 1024 * 1024
+# covers which could not be fetched are not fetched again before this delay (in seconds)
+COVER_RETRY_DELAY = 600
+
+# codec of channels data stored in Redis: "json", or "msgpack" (smaller and faster, requires msgpack
+# package). After a change, run "python manage.py migrate-persistent-data" to convert existing keys.
+PERSISTENCE_CODEC = "json"
+
 RADIO_NAME = "Radio Pycolore"
 
+# liquidsoap telnet server
+LIQUIDSOAP_TELNET_HOST = "localhost"
+LIQUIDSOAP_TELNET_PORT = 1234
+# station selected by the scheduler in liquidsoap is ignored if it wasn't confirmed during this
+# delay (in seconds, selection is sent every minute): liquidsoap then follows its static timetable
+LIQUIDSOAP_SELECTION_TIMEOUT = 180
+
 BACKUP_SONGS_GLOB_PATTERN = "/home/guillaume/radio/songs/*.opus"
 
+# minimal number of songs between two songs of the same artist in playlists
+ARTIST_MIN_GAP = 3
+
+# minimal number of songs per page of playlist pages (artists are never split between pages)
+PLAYLIST_PAGE_SIZE = 100
+
+# scheduler state snapshots (warm start): snapshots older than this delay (in seconds)
+# are ignored at startup, and state is checkpointed every SNAPSHOT_INTERVAL iterations
+SNAPSHOT_MAX_AGE = 3600
+SNAPSHOT_INTERVAL = 15
+
 # all channels handled by sunflower
 CHANNELS = ["tournesol", "music",]
 
@@ -1,20 +1,30 @@
-import telnetlib
+import functools
+import hashlib
+import itertools
+import json
 from datetime import date, datetime, time, timedelta
 from logging import Logger
-from typing import Iterable, Optional, List, Dict, Any
-import random
+from typing import Iterable, Optional, List, Dict, Any, Tuple
 
 from sunflower import settings
 from sunflower.core.bases import DynamicStation
+from sunflower.core.library import PlaylistIndex, SearchIndex
+from sunflower.core.liquidsoap import LiquidsoapError, parse_on_air
+from sunflower.core.mixins import LiquidsoapMixin
 from sunflower.core.types import CardMetadata, MetadataType, Song, MetadataDict
-from sunflower.utils.functions import fetch_cover_and_link_on_deezer, parse_songs, prevent_consecutive_artists
+from sunflower.utils.functions import fetch_cover_and_link_on_deezer, parse_songs, space_artists
+from sunflower.utils.playlist import SongIndex
 
 
-class PycolorePlaylistStation(DynamicStation):
+class PycolorePlaylistStation(DynamicStation, LiquidsoapMixin):
     station_name = "Radio Pycolore"
     station_thumbnail = "https://upload.wikimedia.org/wikipedia/commons/c/ce/Sunflower_clip_art.svg"
     endpoint = "pycolore"
 
+    # number of songs pushed in advance in liquidsoap queue, so that scheduler
+    # latency doesn't affect audio continuity (0: push each song 10 s before the
+    # end of the current one)
+    queue_ahead = 2
 
     # UNUSED:
     # for the moment playlist getter is never used, implement it later if needed.
@@ -25,47 +35,110 @@ class PycolorePlaylistStation(DynamicStation):
     
     # former playlist.setter
     def persist_playlist(self, songs: List[Song]):
-        """Persist public fields of song objects in current  playlist in redis."""
+        """Persist public fields of song objects in current  playlist in redis.
+
+        Paginated playlist index is rebuilt only if library changed, and search
+        index is updated incrementally (see PlaylistIndex and SearchIndex).
+        """
         playlist = [
             {"artist": song.artist, "title": song.title, "album": song.album}
             for song in songs
         ]
         self.set_to_redis("sunflower:station:pycolore:data", {"playlist": playlist}, expiration_delay=172800) # expiration delay = 48h
+        PlaylistIndex(self.endpoint, expiration_delay=172800).persist(songs)
+        # not skipped with playlist index: search index may be missing or stale
+        # even if playlist index is up to date
+        SearchIndex(self.endpoint).update(songs)
 
-    def __setup__(self):
-        self._songs_to_play: List[Song] = []
+    def setup(self):
+        self._songs_to_play: SongIndex = SongIndex()
+        self._library: List[Song] = [] # songs of last library scan
+        self._library_digest: Optional[str] = None
+        self._library_positions: Dict[str, int] = {} # song path -> position in self._library
         self._current_song: Optional[Song] = None
         self._current_song_end: float = 0
         self._end_of_use: datetime = datetime.now()
-    
-    def __init__(self):
-        super().__init__()
-        self._populate_songs_to_play()
-    
-    def _populate_songs_to_play(self):
-        new_songs = parse_songs(settings.BACKUP_SONGS_GLOB_PATTERN)
+        self._pushed_songs: Dict[int, Song] = {} # request id -> song, for songs pushed and not finished
+        self._current_request_id: Optional[int] = None
+
+    def start(self):
+        if not self._songs_to_play:
+            # not restored from a snapshot (library may have been scanned to check it)
+            self._populate_songs_to_play(rescan=not self._library)
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return songs to play, current song and pushed songs for snapshots (see SnapshotStore).
+
+        Songs to play are stored as positions in the last library scan, with the
+        digest of this scan, so that snapshots stay small with large libraries.
+        """
+        return {
+            "glob_pattern": settings.BACKUP_SONGS_GLOB_PATTERN,
+            "library_digest": self._library_digest,
+            "songs_to_play": [self._library_positions[song.path] for song in self._songs_to_play if song.path in self._library_positions],
+            "current_song": None if self._current_song is None else list(self._current_song),
+            "current_song_end": self._current_song_end,
+            "end_of_use": self._end_of_use.timestamp(),
+            "pushed_songs": {str(request_id): list(song) for (request_id, song) in self._pushed_songs.items()},
+            "current_request_id": self._current_request_id,
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> bool:
+        """Restore state returned by get_state(), so that songs already played
+        or pushed in liquidsoap are not played twice.
+
+        Library is scanned again to rebuild songs to play, and state is rejected
+        if songs library changed. Pushed songs unknown by liquidsoap (if it
+        restarted) are forgotten at next _sync_queue().
+        """
+        if state["glob_pattern"] != settings.BACKUP_SONGS_GLOB_PATTERN:
+            return False
+        library = self._scan_library()
+        if state.get("library_digest") != self._library_digest:
+            return False
+        self._songs_to_play = SongIndex(library[position] for position in state["songs_to_play"])
+        self._current_song = None if state["current_song"] is None else Song._make(state["current_song"])
+        self._current_song_end = state["current_song_end"]
+        self._end_of_use = datetime.fromtimestamp(state["end_of_use"])
+        self._pushed_songs = {int(request_id): Song._make(song) for (request_id, song) in state["pushed_songs"].items()}
+        self._current_request_id = state["current_request_id"]
+        return True
+
+    @staticmethod
+    def library_digest(songs: List[Song]) -> str:
+        """Return digest of given songs, changing if a song is added, removed or edited."""
+        return hashlib.sha1(json.dumps([list(song) for song in songs]).encode()).hexdigest()
+
+    def _scan_library(self) -> List[Song]:
+        """Parse songs library and keep it with its digest for snapshots."""
+        self._library = parse_songs(settings.BACKUP_SONGS_GLOB_PATTERN)
+        self._library_digest = self.library_digest(self._library)
+        self._library_positions = {song.path: position for (position, song) in enumerate(self._library)}
+        return self._library
+
+    def _populate_songs_to_play(self, rescan: bool = True):
+        new_songs = self._scan_library() if rescan else self._library
         self.persist_playlist(new_songs)
-        self._songs_to_play += random.sample(new_songs, len(new_songs))
-        self._songs_to_play = prevent_consecutive_artists(self._songs_to_play)
+        recent_artists = [song.artist for song in self._songs_to_play]
+        self._songs_to_play += space_artists(new_songs, settings.ARTIST_MIN_GAP, recent_artists)
 
     def _get_next_song(self, max_length: float):
         """Get next song in current playlist.
 
         Check if its length is not greater than remaining time befor end of use
-        of this station.
+        of this station. Near the end of use, songs are chosen so that they fill
+        the remaining time (see SongIndex).
         """
         if len(self._songs_to_play) <= 5:
             self._populate_songs_to_play()
-        for (i, song) in enumerate(self._songs_to_play):
-            if song.length < max_length:
-                return self._songs_to_play.pop(i)
-        return None
+        return self._songs_to_play.pop(max_length)
 
     @property
     def _artists(self) -> List[str]:
         """Property returning artists of the 5 next-played songs."""
         artists_list = []
-        for song in self._songs_to_play:
+        upcoming_pushed_songs = (song for (request_id, song) in self._pushed_songs.items() if request_id != self._current_request_id)
+        for song in itertools.chain(upcoming_pushed_songs, self._songs_to_play):
             if song.artist not in artists_list:
                 artists_list.append(song.artist)
             if len(artists_list) == 5:
@@ -82,31 +155,120 @@ class PycolorePlaylistStation(DynamicStation):
         if self._current_song is None:
             self._current_song_end = now.timestamp() + max_length
             return
+        try:
+            self.liquidsoap.push(f"{self.formated_station_name}_station_queue", self._current_song.path)
+        except LiquidsoapError as err:
+            # retry with another song at next iteration
+            logger.error(f"station={self.formated_station_name} Song could not be pushed: {err}")
+            self._current_song = None
+            return
         logger.debug("station={} Playing {} - {} ({} songs remaining in current list).".format(self.formated_station_name, self._current_song.artist, self._current_song.title, len(self._songs_to_play)))
         self._current_song_end = (now + timedelta(seconds=self._current_song.length)).timestamp() + delay
-        session = telnetlib.Telnet("localhost", 1234)
-        session.write("{}_station_queue.push {}\n".format(self.formated_station_name, self._current_song.path).encode())
-        session.write("exit\n".encode())
-        session.close()
+
+    def _sync_queue(self, logger: Logger, now: datetime):
+        """Update current song from liquidsoap and keep queue_ahead songs in queue.
+
+        Current song and its end come from liquidsoap (request.on_air and
+        request.metadata commands), so metadata follows real track changes.
+        Pushed songs must end before end of use of this station.
+        """
+        queue_id = f"{self.formated_station_name}_station_queue"
+        queue_reply, on_air_reply = self.liquidsoap.execute(f"{queue_id}.queue", "request.on_air")
+        queued_request_ids = [request_id for request_id in queue_reply.request_ids if request_id in self._pushed_songs]
+        playing_request_ids = [request_id for request_id in on_air_reply.request_ids if request_id in self._pushed_songs]
+
+        if playing_request_ids:
+            request_id = playing_request_ids[-1]
+            if request_id != self._current_request_id:
+                # track changed: get real start of the song
+                start = parse_on_air(self.liquidsoap.metadata(request_id)) or now
+                self._current_request_id = request_id
+                self._current_song = self._pushed_songs[request_id]
+                self._current_song_end = start.timestamp() + self._current_song.length
+                logger.debug("station={} Playing {} - {} (request id {}).".format(self.formated_station_name, self._current_song.artist, self._current_song.title, request_id))
+        elif self._current_song is not None:
+            # queue is empty and last song is over
+            self._current_request_id = None
+            self._current_song = None
+            self._current_song_end = now.timestamp()
+
+        # forget finished songs
+        for request_id in list(self._pushed_songs):
+            if request_id != self._current_request_id and request_id not in queued_request_ids:
+                del self._pushed_songs[request_id]
+
+        # push new songs if needed
+        queue_end = max(self._current_song_end, now.timestamp()) + sum(self._pushed_songs[request_id].length for request_id in queued_request_ids)
+        songs_to_push = []
+        for _ in range(self.queue_ahead - len(queued_request_ids)):
+            song = self._get_next_song(self._end_of_use.timestamp() - queue_end)
+            if song is None:
+                break
+            songs_to_push.append(song)
+            queue_end += song.length
+        if not songs_to_push:
+            if self._current_song is None:
+                # nothing to play before end of use
+                self._current_song_end = self._end_of_use.timestamp()
+            return
+        replies = self.liquidsoap.execute(*(f"{queue_id}.push {song.path}" for song in songs_to_push))
+        for song, reply in zip(songs_to_push, replies):
+            if reply.request_id is None:
+                logger.error(f"station={self.formated_station_name} Song {song.path} could not be pushed: {reply.lines}")
+                continue
+            self._pushed_songs[reply.request_id] = song
+        logger.debug("station={} {} song(s) pushed in queue ({} songs remaining in current list).".format(self.formated_station_name, len(songs_to_push), len(self._songs_to_play)))
+
+    def _flush_queue(self, logger: Logger):
+        """Remove songs pushed in liquidsoap queue when station goes off air.
+
+        Otherwise they would be played when station comes back on air, after
+        its end of use. Queued songs are put back at the end of songs to play.
+        """
+        queue_id = f"{self.formated_station_name}_station_queue"
+        try:
+            reply = self.liquidsoap.execute(f"{queue_id}.flush_and_skip")[0]
+        except LiquidsoapError as err:
+            logger.error(f"station={self.formated_station_name} Liquidsoap queue could not be flushed: {err}")
+            return
+        if any(line.startswith("ERROR") for line in reply.lines):
+            logger.error(f"station={self.formated_station_name} Liquidsoap queue could not be flushed: {reply.lines}")
+            return
+        self._songs_to_play += [song for (request_id, song) in self._pushed_songs.items() if request_id != self._current_request_id]
+        self._pushed_songs = {}
+        self._current_request_id = None
+        self._current_song = None
+        self._current_song_end = 0
+        logger.debug(f"station={self.formated_station_name} Liquidsoap queue flushed (station is off air).")
+
+    def prepare_metadata(self, current_metadata: MetadataDict, logger: Logger, dt: datetime):
+        """Return function building metadata from a copy of current song and next artists.
+
+        State of the station is modified by process() in scheduler thread while
+        cover is fetched on Deezer in a background thread.
+        """
+        return functools.partial(self._build_metadata, self._current_song, self._current_song_end, tuple(self._artists))
 
     def get_metadata(self, current_metadata: MetadataDict, logger: Logger, dt: datetime):
-        if self._current_song is None:
+        return self.prepare_metadata(current_metadata, logger, dt)()
+
+    def _build_metadata(self, current_song: Optional[Song], current_song_end: float, artists: Tuple[str, ...]) -> MetadataDict:
+        if current_song is None:
             return {
                 "station": self.station_name,
                 "type": MetadataType.WAITING_FOR_FOLLOWING,
-                "end": self._current_song_end,
+                "end": current_song_end,
             }
-        artists_list = tuple(self._artists)
-        artists_str = ", ".join(artists_list[:-1]) + " et " + artists_list[-1]
-        thumbnail_src, link = fetch_cover_and_link_on_deezer(self.station_thumbnail, self._current_song.artist, self._current_song.album, self._current_song.title)
+        artists_str = ", ".join(artists[:-1]) + " et " + artists[-1]
+        thumbnail_src, link = fetch_cover_and_link_on_deezer(self.station_thumbnail, current_song.artist, current_song.album, current_song.title)
         return {
             "station": self.station_name,
             "type": MetadataType.MUSIC,
-            "artist": self._current_song.artist,
-            "title": self._current_song.title,
+            "artist": current_song.artist,
+            "title": current_song.title,
             "thumbnail_src": thumbnail_src,
             "link": link,
-            "end": int(self._current_song_end),
+            "end": int(current_song_end),
             "show": "La playlist Pycolore",
             "summary": "Une sélection aléatoire de chansons parmi les musiques stockées sur Pycolore. À suivre : {}.".format(artists_str)
         }
@@ -125,14 +287,17 @@ class PycolorePlaylistStation(DynamicStation):
         """Play new song if needed.
         
         Compute end of use time of this station.
-        If current song is about to end, prepare and play next song.
-
-        Call _play() to trigger next song.
+        In queue-ahead mode, call _sync_queue() for keeping liquidsoap queue filled,
+        and flush the queue when station goes off air.
+        Else, if current song is about to end, prepare and play next song:
+        call _play() to trigger next song.
         """
 
         # if station is not used, return
         channels_using_self = channels_using[self]
         if not channels_using_self:
+            if self.queue_ahead and self._pushed_songs:
+                self._flush_queue(logger)
             return
 
         # compute end of use
@@ -141,6 +306,13 @@ class PycolorePlaylistStation(DynamicStation):
             if self._end_of_use < end_of_current_station:
                 self._end_of_use = end_of_current_station
 
+        if self.queue_ahead:
+            try:
+                self._sync_queue(logger, now)
+            except LiquidsoapError as err:
+                logger.error(f"station={self.formated_station_name} Liquidsoap queue could not be synchronized: {err}")
+            return
+
         if self._current_song_end - 10 < now.timestamp():
             delay = max(self._current_song_end - now.timestamp(), 0)
             max_length = (self._end_of_use - now).seconds - delay
@@ -92,6 +92,10 @@ class RadioFranceStation(URLStation):
     _station_api_name: str
     _grid_template = RADIO_FRANCE_GRID_TEMPLATE
 
+    def setup(self):
+        super().setup()
+        self._cached_grid: List[Dict[str, Any]] = [] # steps of last fetched grid, for fallback metadata
+
     @property
     def token(self):
         if os.getenv("TOKEN") is None: # in case of development server
@@ -272,7 +276,40 @@ class RadioFranceStation(URLStation):
         except requests.exceptions.Timeout:
             return {"message": "API Timeout"}
         data = json.loads(rep.content.decode())
+        grid = (data.get("data") or {}).get("grid")
+        if grid:
+            # called in a background thread: grid is replaced, never mutated, so that
+            # get_fallback_metadata() iterates over a consistent grid in scheduler thread
+            self._cached_grid = grid
         return data
+
+    def get_fallback_metadata(self, current_metadata: MetadataDict, logger: Logger, dt: datetime):
+        """Return metadata of programme planned at dt in last fetched grid, without cover nor request."""
+        dt_timestamp = dt.timestamp()
+        for step in self._cached_grid:
+            if step.get("end") is None or step["end"] <= dt_timestamp:
+                continue
+            if step["start"] > dt_timestamp:
+                return {"station": self.station_name, "type": MetadataType.NONE, "end": int(step["start"])}
+            metadata = {
+                "station": self.station_name,
+                "type": MetadataType.PROGRAMME,
+                "end": int(step["end"]),
+                "thumbnail_src": self.station_thumbnail,
+            }
+            diffusion = step.get("diffusion")
+            if diffusion is None:
+                metadata["show_title"] = step["title"]
+            else:
+                metadata.update({
+                    "show_title": (diffusion.get("show") or {}).get("title", ""),
+                    "show_url": (diffusion.get("show") or {}).get("url", ""),
+                    "diffusion_title": diffusion["title"],
+                    "diffusion_url": diffusion.get("url", ""),
+                    "diffusion_summary": (diffusion.get("standFirst") or "").strip(),
+                })
+            return metadata
+        return None
     
     @staticmethod
     def _find_current_child_show(children: List[Any], parent: Dict[str, Any], dt: datetime):
@@ -54,6 +54,21 @@ class RTL2(URLStation):
             current_broadcast_title=current_broadcast_title,
         )
 
+    def get_fallback_metadata(self, current_metadata: MetadataDict, logger: Logger, dt: datetime):
+        """Return current show from last fetched show data (stored in current metadata), if not over."""
+        show_end = current_metadata.get("show_end")
+        if show_end is None or show_end < dt.timestamp():
+            return None
+        return {
+            "station": self.station_name,
+            "type": MetadataType.PROGRAMME,
+            "thumbnail_src": self.station_thumbnail,
+            "show_title": current_metadata.get("show_title", ""),
+            "show_summary": current_metadata.get("show_summary", ""),
+            "show_end": show_end,
+            "end": show_end,
+        }
+
     def _fetch_song_metadata(self, retry=0):
         """Return mapping containing song info"""
         try:
@@ -0,0 +1,147 @@
+"""Static assets: content-hashed copies, precompressed variants and compressed responses."""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError: # optional dependency (pip install sunflower[brotli])
+    brotli = None
+
+from flask import Flask, Response, request, send_from_directory, url_for
+
+from sunflower import settings
+
+# hashed assets and their manifest are written in this subdirectory of static folder
+ASSETS_DIRECTORY = "assets"
+MANIFEST_FILENAME = "manifest.json"
+
+# only these files are precompressed (other formats are already compressed)
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".html", ".txt", ".json", ".map"}
+
+# hashed assets never change: they can be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# content codings supported for precompressed assets, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def compress_static(static_folder: str) -> Dict[str, str]:
+    """Build content-hashed copies of files of static folder, with gzip and brotli variants.
+
+    A file index.css is copied to assets/index.<hash>.css (hash of its content),
+    along with index.<hash>.css.gz and index.<hash>.css.br (if brotli package is
+    installed) for compressible formats. Previous builds are removed. Return
+    manifest (original name -> hashed name), also written in assets/manifest.json.
+    """
+    assets_folder = os.path.join(static_folder, ASSETS_DIRECTORY)
+    shutil.rmtree(assets_folder, ignore_errors=True)
+    os.makedirs(assets_folder)
+    manifest = {}
+    for root, directories, filenames in os.walk(static_folder):
+        directories[:] = [directory for directory in directories if os.path.join(root, directory) != assets_folder]
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            relative_path = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as file:
+                data = file.read()
+            stem, extension = os.path.splitext(relative_path)
+            hashed_path = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+            target = os.path.join(assets_folder, hashed_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as file:
+                file.write(data)
+            if extension in COMPRESSIBLE_EXTENSIONS:
+                with open(target + ".gz", "wb") as file:
+                    file.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + ".br", "wb") as file:
+                        file.write(brotli.compress(data, quality=11))
+            manifest[relative_path] = f"{ASSETS_DIRECTORY}/{hashed_path}"
+    with open(os.path.join(assets_folder, MANIFEST_FILENAME), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """Serve static assets with hashed urls, immutable caching and precompressed variants.
+
+    asset_url(filename) template global returns url of hashed copy of
+    filename if it was built (see compress_static()), else its plain url.
+    Manifest is reloaded when it changes, so that a build doesn't require a
+    restart. Hashed assets are served with their precompressed variant
+    matching Accept-Encoding header, if any.
+
+    JSON responses larger than settings.JSON_COMPRESSION_MIN_SIZE bytes are
+    gzipped on the fly if client accepts it.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.assets_folder = os.path.join(app.static_folder, ASSETS_DIRECTORY)
+        self._manifest: Dict[str, str] = {}
+        self._manifest_mtime: Optional[float] = None
+        app.add_template_global(self.asset_url)
+        app.view_functions["static"] = self.send_static_file
+        app.after_request(self.compress_json_response)
+
+    @property
+    def manifest(self) -> Dict[str, str]:
+        try:
+            mtime = os.stat(os.path.join(self.assets_folder, MANIFEST_FILENAME)).st_mtime
+        except FileNotFoundError:
+            self._manifest, self._manifest_mtime = {}, None
+            return self._manifest
+        if mtime != self._manifest_mtime:
+            with open(os.path.join(self.assets_folder, MANIFEST_FILENAME)) as file:
+                self._manifest = json.load(file)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def asset_url(self, filename: str) -> str:
+        return url_for("static", filename=self.manifest.get(filename, filename))
+
+    def send_static_file(self, filename: str) -> Response:
+        if not filename.startswith(ASSETS_DIRECTORY + "/"):
+            return self.app.send_static_file(filename)
+        # hashed asset
+        accepted_encodings = request.accept_encodings
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for encoding, suffix in ENCODINGS:
+            if accepted_encodings[encoding] and os.path.isfile(os.path.join(self.app.static_folder, filename + suffix)):
+                response = send_from_directory(self.app.static_folder, filename + suffix, mimetype=mimetype, max_age=0)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(self.app.static_folder, filename, max_age=0)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add("Accept-Encoding")
+        return response
+
+    @staticmethod
+    def compress_json_response(response: Response) -> Response:
+        if (
+            response.mimetype != "application/json"
+            or response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        if not request.accept_encodings["gzip"]:
+            return response
+        data = response.get_data()
+        if len(data) < settings.JSON_COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+        etag, _ = response.get_etag()
+        if etag is not None:
+            # compressed representation is not byte-identical to uncompressed one
+            response.set_etag(etag, weak=True)
+        return response
@@ -3,6 +3,7 @@
 
 import click
 from click.exceptions import Exit
+import glob
 import subprocess
 import os
 
@@ -72,17 +73,24 @@ def start_liquidsoap(restart=False):
         )
 
 
-def start_scheduler(restart=False):
+def start_scheduler(restart=False, workers=0):
+    """Start scheduler. If workers > 0, start as many workers sharing channels and stations."""
     if restart:
         stop_scheduler()
-    click.secho("Starting scheduler", bold=True, fg="cyan")
-    os.system("python sunflower/scheduler.py")
-    success_cli("Scheduler started.")
+    if not workers:
+        click.secho("Starting scheduler", bold=True, fg="cyan")
+        os.system("python sunflower/scheduler.py")
+        success_cli("Scheduler started.")
+    for worker in range(workers):
+        click.secho("Starting scheduler worker {}".format(worker), bold=True, fg="cyan")
+        os.system("python sunflower/scheduler.py --worker {}".format(worker))
+    success_cli("{} scheduler workers started.".format(workers))
 
 
 def stop_scheduler():
     click.secho("Killing current scheduler", bold=True, fg="cyan")
-    os.system("kill $(cat /tmp/sunflower-radio-scheduler.pid)")
+    for pid_file in glob.glob("/tmp/sunflower-radio-scheduler*.pid"):
+        os.system("kill $(cat {})".format(pid_file))
 
 
 def stop_liquidsoap():
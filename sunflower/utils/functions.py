@@ -2,10 +2,13 @@
 
 import functools
 import glob
+import heapq
+import itertools
 import json
-from typing import List, Dict, Any
+import random
+from typing import List, Dict, Any, Deque, Optional, Sequence, Tuple
 
-from collections import namedtuple
+from collections import Counter, deque, namedtuple
 
 import mutagen
 import requests
@@ -29,11 +32,11 @@ def get_channel_or_404(view_function):
 
 def get_station_or_404(view_function):
     @functools.wraps(view_function)
-    def wrapper(station: str):
+    def wrapper(station: str, **kwargs):
         if station not in settings.STATIONS:
             abort(404)
         station_view = StationView(station)
-        return view_function(station_view)
+        return view_function(station_view, **kwargs)
     return wrapper
 
 # utils functions
@@ -61,6 +64,101 @@ def prevent_consecutive_artists(songs_list: List[Song]) -> List[Song]:
             n, j = n + 1, j + 1
     return songs
 
+def space_artists(songs_list: List[Song], min_gap: int = 1,
+                  recent_artists: Sequence[str] = (), rng: random.Random = random) -> List[Song]:
+    """Return songs in a random order where an artist never comes back within min_gap songs.
+
+    Songs of each artist are shuffled, then positions are filled one by one with
+    two priority queues over the artists which are not cooling down:
+    - a weighted random one (an artist is drawn proportionally to its number of
+      remaining songs, which gives the same distribution as a plain shuffle);
+    - a remaining-songs one, used when the biggest artist must be played right
+      away for the gap to remain achievable.
+
+    An artist played at position i can't be drawn again before position i + min_gap + 1.
+    If every remaining artist is cooling down (one artist dominates the list), the
+    one which has waited the longest is played anyway, so the gap is only shortened
+    where it can't be respected. Complexity is O(n log a), a being the number of artists.
+
+    Parameters:
+    - songs_list: a list of sunflower.core.types.Song objects
+    - min_gap: minimal number of songs between two songs of the same artist
+    - recent_artists: artists of previously queued songs (last one is the most recent),
+      they are considered as cooling down at the beginning of the new list
+    - rng: random number generator (random module or random.Random instance)
+
+    Return: a new list (input list is not mutated)
+    """
+    songs_by_artist: Dict[str, List[Song]] = {}
+    for song in songs_list:
+        songs_by_artist.setdefault(song.artist, []).append(song)
+    for songs in songs_by_artist.values():
+        rng.shuffle(songs)
+
+    # number of artists for each count of remaining songs, for tracking the biggest artist
+    artists_by_count = Counter(len(songs) for songs in songs_by_artist.values())
+    max_count = max(artists_by_count, default=0)
+
+    # both heaps contain (key, stamp, artist) entries; an entry is outdated
+    # if its stamp is not the current stamp of the artist
+    random_heap: List[Tuple[float, int, str]] = []
+    count_heap: List[Tuple[int, int, str]] = []
+    stamps: Dict[str, Optional[int]] = {}
+    cooling_down: Deque[Tuple[int, str]] = deque()
+    stamp_counter = itertools.count()
+
+    def make_available(artist):
+        stamp = stamps[artist] = next(stamp_counter)
+        remaining = len(songs_by_artist[artist])
+        heapq.heappush(random_heap, (-rng.random() ** (1 / remaining), stamp, artist))
+        heapq.heappush(count_heap, (-remaining, stamp, artist))
+
+    def pop_available(heap):
+        while heap:
+            _, stamp, artist = heapq.heappop(heap)
+            if stamps[artist] == stamp:
+                return artist
+        return None
+
+    # artists recently played are cooling down, the most recent one for min_gap positions
+    release_positions = {}
+    for distance, artist in enumerate(reversed(recent_artists[-min_gap:] if min_gap else ()), start=1):
+        if artist in songs_by_artist and artist not in release_positions:
+            release_positions[artist] = min_gap + 1 - distance
+    for artist, position in sorted(release_positions.items(), key=lambda item: item[1]):
+        stamps[artist] = None
+        cooling_down.append((position, artist))
+    for artist in songs_by_artist.keys() - release_positions.keys():
+        make_available(artist)
+
+    number_of_songs = len(songs_list)
+    spaced_songs: List[Song] = []
+    for position in range(number_of_songs):
+        while cooling_down and cooling_down[0][0] <= position:
+            make_available(cooling_down.popleft()[1])
+
+        # the biggest artist needs (max_count - 1) * (min_gap + 1) + 1 positions,
+        # if there is no spare position left, play the biggest artists first
+        tight = (max_count - 1) * (min_gap + 1) + artists_by_count[max_count] >= number_of_songs - position
+        artist = pop_available(count_heap if tight else random_heap)
+        if artist is None:
+            # every artist is cooling down: play the one which waited the longest
+            artist = cooling_down.popleft()[1]
+        stamps[artist] = None
+
+        artist_songs = songs_by_artist[artist]
+        remaining = len(artist_songs)
+        artists_by_count[remaining] -= 1
+        if remaining > 1:
+            artists_by_count[remaining - 1] += 1
+        if remaining == max_count and not artists_by_count[remaining]:
+            max_count -= 1
+
+        spaced_songs.append(artist_songs.pop())
+        if artist_songs:
+            cooling_down.append((position + min_gap + 1, artist))
+    return spaced_songs
+
 def parse_songs(glob_pattern: str) -> List[Song]:
     """Parse songs matching glob_pattern and return a list of Song objects.
     
@@ -0,0 +1,146 @@
+"""Song selection engine used by playlist stations."""
+
+import itertools
+from bisect import bisect_right, insort
+from collections import deque
+from typing import Container, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sunflower.core.types import Song
+
+
+class SongIndex:
+    """Songs to play, kept in play order and indexed by length.
+
+    Songs are played in the order they were added, as long as they fit in the
+    remaining time of the slot. When the next song is too long, the longest song
+    fitting in the remaining time is picked instead (bisect in the length index).
+
+    When the remaining time is shorter than planning_horizon (in seconds), the
+    end of the slot is planned: plan() returns songs filling the remaining
+    time as closely as possible, in play order (plans start with one of the
+    planning_candidates first fitting songs and are completed with the first
+    fitting songs). pop() then returns planned songs in play order, keeping
+    the plan as long as it still fits in the remaining time without leaving
+    a larger gap, and songs left out of the plan stay next in play order.
+
+    Picks cost O(log n) (plus a memmove for removal from the length index),
+    except plans, where songs are looked up in play order.
+    """
+
+    def __init__(self, songs: Iterable[Song] = (), planning_horizon: float = 900, planning_candidates: int = 8, max_planned_songs: int = 10):
+        self.planning_horizon = planning_horizon
+        self.planning_candidates = planning_candidates
+        self.max_planned_songs = max_planned_songs
+        self._songs: Dict[int, Song] = {} # position -> song, for songs still to play
+        self._order: Deque[int] = deque() # positions in play order (may contain already played positions)
+        self._by_length: List[Tuple[float, int]] = [] # sorted (length, position)
+        self._positions = itertools.count()
+        self._planned: List[int] = [] # positions of planned songs to play, in play order
+        self._planned_gap = 0.0 # remaining time not filled by planned songs, when plan was made
+        self.extend(songs)
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def __iter__(self) -> Iterator[Song]:
+        """Iterate over songs to play in play order."""
+        return (self._songs[position] for position in self._order if position in self._songs)
+
+    def __iadd__(self, songs: Iterable[Song]) -> "SongIndex":
+        self.extend(songs)
+        return self
+
+    def extend(self, songs: Iterable[Song]):
+        """Add songs at the end of the play order."""
+        for song in songs:
+            position = next(self._positions)
+            self._songs[position] = song
+            self._order.append(position)
+            insort(self._by_length, (song.length, position))
+
+    def _remove(self, position: int) -> Song:
+        song = self._songs.pop(position)
+        del self._by_length[bisect_right(self._by_length, (song.length, position)) - 1]
+        while self._order and self._order[0] not in self._songs:
+            self._order.popleft()
+        return song
+
+    def _longest_fitting(self, max_length: float, excluded: Container[int] = (), count: int = 1) -> List[int]:
+        """Return positions of the count longest songs not longer than max_length, longest first."""
+        found = []
+        i = bisect_right(self._by_length, (max_length, float("inf"))) - 1
+        while i >= 0 and len(found) < count:
+            position = self._by_length[i][1]
+            if position not in excluded:
+                found.append(position)
+            i -= 1
+        return found
+
+    def _first_fitting(self, max_length: float, excluded: Container[int] = (), count: int = 1) -> List[int]:
+        """Return positions of the count first songs in play order not longer than max_length."""
+        found: List[int] = []
+        if not self._by_length or self._by_length[0][0] > max_length:
+            return found
+        for position in self._order:
+            if position in self._songs and position not in excluded and self._songs[position].length <= max_length:
+                found.append(position)
+                if len(found) == count:
+                    break
+        return found
+
+    def _plan_positions(self, max_length: float) -> List[int]:
+        best_plan: List[int] = []
+        best_gap = max_length
+        for first_position in self._first_fitting(max_length, count=self.planning_candidates):
+            plan = {first_position}
+            gap = max_length - self._songs[first_position].length
+            while len(plan) < self.max_planned_songs:
+                found = self._first_fitting(gap, excluded=plan)
+                if not found:
+                    break
+                plan.add(found[0])
+                gap -= self._songs[found[0]].length
+            # earlier candidates win in case of equality
+            if gap < best_gap:
+                best_plan, best_gap = sorted(plan), gap # positions are increasing in play order
+            if not gap:
+                break
+        return best_plan
+
+    def plan(self, max_length: float) -> List[Song]:
+        """Return songs filling max_length seconds as closely as possible, in play order.
+
+        Songs are not removed from the index.
+        """
+        return [self._songs[position] for position in self._plan_positions(max_length)]
+
+    def _pop_planned(self, max_length: float) -> Optional[Song]:
+        planned_length = sum(self._songs[position].length for position in self._planned if position in self._songs)
+        if (
+            not self._planned
+            or any(position not in self._songs for position in self._planned)
+            or planned_length > max_length
+            or max_length - planned_length > self._planned_gap
+        ):
+            self._planned = self._plan_positions(max_length)
+            self._planned_gap = max_length - sum(self._songs[position].length for position in self._planned)
+        if not self._planned:
+            return None
+        return self._remove(self._planned.pop(0))
+
+    def pop(self, max_length: float = float("inf")) -> Optional[Song]:
+        """Remove and return next song to play in the max_length remaining seconds.
+
+        Within planning horizon, next planned song is returned (see plan()).
+        Return None if no song fits.
+        """
+        if not self._songs:
+            return None
+        if max_length <= self.planning_horizon:
+            return self._pop_planned(max_length)
+        self._planned = []
+        next_position = self._order[0]
+        if self._songs[next_position].length <= max_length:
+            return self._remove(next_position)
+        found = self._longest_fitting(max_length)
+        return self._remove(found[0]) if found else None
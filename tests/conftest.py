@@ -0,0 +1,170 @@
+import http.server
+import json
+import socket
+import socketserver
+import threading
+
+import pytest
+
+
+class FakeLiquidsoapServer(socketserver.ThreadingTCPServer):
+    """Local stand-in for liquidsoap telnet server.
+
+    Supported commands:
+    - <queue>.push <uri>: return a new request id
+    - <queue>.queue: return ids of requests waiting in queue
+    - <queue>.flush_and_skip: remove requests of queue and stop current one
+    - request.on_air: return ids of requests on air
+    - request.metadata <id>: return on_air, status and filename metadata
+    - var.set <name> = <value>: set an interactive variable
+    - exit: close connection
+
+    Received commands are stored in commands list. play_next() simulates
+    the beginning of next track of a queue.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), FakeLiquidsoapHandler)
+        self.commands = []
+        self.connections = 0
+        self.queues = {}
+        self.on_air = {} # queue -> (request id, uri, on air datetime)
+        self.variables = {}
+        self._handlers = []
+        self._request_ids = iter(range(1, 1_000_000))
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def drop_connections(self):
+        """Close all open connections, as liquidsoap does with idle connections."""
+        for handler in self._handlers:
+            try:
+                handler.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._handlers.clear()
+
+    def play_next(self, queue_id, start):
+        """Put first request of given queue on air, as if it started at start datetime."""
+        self.on_air.pop(queue_id, None)
+        if self.queues.get(queue_id):
+            request_id, uri = self.queues[queue_id].pop(0)
+            self.on_air[queue_id] = (request_id, uri, start)
+
+    def execute(self, command):
+        """Return reply lines for given command."""
+        self.commands.append(command)
+        name, _, argument = command.partition(" ")
+        if name.endswith(".push"):
+            request_id = next(self._request_ids)
+            self.queues.setdefault(name[:-len(".push")], []).append((request_id, argument))
+            return [str(request_id)]
+        if name.endswith(".flush_and_skip"):
+            queue_id = name[:-len(".flush_and_skip")]
+            self.queues.pop(queue_id, None)
+            self.on_air.pop(queue_id, None)
+            return ["Done"]
+        if name.endswith(".queue"):
+            return [" ".join(str(request_id) for request_id, _ in self.queues.get(name[:-len(".queue")], []))]
+        if name == "request.on_air":
+            return [" ".join(str(request_id) for request_id, _, _ in self.on_air.values())]
+        if name == "request.metadata":
+            for request_id, uri, start in self.on_air.values():
+                if str(request_id) == argument:
+                    return [f'on_air="{start:%Y/%m/%d %H:%M:%S}"', 'status="playing"', f'filename="{uri}"']
+            return []
+        if name == "var.set":
+            variable, _, value = argument.partition(" = ")
+            self.variables[variable] = value.strip('"')
+            return [f"Variable {variable} set."]
+        return ['ERROR: unknown command, type "help" to get a list of commands.']
+
+
+class FakeLiquidsoapHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        self.server._handlers.append(self)
+        try:
+            for line in self.rfile:
+                command = line.decode().strip()
+                if command in ("exit", "quit"):
+                    self.wfile.write(b"Bye!\r\n")
+                    return
+                reply = "".join(line + "\r\n" for line in self.server.execute(command))
+                self.wfile.write((reply + "END\r\n").encode())
+        except (OSError, ValueError):
+            return
+
+
+@pytest.fixture
+def liquidsoap_server():
+    server = FakeLiquidsoapServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.drop_connections()
+    server.server_close()
+
+
+class FakeIcecastServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for Icecast status page (status-json.xsl).
+
+    listeners attribute maps mounts to their number of listeners.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), FakeIcecastHandler)
+        self.listeners = {}
+
+    @property
+    def status_url(self):
+        return f"http://localhost:{self.server_address[1]}/status-json.xsl"
+
+
+class FakeIcecastHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        sources = [
+            {"listenurl": f"http://localhost:3333/{mount}", "listeners": listeners}
+            for mount, listeners in self.server.listeners.items()
+        ]
+        # Icecast doesn't use a list when there is only one source
+        body = json.dumps({"icestats": {"source": sources[0] if len(sources) == 1 else sources}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def icecast_server():
+    server = FakeIcecastServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_db():
+    """Redis connection. Tests using it are skipped if Redis server is not running."""
+    import redis
+    db = redis.Redis()
+    try:
+        db.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis server is not running.")
+    yield db
+    db.close()
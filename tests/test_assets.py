@@ -0,0 +1,36 @@
+import gzip
+
+from flask import Flask, jsonify, render_template_string
+
+from sunflower.utils.assets import IMMUTABLE_CACHE_CONTROL, StaticAssets, compress_static
+
+
+def test_hashed_and_compressed_assets(tmp_path):
+    (tmp_path / "index.css").write_text("body { color: black; }\n" * 10)
+    manifest = compress_static(str(tmp_path))
+    assert manifest["index.css"].startswith("assets/index.") and manifest["index.css"].endswith(".css")
+    assert (tmp_path / (manifest["index.css"] + ".gz")).exists()
+
+    app = Flask(__name__, static_url_path="/static", static_folder=str(tmp_path))
+    StaticAssets(app)
+
+    @app.route("/big/")
+    def big():
+        return jsonify(["x" * 2000])
+
+    client = app.test_client()
+    with app.test_request_context():
+        url = render_template_string('{{ asset_url("index.css") }}')
+        assert url == "/static/" + manifest["index.css"]
+        assert render_template_string('{{ asset_url("unknown.css") }}') == "/static/unknown.css"
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.mimetype == "text/css"
+    assert gzip.decompress(response.data) == (tmp_path / "index.css").read_bytes()
+    assert "Content-Encoding" not in client.get(url).headers
+
+    response = client.get("/big/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data).startswith(b'["xxx')
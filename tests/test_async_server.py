@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from sunflower import settings
+from sunflower.async_server import app, get_fanout
+from sunflower.core.fanout import ChannelState
+
+
+async def request(path, query_string=b"", headers=(), method="GET"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string, "headers": list(headers)}
+    await app(scope, receive, send)
+    return messages[0]["status"], dict(messages[0]["headers"]), b"".join(message.get("body", b"") for message in messages[1:])
+
+
+def test_api_views(monkeypatch):
+    fanout = get_fanout()
+    monkeypatch.setattr(fanout, "start", lambda: None) # states are set by test instead of Redis task
+    endpoint = settings.CHANNELS[0]
+
+    async def main():
+        fanout.update([ChannelState(endpoint, 3, {"type": "Track"}, {"current_station": "A"}) for endpoint in settings.CHANNELS])
+        status, headers, body = await request(f"/api/channels/{endpoint}/update/")
+        assert status == 200 and json.loads(body) == {"current_station": "A"}
+
+        status, headers, body = await request("/api/now-playing/")
+        assert json.loads(body)["channels"][endpoint]["version"] == 3
+        status, _, _ = await request("/api/now-playing/", headers=[(b"if-none-match", headers[b"etag"])])
+        assert status == 304
+        status, head_headers, body = await request("/api/now-playing/", method="HEAD")
+        assert status == 200 and body == b"" and head_headers[b"content-length"] == headers[b"content-length"]
+
+        status, _, _ = await request(f"/api/channels/{endpoint}/poll/", b"version=3&timeout=0.05")
+        assert status == 204
+        poll = asyncio.ensure_future(request(f"/api/channels/{endpoint}/poll/", b"version=3"))
+        await asyncio.sleep(0.01)
+        fanout.update([ChannelState(endpoint, 4, {"type": "Track"}, {"current_station": "B"})])
+        status, _, body = await poll
+        assert status == 200 and json.loads(body)["version"] == 4
+
+        assert (await request("/api/unknown/"))[0] == 404
+
+    asyncio.run(main())
@@ -1,4 +1,15 @@
+import concurrent.futures
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sunflower import settings
 from sunflower.channels import tournesol, music
+from sunflower.core.bases import Channel, STATIONS_INSTANCES, URLStation
+from sunflower.core.functions import write_liquidsoap_config, LiquidsoapConfigChange
+from sunflower.core.liquidsoap import LiquidsoapClient
+from sunflower.core.mixins import LiquidsoapMixin
+from sunflower.core.types import MetadataType
 from sunflower.stations import FranceMusique, FranceInter, FranceInfo, FranceCulture, RTL2, PycolorePlaylistStation
 from collections import Counter
 
@@ -8,4 +19,111 @@ def test_tournesol_station_parsing():
     assert Counter(tournesol.stations) == Counter((FranceCulture, FranceInfo, FranceInter, FranceMusique, RTL2, PycolorePlaylistStation))
 
 def test_music_station_parsing():
-    assert Counter(music.stations) == Counter((RTL2, PycolorePlaylistStation))
\ No newline at end of file
+    assert Counter(music.stations) == Counter((RTL2, PycolorePlaylistStation))
+
+def test_liquidsoap_config_changes(tmp_path):
+    filename = str(tmp_path / "sunflower")
+    assert write_liquidsoap_config(music, filename=filename) == LiquidsoapConfigChange.STRUCTURE
+    assert write_liquidsoap_config(music, filename=filename) == LiquidsoapConfigChange.NONE
+    with open(filename + ".liq") as f:
+        assert f.readline().startswith("#!")
+        assert f.readline().startswith("# structure: ")
+
+    # same stations, other timetable: no restart needed
+    other_timetable = Channel("music", timetable={tuple(range(7)): [
+        ("00:00", "12:00", RTL2),
+        ("12:00", "00:00", PycolorePlaylistStation),
+    ]})
+    assert write_liquidsoap_config(other_timetable, filename=filename) == LiquidsoapConfigChange.TIMETABLE
+
+    # new station: liquidsoap must be restarted
+    other_stations = Channel("music", timetable={tuple(range(7)): [
+        ("00:00", "12:00", RTL2),
+        ("12:00", "00:00", FranceInter),
+    ]})
+    assert write_liquidsoap_config(other_stations, filename=filename) == LiquidsoapConfigChange.STRUCTURE
+
+
+def test_station_selection_in_liquidsoap(liquidsoap_server, monkeypatch):
+    monkeypatch.setattr(LiquidsoapMixin, "liquidsoap", LiquidsoapClient("localhost", liquidsoap_server.port))
+    now = datetime.now()
+    music._select_station_in_liquidsoap(logging.getLogger(__name__), now)
+    assert liquidsoap_server.variables == {
+        "music_station": music.current_station.formated_station_name,
+        "music_station_time": f"{now.timestamp():.1f}",
+    }
+    music._select_station_in_liquidsoap(logging.getLogger(__name__), now)
+    assert len(liquidsoap_server.commands) == 2, "Selection must not be sent again if it didn't change"
+    music._select_station_in_liquidsoap(logging.getLogger(__name__), now + timedelta(seconds=61))
+    assert liquidsoap_server.variables["music_station_time"] == f"{now.timestamp() + 61:.1f}", "Selection time must be confirmed every minute"
+    music._liquidsoap_selection = None
+
+
+def test_following_station_prefetch():
+    logger = logging.getLogger(__name__)
+    calls = []
+
+    class PrefetchedStation(URLStation):
+        station_name = "Prefetched"
+        station_url = "http://localhost/prefetched"
+
+        def get_metadata(self, current_metadata, logger, dt):
+            calls.append(dt)
+            return {"station": self.station_name, "type": MetadataType.NONE, "end": int(dt.timestamp()) + 60}
+
+    channel = Channel("music", timetable={tuple(range(7)): [
+        ("00:00", "12:00", RTL2),
+        ("12:00", "00:00", PrefetchedStation),
+    ]})
+    now = datetime.now()
+    transition = now + timedelta(seconds=settings.STATION_PREFETCH_LEAD_TIME + 10)
+    channel.current_station_start, channel.current_station_end = now - timedelta(hours=1), transition
+    channel._current_station_instance, channel._following_station_instance = RTL2(), PrefetchedStation()
+
+    channel._prefetch_following_station(logger, now)
+    assert channel._prefetch_future is None, "Metadata must not be prefetched before lead time"
+    channel._prefetch_following_station(logger, now + timedelta(seconds=20))
+    channel._prefetch_following_station(logger, now + timedelta(seconds=24))
+    assert channel._prefetch_future.result(timeout=1)["end"] == int(transition.timestamp()) + 60
+    assert calls == [transition], "Metadata must be prefetched once, for transition time"
+
+    # transition
+    channel.current_station_start, channel.current_station_end = transition, transition + timedelta(hours=1)
+    channel._current_station_instance = PrefetchedStation()
+    metadata = channel._refresh_metadata(None, logger, transition + timedelta(seconds=2))
+    assert metadata["station"] == "Prefetched" and calls == [transition]
+    STATIONS_INSTANCES.pop("PrefetchedStation")
+
+
+def test_shared_station_metadata(redis_db):
+    logger = logging.getLogger(__name__)
+    calls = []
+
+    class SharedStation(URLStation):
+        station_name = "Shared"
+        station_url = "http://localhost/shared"
+
+        def get_metadata(self, current_metadata, logger, dt):
+            calls.append(dt)
+            time.sleep(0.3)
+            return {"station": self.station_name, "type": MetadataType.MUSIC, "end": int(dt.timestamp()) + 60}
+
+    timetable = {tuple(range(7)): [("00:00", "00:00", SharedStation)]}
+    channels = [Channel("music", timetable=timetable), Channel("tournesol", timetable=timetable)]
+    keys = [f"sunflower:station:shared:shared_metadata{suffix}" for suffix in ("", ":lock", ":done")]
+    redis_db.delete(*keys)
+    try:
+        now = datetime.now()
+        results = [channel._fetch_shared_metadata(SharedStation().prepare_metadata({}, logger, now), logger, SharedStation()) for channel in channels]
+        assert results[0] == results[1] and results[0]["type"] == MetadataType.MUSIC
+        assert len(calls) == 1, "Station used by several channels must be fetched once"
+
+        # concurrent fetches: second channel waits for the first one
+        redis_db.delete(*keys)
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(channel._fetch_shared_metadata, SharedStation().prepare_metadata({}, logger, now), logger, SharedStation()) for channel in channels]
+            results = [future.result(timeout=5) for future in futures]
+        assert results[0] == results[1] and len(calls) == 2
+    finally:
+        redis_db.delete(*keys)
+        STATIONS_INSTANCES.pop("SharedStation")
@@ -0,0 +1,48 @@
+import io
+import os
+
+import pytest
+
+from sunflower.core.covers import CoverCache
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+
+
+def test_store_and_evict(tmp_path):
+    cache = CoverCache(str(tmp_path), max_size=3 * (len(SVG) + 30))
+    keys = []
+    for number in range(3):
+        url = f"https://example.com/logo-{number}.svg"
+        keys.append(cache.get_key(url))
+        cache.store(keys[-1], url, SVG, "image/svg+xml")
+        # distinct last use times
+        os.utime(tmp_path / f"{keys[-1]}.src", (number, number))
+    path, mimetype = cache.find(keys[0])
+    assert mimetype == "image/svg+xml" and open(path, "rb").read() == SVG
+    assert cache.get("https://example.com/logo-0.svg") == f"/covers/{keys[0]}" # stored: not fetched again
+
+    # least recently used cover is evicted (first one was used again by get())
+    cache.store(cache.get_key("https://example.com/new.svg"), "https://example.com/new.svg", SVG, "image/svg+xml")
+    assert cache.find(keys[1]) is None
+    assert cache.find(keys[0]) is not None and cache.find(keys[2]) is not None
+
+
+def test_resize(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    cache = CoverCache(str(tmp_path), size=100)
+    for mode, color in (("RGB", (200, 0, 0)), ("RGBA", (0, 0, 200, 128)), ("P", 1)):
+        data = io.BytesIO()
+        Image.new(mode, (400, 200), color).save(data, "PNG")
+        url = f"https://example.com/cover-{mode}.png"
+        key = cache.get_key(url)
+        cache.store(key, url, data.getvalue(), "image/png")
+        path, mimetype = cache.find(key, "image/webp,*/*")
+        assert mimetype == "image/webp" and Image.open(path).size == (100, 50)
+        path, mimetype = cache.find(key, "image/*")
+        assert mimetype == "image/jpeg" and Image.open(path).mode == "RGB"
+
+    # images not decodable by Pillow are stored as is, if their type is known
+    cache.store("broken", "https://example.com/broken.png", b"not a png", "image/png")
+    assert cache.find("broken") == (str(tmp_path / "broken.png"), "image/png")
+    with pytest.raises(ValueError):
+        cache.store("unknown", "https://example.com/unknown", b"data", "application/octet-stream")
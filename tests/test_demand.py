@@ -0,0 +1,37 @@
+import socket
+
+from sunflower.core.demand import Demand, DemandMonitor
+
+
+def test_icecast_listeners(icecast_server):
+    monitor = DemandMonitor(icecast_server.status_url)
+    icecast_server.listeners = {"tournesol": 3}
+    assert monitor._get_listeners() == {"tournesol": 3}
+    icecast_server.listeners = {"tournesol": 0, "music": 2}
+    assert monitor._get_listeners() == {"tournesol": 0, "music": 2}
+    assert monitor._collect_listeners() is None, "Status page must be read in background"
+    monitor._listeners_future.result(timeout=5)
+    demand = monitor.refresh(["tournesol", "music"])
+    assert demand["tournesol"].listeners == 0 and demand["music"].listeners == 2
+
+    # status page is not read again before status_interval, and last counts are kept on failure
+    icecast_server.listeners = {"music": 5}
+    assert monitor._collect_listeners() == {"tournesol": 0, "music": 2} and monitor._listeners_future is None
+    monitor.icecast_status_url = "http://localhost:1/status-json.xsl"
+    monitor._listeners_request_time -= monitor.status_interval
+    monitor._collect_listeners()
+    monitor._listeners_future.exception(timeout=5)
+    assert monitor._collect_listeners() == {"tournesol": 0, "music": 2}
+    monitor._listeners_time -= monitor.status_max_age + 1
+    assert monitor._collect_listeners() is None, "Listeners must be unknown when counts are too old"
+
+def test_unknown_demand_is_not_idle():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    monitor = DemandMonitor(f"http://localhost:{port}/status-json.xsl", timeout=0.5)
+    monitor._collect_listeners()
+    monitor._listeners_future.exception(timeout=5)
+    assert monitor.refresh(["tournesol"])["tournesol"].listeners is None
+    assert not Demand(0, None).idle and not Demand(None, 0).idle
+    assert Demand(0, 0).idle and not Demand(1, 0).idle
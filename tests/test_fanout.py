@@ -0,0 +1,57 @@
+import threading
+
+from sunflower.core.fanout import ChannelState, UpdatesFanout, format_update_event, is_newer, parse_stream_entries
+
+
+def make_fanout():
+    fanout = UpdatesFanout(["tournesol", "music"])
+    fanout.start = lambda: None # states are updated by tests instead of Redis thread
+    fanout.update([ChannelState("tournesol", 1, {}, {"current_station": "a"}), ChannelState("music", 1, {}, {})])
+    return fanout
+
+
+def test_wait_for_change():
+    fanout = make_fanout()
+    assert fanout.wait_for_change("tournesol", 0, timeout=1).version == 1
+    assert fanout.wait_for_change("tournesol", 1, timeout=0.05) is None
+
+    timer = threading.Timer(0.05, fanout.update, [[ChannelState("tournesol", 2, {}, {"current_station": "b"})]])
+    timer.start()
+    state = fanout.wait_for_change("tournesol", 1, timeout=5)
+    timer.join()
+    assert state.version == 2 and state.info == {"current_station": "b"}
+    assert fanout._clients["tournesol"] == 0
+
+
+def test_listen():
+    fanout = make_fanout()
+    updates = fanout.listen(["tournesol", "music"], heartbeat_interval=0.05)
+    assert set(next(updates)) == {"tournesol", "music"}
+    assert fanout._clients == {"tournesol": 1, "music": 1}
+    assert next(updates) == {} # heartbeat
+    fanout.update([ChannelState("music", 2, {}, {})])
+    assert list(next(updates)) == ["music"]
+    updates.close()
+    assert fanout._clients == {"tournesol": 0, "music": 0}
+
+
+def test_update_events():
+    state = ChannelState.from_stream_entry("tournesol", b"1700000000000-1", {
+        b"version": b"3", b"metadata": b'{"type": "Musique"}', b"info": b'{"current_station": "a"}',
+    })
+    assert state.version == 3 and state.info == {"current_station": "a"} and state.event_id == "1700000000000-1"
+    assert format_update_event(state) == "id: 1700000000000-1\ndata: updated\n\n"
+    assert format_update_event(state, updated=False) == "id: 1700000000000-1\n\n"
+    assert format_update_event(state._replace(event_id=None), updated=False) == ":\n\n"
+
+    assert not is_newer(state, None)
+    assert not is_newer(state, "1700000000000-1")
+    assert is_newer(state, "1700000000000-0")
+    assert is_newer(state, "999999999999-5")
+    assert is_newer(state, "1.2") # id of another kind of event
+
+    # invalid entries are skipped by stream readers
+    fields = {b"version": b"3", b"metadata": b'{"type": "Musique"}', b"info": b"{}"}
+    entries = [(b"1-0", fields), (b"2-0", {**fields, b"version": b"not a version"}), (b"3-0", {b"version": b"4"})]
+    assert [state.event_id for state in parse_stream_entries("tournesol", entries)] == ["1-0"]
+    assert parse_stream_entries("tournesol", entries[1:]) == []
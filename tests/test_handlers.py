@@ -0,0 +1,98 @@
+import logging
+from datetime import datetime
+from time import time
+from types import SimpleNamespace
+
+import requests
+
+from sunflower.core import covers
+from sunflower.core.covers import CoverCache
+from sunflower.core.liquidsoap import LiquidsoapClient
+from sunflower.core.mixins import LiquidsoapMixin
+from sunflower.core.types import CardMetadata, MetadataType, Song
+from sunflower.handlers import AdsHandler, CoverProxyHandler
+
+station = SimpleNamespace(
+    station_name="RTL 2",
+    formated_station_name="rtl2",
+    html_formated_station_name="RTL 2",
+    station_thumbnail="/static/rtl2.png",
+)
+channel = SimpleNamespace(endpoint="music", current_station=station)
+
+
+def test_ads_handler(liquidsoap_server, monkeypatch):
+    monkeypatch.setattr(LiquidsoapMixin, "liquidsoap", LiquidsoapClient("localhost", liquidsoap_server.port))
+    logger = logging.getLogger(__name__)
+    handler = AdsHandler(channel)
+    songs = [Song(f"/backup/{i}.opus", f"Artist {i}", "", f"Title {i}", 180) for i in range(3)]
+    monkeypatch.setattr(handler, "_parse_songs", lambda: list(songs))
+    monkeypatch.setattr(handler, "_fetch_cover_and_link_on_deezer", lambda artist, album, title: ("https://deezer/cover.jpg", "https://deezer/track"))
+    latencies = []
+    monkeypatch.setattr(handler, "_store_latency", latencies.append)
+    info = CardMetadata("", "", "", "", "")
+
+    # next backup song is staged in background while station broadcasts music
+    now = datetime.now()
+    song_end = now.timestamp() - 5
+    metadata = {"type": MetadataType.MUSIC, "station": "RTL 2", "end": int(song_end)}
+    assert handler.process(metadata, info, logger, now) == (metadata, info)
+    # song is chosen in scheduler thread: snapshots taken during staging keep it
+    assert [song[0] for song in handler.get_state()["backup_songs"]] == [song.path for song in songs]
+    handler._staging_future.result(timeout=5)
+    handler.process(metadata, info, logger, now)
+    assert handler.staged_song.song == songs[0] and handler.staged_song.thumbnail == "https://deezer/cover.jpg"
+
+    # staged song is pushed when ads begin, latency is measured from end of previous song
+    ads = {"type": MetadataType.ADS, "station": "RTL 2", "end": 0}
+    metadata, info = handler.process(ads, info, logger, now)
+    assert metadata["title"] == "Title 0" and metadata["thumbnail_src"] == "https://deezer/cover.jpg"
+    assert "Publicité" in info.current_broadcast_summary
+    assert [uri for _, uri in liquidsoap_server.queues["music_custom_songs"]] == ["/backup/0.opus"]
+    assert latencies[0]["detection_latency"] >= time() - song_end - 1 >= 4
+    assert latencies[0]["tick_latency"] < latencies[0]["detection_latency"]
+
+    # without staged song, next song is played at once with station cover
+    handler._staging_future.result(timeout=5)
+    handler.staged_song, handler._staging_future = None, None
+    metadata, info = handler.process(ads, info, logger, now)
+    assert metadata["title"] == "Title 2" and metadata["thumbnail_src"] == station.station_thumbnail
+    assert abs(latencies[1]["detection_latency"] - latencies[1]["tick_latency"]) < 0.01
+
+
+def test_cover_proxy_handler(tmp_path, monkeypatch):
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+    requested = []
+
+    def get(url, timeout):
+        requested.append(url)
+        if "broken" in url:
+            raise requests.ConnectionError("unreachable")
+        return SimpleNamespace(content=svg, headers={"Content-Type": "image/svg+xml"}, raise_for_status=lambda: None)
+
+    monkeypatch.setattr(covers.requests, "get", get)
+    logger = logging.getLogger(__name__)
+    handler = CoverProxyHandler(channel, retry_delay=60)
+    handler.cache = CoverCache(str(tmp_path))
+    cover, broken = "https://example.com/cover.svg", "https://example.com/broken.svg"
+    metadata = {"type": MetadataType.MUSIC, "thumbnail_src": cover}
+    info = CardMetadata(broken, "", "", "", "")
+
+    # covers are fetched in background: remote urls are kept meanwhile, then
+    # published metadata is refreshed with local url
+    assert handler.process(metadata, info, logger, datetime.now()) == (metadata, info)
+    for future in list(handler._pending.values()):
+        future.exception(timeout=5)
+    refreshed_metadata, refreshed_info = handler.refresh(metadata, info, logger)
+    assert refreshed_metadata["thumbnail_src"] == f"/covers/{CoverCache.get_key(cover)}"
+    assert refreshed_info == info and broken in handler._failures
+    assert handler.refresh(refreshed_metadata, refreshed_info, logger) is None
+    metadata, info = handler.process(metadata, info, logger, datetime.now())
+    assert metadata == refreshed_metadata and info.current_thumbnail == broken
+
+    # failure is cached: broken cover is not requested again before retry delay
+    handler.process(metadata, info, logger, datetime.now())
+    assert sorted(requested) == [broken, cover] and not handler._pending
+    handler._failures[broken] = 0
+    handler.process(metadata, info, logger, datetime.now())
+    assert broken in handler._pending
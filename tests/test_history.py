@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+
+from sunflower.core.history import BroadcastHistory
+from sunflower.core.types import MetadataType
+
+
+def track(title, end):
+    return {b"type": b"Track", b"station": b"Radio Pycolore", b"artist": b"A", b"title": title, b"end": end}
+
+
+def test_downsample():
+    assert BroadcastHistory.compact({"type": MetadataType.MUSIC, "station": "Radio Pycolore", "title": "T", "album": "", "end": 10}) == {
+        "type": "Track", "station": "Radio Pycolore", "title": "T", "end": "10",
+    }
+    ads = {b"type": b"Ads", b"station": b"Radio Pycolore", b"end": b"30"}
+    entries = [
+        (b"1-0", track(b"T1", b"10")),
+        (b"2-0", track(b"T1", b"12")), # same song refreshed
+        (b"3-0", track(b"T2", b"20")),
+        (b"4-0", ads),
+        (b"5-0", {**ads, b"title": b"other ad", b"end": b"40"}),
+        (b"6-0", track(b"T2", b"50")), # same song, but not consecutive
+    ]
+    downsampled = BroadcastHistory.downsample(entries)
+    assert [entry_id for entry_id, _ in downsampled] == [b"1-0", b"3-0", b"4-0", b"6-0"]
+    assert downsampled[0][1][b"end"] == b"12" and downsampled[2][1][b"end"] == b"40"
+    assert entries[0][1][b"end"] == b"10"
+    assert BroadcastHistory.format_entry(downsampled[0]) == {
+        "start": 0.001, "type": "Track", "station": "Radio Pycolore", "artist": "A", "title": "T1", "end": 12,
+    }
+
+
+def test_record_and_range(redis_db):
+    history = BroadcastHistory("tournesol-test", detailed_days=0)
+    day = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    redis_db.delete(*(history.key((day + timedelta(days=n)).date()) for n in range(-1, 3)))
+    try:
+        for minutes, title in ((0, "T1"), (1, "T1"), (3, "T2"), (60 * 24 + 5, "T3")):
+            now = day + timedelta(minutes=minutes)
+            history.record({"type": MetadataType.MUSIC, "title": title, "end": int(now.timestamp()) + 60}, now)
+        assert [entry["title"] for entry in history.get_range(day.timestamp() + 120, (day + timedelta(days=2)).timestamp())] == ["T1", "T2", "T3"]
+        assert [entry["title"] for entry in history.get_range(day.timestamp() + 180, day.timestamp() + 300)] == ["T2"]
+    finally:
+        redis_db.delete(*(history.key((day + timedelta(days=n)).date()) for n in range(-1, 3)))
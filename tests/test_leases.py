@@ -0,0 +1,40 @@
+from sunflower.channels import tournesol
+from sunflower.core.bases import Channel, DynamicStation
+from sunflower.core.leases import LeaseManager
+from sunflower.core.scheduler import Scheduler
+from sunflower.stations import RTL2, PycolorePlaylistStation
+
+
+def test_leases_are_shared_between_workers(redis_db):
+    names = [f"test:object-{i}" for i in range(5)]
+    first = LeaseManager("test-worker-1", lease_duration=5)
+    second = LeaseManager("test-worker-2", lease_duration=5)
+    try:
+        assert first.rebalance(names) == set(names), "Single worker must own all objects"
+
+        # second worker joins: first one releases objects above fair share, after checkpointing them
+        second.rebalance(names)
+        released = []
+        first.rebalance(names, before_release=released.append)
+        assert len(released) == 2 and not first.owned & set(released)
+        owned_by_second = second.rebalance(names)
+        assert len(first.owned) == 3 and len(owned_by_second) == 2
+        assert first.owned.isdisjoint(owned_by_second)
+
+        # first worker leaves: second one takes everything
+        first.release_all()
+        assert second.rebalance(names) == set(names)
+    finally:
+        first.release_all()
+        second.release_all()
+
+
+def test_lease_groups():
+    music = Channel("music", timetable={tuple(range(7)): [("00:00", "00:00", RTL2)]})
+    pycolore = PycolorePlaylistStation()
+    assert isinstance(pycolore, DynamicStation) and PycolorePlaylistStation in tournesol.stations
+    groups = Scheduler._group_objects([music, tournesol, pycolore])
+    assert groups == {
+        "channel:music": [music],
+        "channel:tournesol+station:pycolore": [tournesol, pycolore],
+    }, "A channel and its dynamic stations must share a lease"
@@ -0,0 +1,50 @@
+import socket
+
+import pytest
+
+from sunflower.core.liquidsoap import LiquidsoapClient, LiquidsoapError
+
+
+def test_push_returns_request_id(liquidsoap_server):
+    client = LiquidsoapClient("localhost", liquidsoap_server.port)
+    assert client.push("tournesol_custom_songs", "/songs/a.opus") == 1
+    assert client.push("tournesol_custom_songs", "/songs/b.opus") == 2
+    assert liquidsoap_server.connections == 1, "Connection must be kept open"
+    assert liquidsoap_server.queues["tournesol_custom_songs"] == [(1, "/songs/a.opus"), (2, "/songs/b.opus")]
+    client.close()
+
+
+def test_pipelined_commands(liquidsoap_server):
+    client = LiquidsoapClient("localhost", liquidsoap_server.port)
+    replies = client.execute("a.push /songs/a.opus", "unknown", "b.push /songs/b.opus")
+    assert [reply.request_id for reply in replies] == [1, None, 2]
+    assert replies[1].lines[0].startswith("ERROR")
+    assert all(reply.duration >= 0 for reply in replies)
+
+    received = []
+    client.enqueue("a.push /songs/c.opus", received.append)
+    client.enqueue("a.push /songs/d.opus")
+    assert liquidsoap_server.commands[-1] == "b.push /songs/b.opus", "Queued commands must wait for flush()"
+    replies = client.flush()
+    assert [reply.request_id for reply in replies] == [3, 4]
+    assert received == replies[:1]
+    assert client.flush() == []
+    client.close()
+
+
+def test_reconnection(liquidsoap_server):
+    client = LiquidsoapClient("localhost", liquidsoap_server.port)
+    client.push("a", "/songs/a.opus")
+    liquidsoap_server.drop_connections()
+    assert client.push("a", "/songs/b.opus") == 2
+    assert liquidsoap_server.connections == 2
+    client.close()
+
+
+def test_unreachable_server():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    client = LiquidsoapClient("localhost", port, timeout=0.5)
+    with pytest.raises(LiquidsoapError):
+        client.push("a", "/songs/a.opus")
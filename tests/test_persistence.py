@@ -0,0 +1,183 @@
+import time
+
+import pytest
+import redis
+
+from sunflower.core.codecs import MSGPACK_MAGIC, JsonCodec, get_codec
+from sunflower.core.descriptors import PersistentAttribute
+from sunflower.core.functions import migrate_persistent_attributes
+from sunflower.core.persistence import CachedRedisBackend, MemoryBackend
+from sunflower.core.types import CardMetadata, ChannelView, MetadataEncoder, MetadataType, as_metadata_type
+
+
+class PersistentObject:
+    data_type = "test"
+    endpoint = "persistence"
+    backend = MemoryBackend()
+
+    metadata = PersistentAttribute("metadata", MetadataEncoder, as_metadata_type, backend=backend)
+    info = PersistentAttribute("info", backend=backend)
+
+    @info.post_get_hook
+    def info(self, data):
+        return None if data is None else CardMetadata(**data)
+
+    @info.pre_set_hook
+    def info(self, info):
+        return info._asdict()
+
+
+def test_memory_backend():
+    obj = PersistentObject()
+    assert obj.metadata is None
+    obj.metadata = {"type": MetadataType.MUSIC, "end": 0}
+    assert obj.metadata == {"type": MetadataType.MUSIC, "end": 0}
+    obj.info = CardMetadata("a", "b", "c", "d", "e")
+    assert obj.info == CardMetadata("a", "b", "c", "d", "e")
+    assert set(PersistentObject.backend.data) == {"sunflower:test:persistence:metadata", "sunflower:test:persistence:info"}
+
+    backend, codec = MemoryBackend(), JsonCodec()
+    backend.set("key", [1, 2], codec, expiration_delay=0.01)
+    assert backend.get("key", codec) == [1, 2]
+    time.sleep(0.02)
+    assert backend.get("key", codec) is None
+
+
+def test_default_backend(monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(PersistentAttribute, "default_backend", backend)
+    attribute = PersistentAttribute("data")
+    assert attribute.backend is backend
+    assert attribute.post_get_hook(lambda self, data: data).backend is backend
+
+
+def test_cached_redis_backend(redis_db):
+    key = "sunflower:test:persistence:cached"
+    backend, codec = CachedRedisBackend(), JsonCodec(object_hook=as_metadata_type)
+    backend.set(key, {"type": "Track"}, codec)
+    assert backend.get(key, codec) is backend.get(key, codec), "Repeated reads must hit the cache"
+    assert backend.get(key, codec) == {"type": MetadataType.MUSIC}
+
+    # writes of other processes invalidate cache
+    redis_db.set(key, '{"type": "Ads"}')
+    for _ in range(50):
+        if backend.get(key, codec)["type"] == MetadataType.ADS:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("Cache must be invalidated by keyspace notifications")
+
+    # own writes with expiration delay ("set" and "expire" events) don't invalidate cache
+    backend.set(key, {"type": "Track"}, codec, expiration_delay=60)
+    value = backend.get(key, codec)
+    time.sleep(0.2)
+    assert backend.get(key, codec) is value
+    redis_db.delete(key)
+
+
+def test_own_writes_notifications():
+    backend = CachedRedisBackend(notifications=False)
+    key = "sunflower:test:persistence:own"
+
+    def notify(event):
+        backend._handle_notification({"channel": f"__keyspace@0__:{key}".encode(), "data": event.encode()})
+
+    backend._cache[key] = entry = object()
+    backend._own_writes[(key, "set")] = [time.monotonic() + 5]
+    notify("set")
+    assert backend._cache[key] is entry and not backend._own_writes
+
+    # expected notification which never arrived doesn't hide writes of other processes
+    backend._own_writes[(key, "set")] = [time.monotonic() - 1]
+    notify("set")
+    assert key not in backend._cache and not backend._own_writes
+
+
+def test_cached_redis_backend_without_notifications():
+    class ManagedRedis:
+        """Redis server where keyspace notifications are disabled and CONFIG SET is not allowed."""
+        def __init__(self, events):
+            self.events, self.gets = events, 0
+
+        def config_get(self, name):
+            if self.events is None:
+                raise redis.ResponseError("unknown command 'CONFIG'")
+            return {name: self.events}
+
+        def get(self, key):
+            self.gets += 1
+            return b'{"type": "Track"}'
+
+    codec = JsonCodec(object_hook=as_metadata_type)
+    for events in ("", None):
+        backend = CachedRedisBackend()
+        backend._redis = ManagedRedis(events)
+        backend.get("sunflower:test:persistence:managed", codec)
+        backend.get("sunflower:test:persistence:managed", codec)
+        assert not backend.notifications and backend._redis.gets == 2, "Values must not be cached without notifications"
+
+def test_json_codec():
+    codec = JsonCodec(MetadataEncoder, as_metadata_type)
+    data = codec.encode({"type": MetadataType.ADS, "end": 0})
+    assert data == b'{"type": "Ads", "end": 0}', "Json codec must keep former format"
+    assert codec.decode(data) == {"type": MetadataType.ADS, "end": 0}
+    assert as_metadata_type({"type": ["not", "a", "type"]}) == {"type": ["not", "a", "type"]}
+
+
+def test_msgpack_codec():
+    pytest.importorskip("msgpack")
+    codec = get_codec("msgpack", MetadataEncoder, as_metadata_type)
+    metadata = {"type": MetadataType.MUSIC, "artist": "Artiste", "end": 1600000000}
+    data = codec.encode(metadata)
+    assert data.startswith(MSGPACK_MAGIC)
+    assert codec.decode(data) == metadata
+
+    # both codecs read both formats, so that existing keys can be migrated
+    json_codec = JsonCodec(MetadataEncoder, as_metadata_type)
+    assert json_codec.decode(data) == metadata
+    assert codec.decode(json_codec.encode(metadata)) == metadata
+    with pytest.raises(ValueError):
+        codec.decode(MSGPACK_MAGIC + b"\x99" + data[len(MSGPACK_MAGIC) + 1:])
+
+
+def test_migrate_persistent_attributes(redis_db):
+    pytest.importorskip("msgpack")
+
+    class MigratedObject:
+        data_type = "test"
+        endpoint = "migration"
+        metadata = PersistentAttribute("metadata", MetadataEncoder, as_metadata_type, codec=get_codec("msgpack", MetadataEncoder, as_metadata_type))
+
+    obj = MigratedObject()
+    key = MigratedObject.metadata.get_key(obj)
+    redis_db.set(key, '{"type": "Track"}', ex=100)
+    try:
+        assert migrate_persistent_attributes(obj) == 1
+        assert redis_db.get(key).startswith(MSGPACK_MAGIC) and 0 < redis_db.ttl(key) <= 100, "Expiration must be kept"
+        assert obj.metadata == {"type": MetadataType.MUSIC}
+        assert migrate_persistent_attributes(obj) == 0
+    finally:
+        redis_db.delete(key)
+
+
+def test_get_many():
+    first, second = PersistentObject(), PersistentObject()
+    second.endpoint = "other"
+    first.info = CardMetadata("a", "b", "c", "d", "e")
+    first.metadata = {"type": MetadataType.NONE, "end": 0}
+    values = PersistentAttribute.get_many([(first, "metadata"), (first, "info"), (second, "info")])
+    assert values == [{"type": MetadataType.NONE, "end": 0}, CardMetadata("a", "b", "c", "d", "e"), None]
+
+
+def test_views_batch_reads(redis_db):
+    redis_db.set("sunflower:channel:tournesol:metadata", '{"type": "Track"}')
+    redis_db.set("sunflower:channel:tournesol:info", '{"current_station": "a"}')
+    try:
+        view = ChannelView("tournesol").fetch()
+        redis_db.delete("sunflower:channel:tournesol:metadata")
+        assert view.metadata == {"type": MetadataType.MUSIC}, "Fetched values must be memoized"
+        views = ChannelView.get_many(["tournesol", "music"], "info")
+        assert views[0].info == {"current_station": "a"}
+        assert [view.endpoint for view in views] == ["tournesol", "music"]
+    finally:
+        redis_db.delete("sunflower:channel:tournesol:metadata", "sunflower:channel:tournesol:info")
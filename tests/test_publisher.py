@@ -0,0 +1,30 @@
+import gzip
+import json
+
+from sunflower.core.publisher import StaticPublisher
+
+
+def test_publish_changed_data(tmp_path):
+    publisher = StaticPublisher(str(tmp_path), channels=["tournesol"], stations=["pycolore"])
+    raw_data = {
+        "sunflower:channel:tournesol:metadata": b'{"type": "Track", "end": 0}',
+        "sunflower:channel:tournesol:info": b'{"current_station": "a"}',
+        "sunflower:channel:tournesol:version": b"1",
+        "sunflower:station:pycolore:data": None,
+    }
+    assert set(publisher.publish_raw_data(raw_data)) == {
+        "api/channels/tournesol/metadata/index.json",
+        "api/channels/tournesol/update/index.json",
+        "api/now-playing/index.json",
+        "api/stations/pycolore/index.json",
+    }
+    card_path = tmp_path / "api/channels/tournesol/update/index.json"
+    assert json.loads(card_path.read_bytes()) == {"current_station": "a"}
+    assert gzip.decompress((tmp_path / "api/channels/tournesol/update/index.json.gz").read_bytes()) == card_path.read_bytes()
+    assert not [path for path in tmp_path.rglob(".tmp-*")]
+
+    # only changed data is written again
+    assert publisher.publish_raw_data(raw_data) == []
+    raw_data["sunflower:channel:tournesol:version"] = b"2"
+    assert publisher.publish_raw_data(raw_data) == ["api/now-playing/index.json"]
+    assert json.loads((tmp_path / "api/now-playing/index.json").read_bytes())["version"] == "2"
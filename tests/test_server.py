@@ -0,0 +1,44 @@
+from sunflower import server, settings
+from sunflower.core.fanout import ChannelState
+from sunflower.core.types import MetadataType
+from sunflower.server import app, fanout
+
+
+def test_now_playing(redis_db):
+    keys = [f"sunflower:channel:{endpoint}:{field}" for endpoint in settings.CHANNELS for field in ("metadata", "info", "version")]
+    saved = dict(zip(keys, redis_db.mget(keys)))
+    try:
+        for endpoint in settings.CHANNELS:
+            redis_db.set(f"sunflower:channel:{endpoint}:metadata", '{"type": "Track", "end": 0}')
+            redis_db.set(f"sunflower:channel:{endpoint}:info", '{"current_station": "%s"}' % endpoint)
+            redis_db.set(f"sunflower:channel:{endpoint}:version", "1")
+        client = app.test_client()
+        response = client.get("/api/now-playing/")
+        assert set(response.json["channels"]) == set(settings.CHANNELS)
+        assert response.json["channels"][settings.CHANNELS[0]]["metadata"] == {"type": "Track", "end": 0}
+
+        etag = response.headers["ETag"]
+        assert client.get("/api/now-playing/", headers={"If-None-Match": etag}).status_code == 304
+        redis_db.incr(f"sunflower:channel:{settings.CHANNELS[0]}:version")
+        assert client.get("/api/now-playing/", headers={"If-None-Match": etag}).status_code == 200
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                redis_db.delete(key)
+            else:
+                redis_db.set(key, value)
+
+
+
+def test_json_metadata_types(monkeypatch):
+    # metadata types are serialized by jsonify(), without Redis: states are given to views
+    states = [ChannelState(endpoint, 1, {"type": MetadataType.MUSIC, "end": 0}, {}) for endpoint in settings.CHANNELS]
+    get_now_playing = server.get_now_playing
+    monkeypatch.setattr(server, "get_now_playing", lambda: get_now_playing(states))
+    monkeypatch.setattr(fanout, "wait_for_change", lambda endpoint, version, timeout: states[0])
+    client = app.test_client()
+    response = client.get("/api/now-playing/")
+    assert response.status_code == 200
+    assert response.json["channels"][settings.CHANNELS[0]]["metadata"] == {"type": "Track", "end": 0}
+    response = client.get(f"/api/channels/{settings.CHANNELS[0]}/poll/?version=0")
+    assert response.status_code == 200 and response.json["metadata"]["type"] == "Track"
@@ -1,4 +1,14 @@
-from sunflower.core.bases import STATIONS_INSTANCES
+import json
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+
+from sunflower.channels import music
+from sunflower.core.bases import STATIONS_INSTANCES, StationRegistry, DynamicStation
+from sunflower.core.liquidsoap import LiquidsoapClient
+from sunflower.core.mixins import LiquidsoapMixin
+from sunflower.core.types import MetadataType, Song
 
 from sunflower.stations import (
     RTL2,
@@ -15,3 +25,144 @@ def test_instances_unique():
         for station_cls in (RTL2, FranceInfo, FranceInter, FranceMusique, FranceCulture, PycolorePlaylistStation):
             if name == station_cls.__name__:
                 assert inst is station_cls()
+
+def test_station_lifecycle():
+    calls = []
+
+    class LifecycleStation(DynamicStation):
+        station_name = "Lifecycle"
+        endpoint = "lifecycle"
+
+        def __init__(self):
+            super().__init__()
+            calls.append("init")
+
+        def setup(self):
+            calls.append("setup")
+
+        def start(self):
+            calls.append("start")
+
+        def stop(self):
+            calls.append("stop")
+
+    station = LifecycleStation()
+    assert LifecycleStation() is station
+    assert calls == ["init", "setup"], "Station must be constructed and setup once"
+
+    STATIONS_INSTANCES.start(station)
+    STATIONS_INSTANCES.start(LifecycleStation())
+    assert calls == ["init", "setup", "start"], "Station must be started once"
+
+    STATIONS_INSTANCES.stop_all()
+    STATIONS_INSTANCES.pop("LifecycleStation")
+    assert calls == ["init", "setup", "start", "stop"]
+    assert LifecycleStation() is not station, "Registry must be reusable after removal of an instance"
+
+    registry = StationRegistry()
+    other_station = registry.get_instance(LifecycleStation)
+    registry.start(other_station)
+    registry.reset()
+    assert not registry
+    assert calls[-3:] == ["setup", "start", "stop"]
+    STATIONS_INSTANCES.pop("LifecycleStation")
+
+@pytest.fixture
+def pycolore_station():
+    """New PycolorePlaylistStation instance, independent of the global registry."""
+    return StationRegistry().get_instance(PycolorePlaylistStation)
+
+def test_queue_ahead(liquidsoap_server, monkeypatch, pycolore_station):
+    monkeypatch.setattr(LiquidsoapMixin, "liquidsoap", LiquidsoapClient("localhost", liquidsoap_server.port))
+    logger = logging.getLogger(__name__)
+    queue_id = "radiopycolore_station_queue"
+
+    station = pycolore_station
+    station._songs_to_play += [Song(f"/songs/{i}.opus", str(i), "", str(i), 200) for i in range(20)]
+    now = datetime.now().replace(microsecond=0)
+    station._end_of_use = now + timedelta(hours=1)
+    channels_using = {station: [music]}
+
+    # songs are pushed in advance
+    station.process(logger, channels_using, now)
+    assert [uri for _, uri in liquidsoap_server.queues[queue_id]] == ["/songs/0.opus", "/songs/1.opus"]
+    assert station.get_metadata({}, logger, now)["type"] == MetadataType.WAITING_FOR_FOLLOWING
+
+    # song start is given by liquidsoap, queue is filled again
+    start = now - timedelta(seconds=30)
+    liquidsoap_server.play_next(queue_id, start)
+    station.process(logger, channels_using, now)
+    assert station._current_song.path == "/songs/0.opus"
+    assert station._current_song_end == start.timestamp() + 200
+    assert [uri for _, uri in liquidsoap_server.queues[queue_id]] == ["/songs/1.opus", "/songs/2.opus"]
+
+    # a late tick doesn't change anything to the queue
+    liquidsoap_server.play_next(queue_id, start + timedelta(seconds=200))
+    station.process(logger, channels_using, now + timedelta(seconds=300))
+    assert station._current_song.path == "/songs/1.opus"
+    assert station._current_song_end == start.timestamp() + 400
+    assert len(liquidsoap_server.queues[queue_id]) == 2
+    assert set(station._pushed_songs) == {2, 3, 4}
+
+    # queue is flushed when station goes off air, queued songs will be played later
+    station.process(logger, {station: []}, now + timedelta(seconds=310))
+    assert not liquidsoap_server.queues.get(queue_id) and queue_id not in liquidsoap_server.on_air
+    assert station._pushed_songs == {} and station._current_song is None
+    assert [song.path for song in station._songs_to_play][-2:] == ["/songs/2.opus", "/songs/3.opus"]
+
+def test_pycolore_metadata_snapshot(pycolore_station):
+    logger = logging.getLogger(__name__)
+    station = pycolore_station
+    station._current_song_end = 1234
+    fetch = station.prepare_metadata({}, logger, datetime.now())
+    # scheduler thread plays next song while metadata is built in background
+    station._current_song = Song("/songs/0.opus", "0", "", "0", 200)
+    station._current_song_end = 1434
+    assert fetch() == {"station": station.station_name, "type": MetadataType.WAITING_FOR_FOLLOWING, "end": 1234}
+
+def test_pycolore_state_roundtrip(monkeypatch, pycolore_station):
+    library = [Song(f"/songs/{i}.opus", str(i), "", str(i), 200) for i in range(4)]
+    monkeypatch.setattr("sunflower.stations.pycolore.parse_songs", lambda pattern: list(library))
+    station = pycolore_station
+    station._scan_library()
+    station._songs_to_play += library[1:]
+    station._current_song = library[0]
+    station._current_song_end = 1234.5
+    station._pushed_songs = {7: station._current_song}
+    station._current_request_id = 7
+    state = json.loads(json.dumps(station.get_state()))
+    assert state["songs_to_play"] == [1, 2, 3], "Songs to play must be stored as positions in library"
+
+    station.setup()
+    assert station.restore_state(state)
+    assert list(station._songs_to_play) == library[1:]
+    assert station._current_song == library[0] and station._current_song_end == 1234.5
+    assert station._pushed_songs == {7: station._current_song} and station._current_request_id == 7
+
+    assert not station.restore_state(dict(state, glob_pattern="/elsewhere/*.opus")), "State of another library must be rejected"
+    library.pop()
+    station.setup()
+    assert not station.restore_state(state), "State of a changed library must be rejected"
+    assert station._library == library, "Library scanned for restoration must be kept"
+
+def test_radiofrance_fallback_metadata():
+    logger = logging.getLogger(__name__)
+    station = FranceInter()
+    now = datetime.now()
+    start = int(now.timestamp()) - 600
+    station._cached_grid = [
+        {"start": start - 3600, "end": start, "title": "Le journal"},
+        {"start": start, "end": start + 3600, "diffusion": {
+            "title": "Diffusion", "url": "", "standFirst": " Résumé ", "show": {"title": "Émission", "url": ""},
+        }},
+        {"start": start + 3700, "end": start + 7200, "title": "Plus tard"},
+    ]
+    metadata = station.get_fallback_metadata({}, logger, now)
+    assert metadata["type"] == MetadataType.PROGRAMME and metadata["end"] == start + 3600
+    assert metadata["diffusion_title"] == "Diffusion" and metadata["diffusion_summary"] == "Résumé"
+    assert station.format_info(None, metadata, logger).current_show_title == "Émission"
+
+    metadata = station.get_fallback_metadata({}, logger, now + timedelta(seconds=3050))
+    assert metadata == {"station": station.station_name, "type": MetadataType.NONE, "end": start + 3700}
+    assert station.get_fallback_metadata({}, logger, now + timedelta(hours=3)) is None
+    station._cached_grid = []
@@ -1,4 +1,8 @@
-from sunflower.utils.functions import parse_songs, prevent_consecutive_artists
+import random
+
+from sunflower.utils.functions import parse_songs, prevent_consecutive_artists, space_artists
+from sunflower.utils.playlist import SongIndex
+from sunflower.core.library import PlaylistIndex, SearchIndex, tokenize
 from sunflower.core.types import Song
 import glob
 
@@ -26,3 +30,134 @@ def test_prevent_consecutive_artists():
     treated_songs = prevent_consecutive_artists(songs)
     for i in range(len(treated_songs)-1):
         assert treated_songs[i].artist != treated_songs[i+1].artist, "Two songs in a row have the same artist."
+
+def test_space_artists():
+    rng = random.Random(42)
+
+    # Check that all songs are kept and that the gap is respected
+    songs = [Song(str(i), "ABCDEFGHIJ"[i % 10], "", str(i), 0) for i in range(200)]
+    treated_songs = space_artists(songs, 3, rng=rng)
+    assert sorted(treated_songs) == sorted(songs), "A song has been kicked!"
+    for i in range(len(treated_songs)-3):
+        artists = [song.artist for song in treated_songs[i:i+4]]
+        assert len(set(artists)) == 4, "Two songs of the same artist are too close."
+
+    # Recently played artists are not played at the beginning of the list
+    treated_songs = space_artists(songs, 3, recent_artists=["A", "B", "C"], rng=rng)
+    assert treated_songs[0].artist not in ("A", "B", "C")
+    assert treated_songs[1].artist not in ("B", "C")
+    assert treated_songs[2].artist != "C"
+
+    # One artist dominates: all songs are kept and others artists are spread
+    songs = [Song(str(i), "A", "", str(i), 0) for i in range(20)] + [Song("b", "B", "", "b", 0), Song("c", "C", "", "c", 0)]
+    treated_songs = space_artists(songs, 2, rng=rng)
+    assert sorted(treated_songs) == sorted(songs), "A song has been kicked!"
+    assert treated_songs[0].artist == "A"
+
+def test_song_index():
+    songs = [Song(str(i), str(i), "", str(i), length) for (i, length) in enumerate((200, 300, 100, 250, 180, 240))]
+
+    # Songs are played in order if they fit
+    index = SongIndex(songs)
+    assert index.pop() == songs[0]
+    assert index.pop(1000) == songs[1]
+    assert list(index) == songs[2:]
+
+    # Longest fitting song is chosen when next one is too long
+    index = SongIndex(songs[1:], planning_horizon=0)
+    assert index.pop(260) == songs[3]
+    assert index.pop(50) is None
+    assert len(index) == 4
+
+    # End of slot is planned as closely as possible, and played in play order
+    index = SongIndex(songs)
+    assert index.plan(400) == [songs[1], songs[2]]
+    played = []
+    while (song := index.pop(420 - sum(song.length for song in played))) is not None:
+        played.append(song)
+    assert played == [songs[1], songs[2]]
+    assert list(index) == [songs[0], *songs[3:]], "Songs left out of the plan must stay next in play order"
+
+    # plan is kept while it fits, and made again when remaining time changes
+    index = SongIndex(songs)
+    assert index.pop(420) == songs[1]
+    index.extend([Song("6", "6", "", "6", 120)])
+    assert index.pop(120) == songs[2]
+    index = SongIndex(songs)
+    assert index.pop(420) == songs[1]
+    assert index.pop(90) is None
+
+
+def test_playlist_index_pages():
+    songs = [
+        Song("/a1", "b artist", None, "Title 2", 60),
+        Song("/a2", "A artist", "Album", "title 1", 60),
+        Song("/a3", "b artist", None, "title 1", 60),
+        Song("/a4", "C artist", None, "Title", 60),
+        Song("/a5", "B Artist", None, "Title 3", 60),
+    ]
+    index = PlaylistIndex("pycolore", page_size=2)
+    groups = index.group_by_artist(songs)
+    # artists are grouped case insensitively
+    assert [group["artist"] for group in groups] == ["A artist", "b artist", "C artist"]
+    assert [song["title"] for song in groups[1]["songs"]] == ["title 1", "Title 2", "Title 3"]
+    # groups are not split between pages
+    assert [[group["artist"] for group in page] for page in index.paginate(groups)] == [["A artist", "b artist"], ["C artist"]]
+
+
+def test_playlist_index_persistence(redis_db):
+    songs = [Song(f"/{i}", artist, None, f"Title {i}", 60) for i, artist in enumerate(("A", "B", "b", "C", "D"))]
+    index = PlaylistIndex("tournesol-test", page_size=2)
+    redis_db.delete(index.pages_key, index.artists_key, index.digest_key)
+    try:
+        assert index.persist(songs)
+        assert not index.persist(reversed(songs)), "Unchanged songs must not be indexed again"
+        first_page = index.get_page(1)
+        assert first_page["pages"] == 2 and first_page["artists_count"] == 4
+        assert [group["artist"] for group in first_page["artists"]] == ["A", "B"]
+        assert [group["artist"] for group in index.get_page(2)["artists"]] == ["C", "D"]
+        assert index.get_page(0) is None and index.get_page(3) is None
+        assert index.get_artist("B") == index.get_artist("b") == {"artist": "B", "page": 1, "songs": [
+            {"title": "Title 1", "album": None}, {"title": "Title 2", "album": None},
+        ]}
+        assert index.get_artist("E") is None
+
+        assert index.persist(songs[:1])
+        assert index.get_page(1)["pages"] == 1 and index.get_artist("B") is None
+    finally:
+        redis_db.delete(index.pages_key, index.artists_key, index.digest_key)
+
+
+def test_search_index_ranking():
+    songs = {
+        "1": {"artist": "Édith Piaf", "album": None, "title": "La Vie en rose"},
+        "2": {"artist": "Les Roses", "album": "Vie", "title": "Piano"},
+        "3": {"artist": "Other", "album": None, "title": "Rosemary"},
+    }
+    assert tokenize("Édith PIAF, l'été") == ["edith", "piaf", "l", "ete"]
+    members = sorted(set().union(*(SearchIndex.members(song_id, data) for song_id, data in songs.items())))
+
+    def search(query):
+        # same matches as ZRANGEBYLEX on sorted members, rarest word first
+        matches = {word: [member for member in members if member.startswith(word)] for word in set(tokenize(query))}
+        words = sorted(matches, key=lambda word: len(matches[word]))
+        return SearchIndex.rank(words, matches, limit=10)
+
+    assert search("rose") == ["1", "3", "2"] # exact title word, then title prefix, then artist prefix
+    assert search("vie ros") == ["1", "2"]
+    assert search("piaf edi") == ["1"]
+    assert search("unknown") == []
+
+
+def test_search_index_candidates(redis_db):
+    index = SearchIndex("test", max_candidates=2)
+    redis_db.delete(index.tokens_key, index.songs_key)
+    try:
+        index.update([Song(f"/{i}.opus", "Rose", None, f"Song {i}", 200) for i in range(5)] + [Song("/piaf.opus", "Édith Piaf", None, "La Vie en rose", 200)])
+        # "rose" has more members than max_candidates, but "piaf" gives candidates
+        found = index.search("rose piaf")
+        assert found.songs == [{"artist": "Édith Piaf", "album": None, "title": "La Vie en rose"}] and not found.truncated
+        assert len(index.search("rose").songs) == 2 and index.search("rose").truncated
+        assert index.search("rose unknown") == ([], False)
+    finally:
+        redis_db.delete(index.tokens_key, index.songs_key)